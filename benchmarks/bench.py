@@ -0,0 +1,259 @@
+"""
+bench.py — Benchmark dei percorsi caldi: scoring meteo, terreno e GPX.
+
+Ogni funzione viene eseguita su payload nel formato Open-Meteo (sintetici,
+o registrati con record_fixtures.py: vedi payloads.py) e sui GPX del
+repository, senza rete né Redis.
+Per ciascuna si misurano:
+  - tempo: mediana e minimo su N ripetizioni (perf_counter); il confronto
+    usa il minimo, il meno sensibile al rumore della macchina, ed è relativo:
+    la baseline viene riscalata sul rapporto tra un carico di calibrazione
+    misurato ora e lo stesso carico misurato quando è stata salvata, così una
+    macchina più lenta non fa fallire il confronto
+  - allocazioni: picco di memoria e byte/blocchi trattenuti in una singola
+    esecuzione (tracemalloc, in un giro separato per non falsare i tempi)
+
+I risultati vengono confrontati con benchmarks/baseline.json: se tempo o
+allocazioni superano la baseline oltre la tolleranza il comando esce con
+codice 1. Viene anche confrontata un'impronta dell'output, così si vede
+quando è cambiata la logica del modello e la baseline va rigenerata.
+
+  python benchmarks/bench.py                    # confronto con la baseline
+  python benchmarks/bench.py --update-baseline  # rigenera la baseline
+  python benchmarks/bench.py -k zone -n 50      # solo alcune funzioni
+
+Le funzioni confrontano gli orari con datetime.now(): durante il benchmark
+"adesso" è fissato a FROZEN_NOW e le fixture vengono traslate su quel giorno,
+così l'impronta dell'output non dipende da data e ora dell'esecuzione.
+"""
+
+import os
+import sys
+import copy
+import json
+import math
+import time
+import asyncio
+import hashlib
+import contextlib
+import argparse
+import statistics
+import tracemalloc
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+
+import main  # noqa: E402
+import log  # noqa: E402
+from payloads import load_fixtures  # noqa: E402
+
+HERE          = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(HERE, "baseline.json")
+
+TIME_TOLERANCE  = 0.30   # +30% sul minimo (le macchine variano)
+TIME_FLOOR_MS   = 0.5    # ...ma almeno +0.5ms: sulle funzioni da pochi µs il 30% è rumore
+CALIBRATION_N   = 20000  # iterazioni del carico di calibrazione (~qualche ms)
+ALLOC_TOLERANCE = 0.10   # +10% sul picco di memoria (deterministico)
+DEFAULT_REPEAT  = 30
+FROZEN_NOW      = datetime(2026, 10, 15, 6, 0)   # "adesso" per le funzioni misurate
+
+
+class _FrozenDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return FROZEN_NOW.replace(tzinfo=tz)
+
+
+@contextlib.contextmanager
+def frozen_now():
+    """datetime.now() in main.py restituisce FROZEN_NOW."""
+    original, main.datetime = main.datetime, _FrozenDatetime
+    try:
+        yield
+    finally:
+        main.datetime = original
+
+
+# ─── Casi ────────────────────────────────────────────────────────────────────
+
+def build_cases(fx: dict) -> dict:
+    """
+    {nome: (setup, fn)}: setup() prepara gli argomenti fuori dalla misura,
+    fn(*args) è la chiamata misurata.
+    """
+    hourly  = fx["hourly"]
+    history = fx["history"]
+    soil    = main.calculate_soil_dryness_5d(history)
+    windows = main.find_best_riding_windows(hourly)
+    soils   = {k: dict(soil) for k in main.ZONE_GEOLOGY}
+    zone    = next(iter(main.ZONE_GEOLOGY.values()))
+    loop    = asyncio.new_event_loop()
+
+    def ensure_gpx_all():
+        for g in main.GPX_FILES:
+            main._ensure_gpx_cached(g["key"], g["file"])
+
+    def clear_gpx():
+        main._GPX_CACHE.clear()
+        return ()
+
+    return {
+        "find_best_riding_windows": (
+            lambda: (hourly,), main.find_best_riding_windows),
+        "calculate_trail_conditions": (
+            lambda: (hourly,), main.calculate_trail_conditions),
+        "calculate_zone_matrix_5d": (
+            lambda: (hourly, soils),
+            lambda h, s: loop.run_until_complete(main.calculate_zone_matrix_5d(h, s))),
+        "project_soil_forecast_smi": (
+            lambda: (soil["rain_7d"], zone, hourly, copy.deepcopy(windows)),
+            main.project_soil_forecast_smi),
+        "adjust_windows_for_soil": (
+            lambda: (copy.deepcopy(windows), soil, hourly),
+            main.adjust_windows_for_soil),
+        "_ensure_gpx_cached": (
+            clear_gpx,
+            lambda: (ensure_gpx_all(), {k: len(v["track"]) for k, v in sorted(main._GPX_CACHE.items())})[1]),
+    }
+
+
+# ─── Misura ──────────────────────────────────────────────────────────────────
+
+def _fingerprint(value) -> str:
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
+def measure(setup, fn, repeat: int) -> dict:
+    # I log delle funzioni (es. "📍 GPX cachato") non devono sporcare l'output:
+    # scartati già in log._log, così non arrivano nemmeno alla coda del listener
+    previous = log.set_level("WARNING")
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            return _measure(setup, fn, repeat)
+    finally:
+        log.set_level(previous)
+
+
+def _measure(setup, fn, repeat: int) -> dict:
+    # Giro a vuoto: import pigri, cache di modulo, ecc.
+    output = fn(*setup())
+
+    times = []
+    for _ in range(repeat):
+        args  = setup()
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+
+    args = setup()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    fn(*args)
+    after  = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats  = after.compare_to(before, "lineno")
+    allocs = sum(s.size_diff for s in stats if s.size_diff > 0)
+    blocks = sum(s.count_diff for s in stats if s.count_diff > 0)
+
+    return {
+        "median_ms":   round(statistics.median(times) * 1000, 4),
+        "min_ms":      round(min(times) * 1000, 4),
+        "alloc_bytes": allocs,
+        "alloc_peak":  peak,
+        "alloc_blocks": blocks,
+        "output":      _fingerprint(output),
+    }
+
+
+def _calibration_work() -> int:
+    # Stesso genere di lavoro dei casi misurati: aritmetica float, dict, liste
+    acc, buckets = 0.0, {}
+    for i in range(CALIBRATION_N):
+        acc += math.sqrt(i) * 1.0001
+        buckets.setdefault(i % 97, []).append(acc)
+    return len(sorted(buckets, key=lambda k: buckets[k][-1]))
+
+
+def calibrate(repeat: int) -> float:
+    """Minimo (ms) del carico di calibrazione: misura la velocità della macchina."""
+    _calibration_work()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _calibration_work()
+        times.append(time.perf_counter() - start)
+    return round(min(times) * 1000, 4)
+
+
+def compare(name: str, result: dict, base: dict, speed: float = 1.0) -> list:
+    """
+    Restituisce i problemi rispetto alla baseline (lista vuota = ok).
+    speed: calibrazione attuale / calibrazione della baseline (>1 = macchina più lenta).
+    """
+    problems = []
+    if not base:
+        return problems
+    expected = base["min_ms"] * speed
+    if result["min_ms"] > max(expected * (1 + TIME_TOLERANCE), expected + TIME_FLOOR_MS):
+        problems.append(f"tempo {result['min_ms']:.3f}ms vs baseline {expected:.3f}ms (riscalata ×{speed:.2f})")
+    if result["alloc_peak"] > base["alloc_peak"] * (1 + ALLOC_TOLERANCE) + 1024:
+        problems.append(f"picco memoria {result['alloc_peak']}B vs baseline {base['alloc_peak']}B")
+    return problems
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark scoring/terreno/GPX")
+    parser.add_argument("-n", "--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("-k", "--filter", default="", help="esegue solo i casi che contengono questa stringa")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            baseline = json.load(f)
+
+    calibration = calibrate(args.repeat)
+    speed       = calibration / baseline["calibration_ms"] if baseline.get("calibration_ms") else 1.0
+    print(f"⏱️ Calibrazione: {calibration:.3f}ms (×{speed:.2f} rispetto alla baseline)")
+
+    with frozen_now():
+        cases = build_cases(load_fixtures(FROZEN_NOW))
+    results = {}
+    failed  = False
+    print(f"{'funzione':<28} {'mediana':>10} {'min':>10} {'alloc':>10} {'picco':>10}  esito")
+    for name, (setup, fn) in cases.items():
+        if args.filter and args.filter not in name:
+            continue
+        with frozen_now():
+            r = measure(setup, fn, args.repeat)
+        results[name] = r
+        base     = baseline.get("results", {}).get(name)
+        problems = [] if args.update_baseline else compare(name, r, base, speed)
+        if base and base.get("output") != r["output"]:
+            print(f"  ℹ️ {name}: output diverso dalla baseline (logica cambiata o fixture diverse)")
+        failed |= bool(problems)
+        status = "❌ " + "; ".join(problems) if problems else ("✅" if base else "—")
+        print(f"{name:<28} {r['median_ms']:>8.3f}ms {r['min_ms']:>8.3f}ms "
+              f"{r['alloc_bytes'] / 1024:>8.1f}KB {r['alloc_peak'] / 1024:>8.1f}KB  {status}")
+
+    if args.update_baseline:
+        merged = {**baseline.get("results", {}), **results}
+        with open(BASELINE_FILE, "w") as f:
+            json.dump({
+                "python":  sys.version.split()[0],
+                "updated": datetime.now().date().isoformat(),
+                "calibration_ms": calibration,
+                "results": merged,
+            }, f, indent=2)
+        print(f"💾 Baseline aggiornata: {BASELINE_FILE}")
+        return 0
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
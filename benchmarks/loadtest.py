@@ -0,0 +1,238 @@
+"""
+loadtest.py — Load test end-to-end dell'app con upstream finti.
+
+Avvia due processi:
+  - stubs.py: Open-Meteo, Strava, Google Sheets e Upstash finti, con latenza regolabile
+  - l'app (uvicorn, un solo worker), con ogni richiesta httpx verso l'esterno
+    dirottata sugli stub e lo storage puntato sull'emulatore Upstash
+
+poi genera traffico concorrente su ogni route, una route alla volta, e riporta
+throughput, p50/p95/p99 e chiamate upstream per page view (differenza dei
+contatori degli stub prima/dopo la fase, divisa per le richieste). I job di
+background dell'app (stato terreno, feedback) girano anche durante il test,
+quindi le chiamate per page view includono la loro piccola quota.
+
+  python benchmarks/loadtest.py --concurrency 20 --requests 200
+  python benchmarks/loadtest.py --routes /percorsi /terreno --wx-latency-ms 400
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+import tempfile
+import statistics
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_ROUTES = ["/dashboard-completa", "/percorsi", "/terreno", "/avvisi", "/segnala"]
+REPORT_KINDS   = ["fango", "albero", "allagato"]
+
+
+# ─── Processo app: dirotta gli upstream sugli stub ───────────────────────────
+
+def _redirect_upstreams(stub_url: str):
+    """Riscrive host/porta di ogni richiesta httpx (sync e async) verso lo stub."""
+    stub = httpx.URL(stub_url)
+
+    def rewrite(request: httpx.Request):
+        if (request.url.host, request.url.port) != (stub.host, stub.port):
+            request.headers["X-Upstream-Host"] = request.url.host
+            request.url = request.url.copy_with(scheme=stub.scheme, host=stub.host, port=stub.port)
+
+    orig_async = httpx.AsyncHTTPTransport.handle_async_request
+    orig_sync  = httpx.HTTPTransport.handle_request
+
+    async def handle_async(self, request):
+        rewrite(request)
+        return await orig_async(self, request)
+
+    def handle_sync(self, request):
+        rewrite(request)
+        return orig_sync(self, request)
+
+    httpx.AsyncHTTPTransport.handle_async_request = handle_async
+    httpx.HTTPTransport.handle_request            = handle_sync
+
+
+def serve_app(port: int, stub_url: str):
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    os.environ.update({
+        "STORAGE_BACKEND":          "upstash",
+        "UPSTASH_REDIS_REST_URL":   f"{stub_url}/upstash",
+        "UPSTASH_REDIS_REST_TOKEN": "loadtest",
+        "STRAVA_ACCESS_TOKEN":      "loadtest",
+        "STRAVA_REFRESH_TOKEN":     "loadtest",
+        "STRAVA_EXPIRES_AT":        str(int(time.time()) + 24 * 3600),
+    })
+    _redirect_upstreams(stub_url)
+
+    # L'app gira in ROOT (template e static sono relativi): i token Strava
+    # vanno in un file temporaneo, altrimenti load_tokens leggerebbe quelli
+    # veri e save_tokens li sovrascriverebbe con quelli del load test
+    import strava_client
+    strava_client.TOKEN_FILE = os.path.join(tempfile.mkdtemp(prefix="loadtest-"), "strava_tokens.json")
+
+    import uvicorn
+    import main
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+# ─── Generatore di carico ────────────────────────────────────────────────────
+
+def _percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+async def _hit(client: httpx.AsyncClient, route: str):
+    if route == "/segnala":
+        return await client.post(route, json={
+            "lat":         round(random.uniform(41.70, 41.78), 5),
+            "lon":         round(random.uniform(12.65, 12.80), 5),
+            "kind":        random.choice(REPORT_KINDS),
+            "description": "load test",
+        })
+    return await client.get(route)
+
+
+async def run_route(client: httpx.AsyncClient, route: str, total: int, concurrency: int) -> dict:
+    latencies, errors = [], 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                r = await _hit(client, route)
+                if r.status_code >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    wall = time.perf_counter() - start
+    return {
+        "requests":   len(latencies),
+        "errors":     errors,
+        "throughput": len(latencies) / wall if wall else 0.0,
+        "p50_ms":     _percentile(latencies, 50) * 1000,
+        "p95_ms":     _percentile(latencies, 95) * 1000,
+        "p99_ms":     _percentile(latencies, 99) * 1000,
+        "mean_ms":    statistics.mean(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+async def _stub_calls(stub_url: str) -> dict:
+    async with httpx.AsyncClient() as c:
+        return (await c.get(f"{stub_url}/_stub/stats")).json()["calls"]
+
+
+async def _wait_ready(url: str, timeout: float = 60.0):
+    deadline = time.time() + timeout
+    async with httpx.AsyncClient() as c:
+        while time.time() < deadline:
+            try:
+                r = await c.head(url)
+                if r.status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.3)
+    raise RuntimeError(f"{url} non risponde dopo {timeout:.0f}s")
+
+
+async def load_test(args) -> dict:
+    app_url  = f"http://127.0.0.1:{args.app_port}"
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    await _wait_ready(f"{stub_url}/_stub/stats")
+    await _wait_ready(f"{app_url}/")
+
+    results = {}
+    limits  = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=app_url, timeout=60.0, limits=limits) as client:
+        for route in args.routes:
+            # Riscaldamento: popola cache e stato, non entra nelle statistiche
+            await run_route(client, route, args.warmup, min(args.concurrency, max(1, args.warmup)))
+            before = await _stub_calls(stub_url)
+            stats  = await run_route(client, route, args.requests, args.concurrency)
+            after  = await _stub_calls(stub_url)
+            stats["upstream_per_view"] = {
+                name: round((after.get(name, 0) - before.get(name, 0)) / max(1, stats["requests"]), 3)
+                for name in sorted(set(after) | set(before))
+                if after.get(name, 0) != before.get(name, 0)
+            }
+            results[route] = stats
+            print(f"{route:<20} {stats['throughput']:>7.1f} req/s  p50 {stats['p50_ms']:>7.1f}ms  "
+                  f"p95 {stats['p95_ms']:>7.1f}ms  p99 {stats['p99_ms']:>7.1f}ms  "
+                  f"errori {stats['errors']:>3}  upstream/view {stats['upstream_per_view']}")
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Load test end-to-end con upstream finti")
+    parser.add_argument("--routes", nargs="+", default=DEFAULT_ROUTES)
+    parser.add_argument("-c", "--concurrency", type=int, default=10)
+    parser.add_argument("-n", "--requests", type=int, default=100, help="richieste misurate per route")
+    parser.add_argument("--warmup", type=int, default=5, help="richieste di riscaldamento per route")
+    parser.add_argument("--app-port", type=int, default=8181)
+    parser.add_argument("--stub-port", type=int, default=8190)
+    parser.add_argument("--wx-latency-ms", type=float, default=120)
+    parser.add_argument("--archive-latency-ms", type=float, default=250)
+    parser.add_argument("--strava-latency-ms", type=float, default=200)
+    parser.add_argument("--sheets-latency-ms", type=float, default=300)
+    parser.add_argument("--upstash-latency-ms", type=float, default=15)
+    parser.add_argument("--json", help="salva i risultati in questo file")
+    parser.add_argument("--app-log", help="salva stdout/stderr dell'app in questo file")
+    parser.add_argument("--serve-app", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    if args.serve_app:
+        serve_app(args.app_port, stub_url)
+        return 0
+
+    quiet = {"stdout": subprocess.DEVNULL, "stderr": subprocess.STDOUT}
+    stubs = subprocess.Popen([
+        sys.executable, os.path.join(HERE, "stubs.py"), "--port", str(args.stub_port),
+        "--wx-latency-ms", str(args.wx_latency_ms), "--archive-latency-ms", str(args.archive_latency_ms),
+        "--strava-latency-ms", str(args.strava_latency_ms), "--sheets-latency-ms", str(args.sheets_latency_ms),
+        "--upstash-latency-ms", str(args.upstash_latency_ms),
+    ], **quiet)
+    app_out = open(args.app_log, "w") if args.app_log else subprocess.DEVNULL
+    app = subprocess.Popen([
+        sys.executable, os.path.abspath(__file__), "--serve-app",
+        "--app-port", str(args.app_port), "--stub-port", str(args.stub_port),
+    ], stdout=app_out, stderr=subprocess.STDOUT)
+    try:
+        print(f"🏋️ Load test: {args.requests} richieste/route, concorrenza {args.concurrency}, 1 worker")
+        results = asyncio.run(load_test(args))
+    finally:
+        for p in (app, stubs):
+            p.terminate()
+            p.wait(timeout=10)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k != "serve_app"}, "results": results}, f, indent=2)
+        print(f"💾 Risultati salvati in {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
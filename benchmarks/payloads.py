@@ -0,0 +1,50 @@
+"""
+payloads.py — Fixture Open-Meteo, traslate sulla data di oggi.
+
+Se esistono payload registrati con record_fixtures.py (fixtures/forecast.json,
+fixtures/history.json) si usano quelli; altrimenti i payload sintetici del
+repository (fixtures/*.synthetic.json), costruiti a mano nel formato
+Open-Meteo e marcati "synthetic": true in _meta.
+
+Condivise da bench.py (benchmark delle funzioni) e stubs.py (upstream finti
+del load test).
+"""
+
+import os
+import json
+from datetime import datetime, timedelta
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def _fixture_path(name: str) -> str:
+    """Payload registrato se presente, altrimenti quello sintetico."""
+    recorded = os.path.join(FIXTURES, f"{name}.json")
+    return recorded if os.path.exists(recorded) else os.path.join(FIXTURES, f"{name}.synthetic.json")
+
+
+def _shift_days(values: list, delta: timedelta, fmt: str) -> list:
+    return [(datetime.strptime(v, fmt) + delta).strftime(fmt) for v in values]
+
+
+def load_fixtures(today: datetime = None) -> dict:
+    """
+    Carica le fixture e le trasla su oggi (primo giorno forecast = oggi, storico fino a ieri);
+    `today` sostituisce la data corrente (bench.py la fissa per avere output riproducibili).
+    Restituisce {"forecast": payload completo, "hourly": ..., "history": payload completo}.
+    """
+    with open(_fixture_path("forecast")) as f:
+        forecast = json.load(f)
+    with open(_fixture_path("history")) as f:
+        history = json.load(f)
+
+    today  = (today or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    first  = datetime.fromisoformat(forecast["hourly"]["time"][0]).replace(hour=0, minute=0)
+    delta  = timedelta(days=(today - first).days)
+    forecast["hourly"]["time"] = _shift_days(forecast["hourly"]["time"], delta, "%Y-%m-%dT%H:%M")
+
+    last   = datetime.fromisoformat(history["daily"]["time"][-1])
+    hdelta = timedelta(days=(today - timedelta(days=1) - last).days)
+    history["daily"]["time"] = _shift_days(history["daily"]["time"], hdelta, "%Y-%m-%d")
+
+    return {"forecast": forecast, "hourly": forecast["hourly"], "history": history}
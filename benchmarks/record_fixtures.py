@@ -0,0 +1,48 @@
+"""
+record_fixtures.py — Registra i payload Open-Meteo usati dai benchmark.
+
+Scarica forecast (icon_seamless, 3 giorni) e storico Archive (7 giorni) per
+il punto di riferimento e li salva in benchmarks/fixtures/forecast.json e
+history.json. Il repository contiene solo payload sintetici
+(*.synthetic.json): i file registrati, se presenti, hanno la precedenza
+(vedi payloads.py). Dopo una registrazione l'impronta dell'output cambia e va
+aggiornata anche la baseline:
+
+  python benchmarks/record_fixtures.py
+  python benchmarks/bench.py --update-baseline
+"""
+
+import os
+import sys
+import json
+import asyncio
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from weather_client import fetch_weather, fetch_weather_history
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Monte Cavo: stessa località di default della dashboard
+LAT, LON = 41.7486, 12.7064
+
+
+async def record():
+    forecast, history = await asyncio.gather(
+        fetch_weather(LAT, LON),
+        fetch_weather_history(LAT, LON, 7),
+    )
+    for name, payload, source in (
+        ("forecast.json", forecast, "Open-Meteo forecast (icon_seamless)"),
+        ("history.json",  history,  "Open-Meteo archive"),
+    ):
+        payload = {"_meta": {"source": source, "lat": LAT, "lon": LON, "recorded": date.today().isoformat()}, **payload}
+        with open(os.path.join(FIXTURES, name), "w") as f:
+            json.dump(payload, f, indent=1, ensure_ascii=False)
+        print(f"💾 {name} registrato")
+
+
+if __name__ == "__main__":
+    os.makedirs(FIXTURES, exist_ok=True)
+    asyncio.run(record())
@@ -0,0 +1,212 @@
+"""
+stubs.py — Upstream finti per il load test (Open-Meteo, Strava, Google Sheets, Upstash).
+
+Un unico server locale risponde al posto di tutti gli upstream. L'app, avviata
+da loadtest.py, riscrive ogni richiesta httpx verso questo server aggiungendo
+l'header X-Upstream-Host con l'host originale; qui si smista per host.
+Upstash è l'emulatore di upstash_emulator.py montato su /upstash.
+
+Ogni upstream ha una latenza regolabile e un contatore di chiamate, letto da
+loadtest.py per calcolare le chiamate upstream per page view:
+
+  python benchmarks/stubs.py --port 8090 --wx-latency-ms 150 --strava-latency-ms 250
+  GET /_stub/stats   → {"calls": {"open-meteo": 12, "strava": 3, ...}}
+"""
+
+import os
+import sys
+import json
+import random
+import asyncio
+import argparse
+import xml.etree.ElementTree as ET
+from collections import Counter
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+
+import upstash_emulator
+from payloads import load_fixtures
+
+UPSTREAMS = {
+    "api.open-meteo.com":         "open-meteo",
+    "archive-api.open-meteo.com": "open-meteo-archive",
+    "www.strava.com":             "strava",
+    "docs.google.com":            "google-sheets",
+}
+
+app = FastAPI(title="Upstream stubs")
+app.mount("/upstash", upstash_emulator.app)
+
+_latency = {"open-meteo": 0.0, "open-meteo-archive": 0.0, "strava": 0.0, "google-sheets": 0.0}
+_jitter  = 0.2          # ±20% sulla latenza di ogni upstream
+_calls   = Counter()
+_fx      = load_fixtures()
+
+CSV_ETAG = '"loadtest-v1"'
+CSV_BODY = (
+    "Informazioni cronologiche,Sentiero / Località,Condizione,Foto,Dettagli\n"
+    + "".join(
+        f"{(datetime.now() - timedelta(hours=h)).strftime('%d/%m/%Y %H.%M.%S')},"
+        f"Sentiero {h},Fango,,Tratto {h} scivoloso\n"
+        for h in range(30, 0, -1)
+    )
+)
+
+
+# ─── Strava: segmenti costruiti sul primo GPX del repository ─────────────────
+
+def _encode_polyline(coords: list) -> str:
+    out, prev = [], (0, 0)
+    for lat, lon in coords:
+        cur = (round(lat * 1e5), round(lon * 1e5))
+        for delta in (cur[0] - prev[0], cur[1] - prev[1]):
+            v = ~(delta << 1) if delta < 0 else delta << 1
+            while v >= 0x20:
+                out.append(chr((0x20 | (v & 0x1F)) + 63))
+                v >>= 5
+            out.append(chr(v + 63))
+        prev = cur
+    return "".join(out)
+
+
+def _gpx_coords() -> list:
+    with open(os.path.join(ROOT, "gpx_config.json")) as f:
+        config = json.load(f)
+    for g in config if isinstance(config, list) else config.get("gpx_files", []):
+        path = os.path.join(ROOT, g["file"])
+        if not os.path.exists(path):
+            continue
+        pts = [el for el in ET.parse(path).iter() if el.tag.endswith("trkpt")]
+        return [[float(p.get("lat")), float(p.get("lon"))] for p in pts[::10]]
+    return [[41.75 + i * 1e-4, 12.70 + i * 1e-4] for i in range(400)]
+
+
+def _build_segments(n: int = 12) -> list:
+    coords = _gpx_coords()
+    size   = max(5, len(coords) // (n + 1))
+    segs   = []
+    for i in range(n):
+        part = coords[i * size:(i + 1) * size] or coords[:size]
+        segs.append({
+            "id":                   900000 + i,
+            "name":                 f"Segmento di prova {i + 1}",
+            "distance":             1200.0 + 100 * i,
+            "average_grade":        4.5,
+            "maximum_grade":        12.0,
+            "total_elevation_gain": 80.0,
+            "start_latlng":         part[0],
+            "end_latlng":           part[-1],
+            "map":                  {"polyline": _encode_polyline(part)},
+        })
+    return segs
+
+
+_SEGMENTS = _build_segments()
+
+
+def _segment_detail(seg_id: int) -> dict:
+    base = next((s for s in _SEGMENTS if s["id"] == seg_id), _SEGMENTS[0])
+    return {
+        **base,
+        "effort_count":  random.randint(1000, 20000),
+        "athlete_count": random.randint(200, 4000),
+        "xoms":          {"kom": "3:21"},
+        "athlete_segment_stats": {"pr_elapsed_time": 245, "pr_date": "2026-09-01", "effort_count": 7},
+        "local_legend":  {"title": "Rider", "effort_count": "12"},
+    }
+
+
+# ─── Risposte per upstream ───────────────────────────────────────────────────
+
+def _forecast():
+    return JSONResponse(_fx["forecast"])
+
+
+def _archive(request: Request):
+    """Storico per l'intervallo richiesto, ciclando i valori della fixture."""
+    daily = _fx["history"]["daily"]
+    try:
+        start = datetime.fromisoformat(request.query_params["start_date"]).date()
+        end   = datetime.fromisoformat(request.query_params["end_date"]).date()
+    except Exception:
+        return JSONResponse(_fx["history"])
+    n = (end - start).days + 1
+    cycle = lambda key: [daily[key][i % len(daily[key])] for i in range(n)]
+    out = {k: cycle(k) for k in daily if k != "time"}
+    out["time"] = [(start + timedelta(days=i)).isoformat() for i in range(n)]
+    return JSONResponse({**_fx["history"], "daily": out})
+
+
+def _strava(path: str):
+    headers = {"X-RateLimit-Limit": "1000,10000", "X-RateLimit-Usage": "1,1"}
+    if path.startswith("oauth/token"):
+        return JSONResponse({"access_token": "loadtest", "refresh_token": "loadtest",
+                             "expires_at": int(datetime.now().timestamp()) + 6 * 3600})
+    if path.startswith("api/v3/segments/starred"):
+        return JSONResponse(_SEGMENTS, headers=headers)
+    if path.startswith("api/v3/segments/"):
+        parts = path.split("/")
+        if len(parts) > 4:      # leaderboard e simili
+            return JSONResponse({"entries": []}, headers=headers)
+        return JSONResponse(_segment_detail(int(parts[3])), headers=headers)
+    if path.startswith("api/v3/clubs/"):
+        return JSONResponse([] if path.endswith("activities") else {"name": "Loadtest club"}, headers=headers)
+    return JSONResponse({"message": "Record Not Found"}, status_code=404)
+
+
+def _sheets(request: Request):
+    if request.headers.get("If-None-Match") == CSV_ETAG:
+        return Response(status_code=304)
+    return PlainTextResponse(CSV_BODY, headers={"ETag": CSV_ETAG})
+
+
+@app.get("/_stub/stats")
+async def stub_stats():
+    return {"calls": {**dict(_calls), "upstash": upstash_emulator._stats["requests"]}}
+
+
+@app.api_route("/{path:path}", methods=["GET", "POST"])
+async def upstream(path: str, request: Request):
+    name = UPSTREAMS.get(request.headers.get("X-Upstream-Host", ""), "unknown")
+    _calls[name] += 1
+    latency = _latency.get(name, 0.0)
+    if latency:
+        await asyncio.sleep(latency * random.uniform(1 - _jitter, 1 + _jitter) / 1000)
+
+    if name == "open-meteo":
+        return _forecast()
+    if name == "open-meteo-archive":
+        return _archive(request)
+    if name == "strava":
+        return _strava(path)
+    if name == "google-sheets":
+        return _sheets(request)
+    return JSONResponse({"error": f"upstream non previsto: {request.headers.get('X-Upstream-Host')}"}, status_code=502)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Upstream finti per il load test")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--wx-latency-ms", type=float, default=120)
+    parser.add_argument("--archive-latency-ms", type=float, default=250)
+    parser.add_argument("--strava-latency-ms", type=float, default=200)
+    parser.add_argument("--sheets-latency-ms", type=float, default=300)
+    parser.add_argument("--upstash-latency-ms", type=float, default=15)
+    args = parser.parse_args()
+
+    _latency.update({
+        "open-meteo":         args.wx_latency_ms,
+        "open-meteo-archive": args.archive_latency_ms,
+        "strava":             args.strava_latency_ms,
+        "google-sheets":      args.sheets_latency_ms,
+    })
+    upstash_emulator._config.update({"latency_ms": args.upstash_latency_ms, "jitter_ms": args.upstash_latency_ms * 0.4})
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
@@ -1,10 +1,26 @@
 """
-cache.py — Cache Redis (Upstash) per dati meteo e Strava.
+cache.py — Cache Redis (Upstash / Redis / in-process, vedi storage.py) per dati meteo e Strava.
 
 Strategia TTL:
-  - forecast meteo : 60 min  (ICON aggiorna ogni 3h, 60min è ottimale)
-  - storico meteo  : 2 ore   (Archive API ha lag ~2gg, inutile refreshare spesso)
-  - segmenti Strava: 6 ore   (lista segmenti starred quasi statica)
+  - meteo, per namespace (soft / hard / stale-if-error):
+      forecast : 60 min / 3 ore / +12 ore  (ICON aggiorna ogni 3h)
+      storico  : 2 ore  / 12 ore / +48 ore (Archive API ha lag ~2gg)
+    Entro soft la voce è fresca. Tra soft e hard viene servita subito e
+    aggiornata in background (un refresh per chiave). Oltre hard si richiama
+    l'upstream in linea, ma se fallisce si serve l'ultima copia buona fino a
+    hard + stale-if-error, poi la chiave scade.
+  - Strava, per segmento (stale-while-revalidate):
+      lista starred      : 30 min soft / 6 ore hard
+      geometria/metadati : 30 giorni (non cambiano mai)
+      contatori/PR/KOM   : 6 ore soft / 7 giorni hard
+    Tra soft e hard il dato viene servito subito e aggiornato in background.
+
+Invalidazione meteo per generazione: le voci wx:* sono salvate come
+{"g": generazione, "v": valore} e lette insieme al contatore gen:wx nella
+stessa pipeline. "Invalida tutta la cache meteo" è un solo INCR gen:wx: le
+voci della generazione precedente diventano miss e scadono col loro TTL.
+Per il resto (Strava, elenco chiavi) si usa SCAN a cursore e UNLINK in
+blocchi pipelined, mai KEYS (O(N), blocca Redis).
 
 Fix critico: _redis_set usa POST /pipeline con JSON nel body (non nell'URL).
 Il vecchio approccio GET /set/key/value rompeva l'URL con dati JSON complessi.
@@ -12,53 +28,53 @@ Il vecchio approccio GET /set/key/value rompeva l'URL con dati JSON complessi.
 
 import os
 import json
+import time
 import asyncio
-import httpx
+import contextvars
 from datetime import datetime
 
-UPSTASH_URL   = os.getenv("UPSTASH_REDIS_REST_URL", "").rstrip("/")
-UPSTASH_TOKEN = os.getenv("UPSTASH_REDIS_REST_TOKEN", "")
-
-# TTL in secondi
-TTL_FORECAST = 60 * 60        # 60 minuti (ICON aggiorna ogni 3h)
-TTL_HISTORY  = 2  * 60 * 60   # 2 ore
-TTL_STRAVA   = 6  * 60 * 60   # 6 ore
-
-# Semaforo: max 2 chiamate simultanee all'Archive API (evita 429)
-_ARCHIVE_SEMAPHORE = asyncio.Semaphore(2)
-
-
-# ─── Upstash helpers ──────────────────────────────────────────────────────────
-
-def _headers():
-    return {
-        "Authorization": f"Bearer {UPSTASH_TOKEN}",
-        "Content-Type":  "application/json",
-    }
-
+import storage
+import upstream
+import memory
+from metrics import cache_result
+import log
+
+# TTL in secondi — meteo: (soft, hard), vedi docstring del modulo
+TTL_FORECAST = (60 * 60,     3  * 60 * 60)
+TTL_HISTORY  = (2 * 60 * 60, 12 * 60 * 60)
+STALE_IF_ERROR = {
+    "wx:forecast": 12 * 60 * 60,
+    "wx:history":  48 * 60 * 60,
+}
+
+# Strava per segmento: (soft, hard) — vedi docstring del modulo
+TTL_STRAVA_LIST    = (30 * 60,      6 * 60 * 60)
+TTL_STRAVA_STATIC  = 30 * 24 * 60 * 60
+TTL_STRAVA_DYNAMIC = (6 * 60 * 60,  7 * 24 * 60 * 60)
+TTL_STRAVA_RETRY   = 15 * 60      # segmento senza dettaglio: ritenta dopo 15 min
+
+WX_NAMESPACE   = "wx"
+CACHE_PREFIXES = ("wx:", "strava:", "gen:")   # chiavi mostrate in /admin/cache
+SCAN_COUNT     = 500      # chiavi esaminate per chiamata SCAN
+UNLINK_BATCH   = 500      # chiavi per comando UNLINK
+
+# Code per priorità verso Open-Meteo (vedi upstream.py). Archive API: concorrenza
+# adattiva, parte da 2 e sale finché non arrivano 429/timeout
+ARCHIVE_LIMITER  = upstream.limiter("archive-api.open-meteo.com", initial=2,
+                                    maximum=int(os.getenv("ARCHIVE_MAX_CONCURRENCY", "8")))
+FORECAST_LIMITER = upstream.limiter("api.open-meteo.com", initial=8, maximum=32)
+
+
+# ─── Storage helpers ──────────────────────────────────────────────────────────
+# Il backend (Upstash REST, Redis nativo, in-process) è scelto in storage.py
 
 def _pipeline(commands: list):
-    """Esegue più comandi Redis in una sola richiesta POST (JSON nel body)."""
-    if not UPSTASH_URL or not UPSTASH_TOKEN:
-        return None
-    try:
-        r = httpx.post(
-            f"{UPSTASH_URL}/pipeline",
-            headers=_headers(),
-            content=json.dumps(commands),
-            timeout=5.0,
-        )
-        r.raise_for_status()
-        return r.json()
-    except Exception as e:
-        print(f"⚠️ Cache pipeline error: {e}")
-        return None
+    """Esegue più comandi Redis in una sola richiesta. None su errore."""
+    return storage.pipeline(commands)
 
 
 def _redis_get(key: str):
     """Recupera un valore da Redis. Restituisce il valore deserializzato o None."""
-    if not UPSTASH_URL or not UPSTASH_TOKEN:
-        return None
     try:
         result = _pipeline([["GET", key]])
         if not result:
@@ -68,17 +84,15 @@ def _redis_get(key: str):
             return None
         return json.loads(raw)
     except Exception as e:
-        print(f"⚠️ Cache GET error [{key}]: {e}")
+        log.warning("⚠️ Cache GET error [{key}]: {error}", key=key, error=e)
         return None
 
 
 def _redis_set(key: str, value, ttl: int):
     """
     Salva un valore in Redis con TTL (secondi).
-    Usa pipeline POST — il JSON va nel body, non nell'URL.
+    Usa pipeline — il JSON va nel body, non nell'URL.
     """
-    if not UPSTASH_URL or not UPSTASH_TOKEN:
-        return
     try:
         serialized = json.dumps(value, ensure_ascii=False)
         _pipeline([
@@ -86,105 +100,392 @@ def _redis_set(key: str, value, ttl: int):
             ["EXPIRE", key, ttl],
         ])
     except Exception as e:
-        print(f"⚠️ Cache SET error [{key}]: {e}")
+        log.warning("⚠️ Cache SET error [{key}]: {error}", key=key, error=e)
 
 
 def _coord_key(lat: float, lon: float) -> str:
     return f"{lat:.3f}_{lon:.3f}"
 
 
-# ─── Cache wrapper: meteo forecast ───────────────────────────────────────────
+# ─── Namespace con generazione ───────────────────────────────────────────────
 
-async def cached_fetch_weather(lat: float, lon: float, fetch_fn):
-    key = f"wx:forecast:{_coord_key(lat, lon)}"
-    cached = _redis_get(key)
-    if cached is not None:
-        print(f"  📦 Cache HIT forecast {_coord_key(lat, lon)}")
-        return cached
-
-    print(f"  🌐 Cache MISS forecast {_coord_key(lat, lon)} — chiamo Open-Meteo")
-    data = await fetch_fn(lat, lon)
-    _redis_set(key, data, TTL_FORECAST)
+def _generation_key(namespace: str) -> str:
+    return f"gen:{namespace}"
+
+
+def _ns_get(namespace: str, key: str) -> tuple:
+    """Legge key e la generazione del namespace in un solo round trip → (voce {"v", "ts"} o None, generazione)."""
+    results = _pipeline([["GET", _generation_key(namespace)], ["GET", key]])
+    if not results or len(results) < 2:
+        return None, 0
+    try:
+        generation = int(results[0].get("result") or 0)
+        raw = results[1].get("result")
+        entry = json.loads(raw) if raw is not None else None
+    except Exception as e:
+        log.warning("⚠️ Cache GET error [{key}]: {error}", key=key, error=e)
+        return None, 0
+    # Voci di una generazione precedente (o nel vecchio formato senza "g") = miss
+    if not isinstance(entry, dict) or entry.get("g") != generation:
+        return None, generation
+    return entry, generation
+
+
+def _ns_set(key: str, value, ttl: int, generation: int):
+    """Salva value marcato con la generazione letta prima del fetch e l'istante di scrittura."""
+    _redis_set(key, {"g": generation, "v": value, "ts": time.time()}, ttl)
+
+
+def scan_keys(pattern: str) -> list:
+    """Tutte le chiavi che corrispondono a pattern, a blocchi di SCAN_COUNT (mai KEYS)."""
+    keys, cursor = [], "0"
+    while True:
+        results = _pipeline([["SCAN", cursor, "MATCH", pattern, "COUNT", SCAN_COUNT]])
+        if not results or "result" not in results[0]:
+            break
+        cursor, batch = results[0]["result"]
+        keys.extend(batch)
+        if str(cursor) == "0":
+            break
+    return keys
+
+
+def unlink_keys(keys: list) -> int:
+    """UNLINK (cancellazione non bloccante lato Redis) in blocchi, tutti in una pipeline."""
+    if not keys:
+        return 0
+    results = _pipeline([["UNLINK", *keys[i:i + UNLINK_BATCH]] for i in range(0, len(keys), UNLINK_BATCH)]) or []
+    return sum(r.get("result") or 0 for r in results if isinstance(r, dict))
+
+
+# ─── Cache meteo: stale-while-revalidate e stale-if-error ───────────────────
+
+_WX_REFRESHING: set = set()     # chiavi wx:* con refresh in background in corso
+_BACKGROUND_TASKS: set = set()  # riferimenti forti: il loop tiene solo riferimenti deboli ai task
+
+
+def _spawn(coro, priority: str = "prefetch"):
+    """
+    Task in background con un contesto nuovo: il suo tempo non finisce nella
+    richiesta che l'ha avviato e le sue chiamate upstream cedono il passo ai visitatori.
+    """
+    context = contextvars.Context()
+    context.run(upstream.set_priority, priority)
+    try:
+        task = asyncio.get_running_loop().create_task(coro, context=context)
+    except RuntimeError:
+        coro.close()
+        return
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_BACKGROUND_TASKS.discard)
+
+
+async def _refresh_wx(namespace: str, key: str, ttl: tuple, generation: int, fetch, limiter=None):
+    """Refresh in background di una voce servita stale. Se fallisce resta la copia vecchia."""
+    try:
+        if limiter is not None:
+            async with limiter:
+                data = await fetch()
+        else:
+            data = await fetch()
+        _ns_set(key, data, ttl[1] + STALE_IF_ERROR[namespace], generation)
+        log.info("  🔄 Cache {key} aggiornata in background", event="cache.refresh", key=key)
+    except Exception as e:
+        log.warning("⚠️ Refresh {key} fallito, resta la copia in cache: {error}", key=key, error=e)
+    finally:
+        _WX_REFRESHING.discard(key)
+
+
+async def _cached_wx(namespace: str, key: str, label: str, upstream_name: str, ttl: tuple, fetch, limiter=None):
+    """
+    Lookup comune per wx:forecast e wx:history.
+    fetch: coroutine function senza argomenti che chiama l'upstream.
+    upstream_name: nome dell'upstream nei log (es. "Open-Meteo").
+    limiter: limiter di upstream.py attorno alle chiamate (coda per priorità);
+    dopo l'attesa si ricontrolla la cache, che intanto può essere stata scritta.
+    """
+    soft, hard = ttl
+    entry, generation = _ns_get(WX_NAMESPACE, key)
+    age = time.time() - entry.get("ts", 0) if entry is not None else None
+
+    if entry is not None and age <= soft:
+        cache_result(namespace, "hit", key=key)
+        log.info("  📦 Cache HIT {label}", event="cache.hit", label=label)
+        return entry["v"]
+
+    if entry is not None and age <= hard:
+        # Stale-while-revalidate: risposta immediata, un solo refresh per chiave
+        if key in _WX_REFRESHING:
+            cache_result(namespace, "coalesced", key=key)
+        else:
+            cache_result(namespace, "stale", key=key)
+            _WX_REFRESHING.add(key)
+            _spawn(_refresh_wx(namespace, key, ttl, generation, fetch, limiter))
+        log.info("  📦 Cache STALE {label} ({age:.0f}s) — refresh in background", event="cache.hit", label=label, age=age)
+        return entry["v"]
+
+    log.info("  🌐 Cache MISS {label} — chiamo {upstream}", event="cache.miss", label=label, upstream=upstream_name)
+    try:
+        if limiter is not None:
+            async with limiter:
+                again, generation = _ns_get(WX_NAMESPACE, key)
+                if again is not None and time.time() - again.get("ts", 0) <= soft:
+                    cache_result(namespace, "coalesced", key=key)
+                    log.info("  📦 Cache HIT {label} (dopo l'attesa)", event="cache.hit", label=label)
+                    return again["v"]
+                cache_result(namespace, "miss", key=key)
+                data = await fetch()
+        else:
+            cache_result(namespace, "miss", key=key)
+            data = await fetch()
+    except Exception as e:
+        if entry is None:
+            raise
+        # Stale-if-error: upstream giù, si serve l'ultima copia buona finché la chiave non scade
+        cache_result(namespace, "stale_if_error", key=key)
+        log.warning("⚠️ {upstream} non disponibile per {label}, servo la copia di {hours:.1f} ore fa: {error}",
+                    upstream=upstream_name, label=label, hours=age / 3600, error=e)
+        return entry["v"]
+    _ns_set(key, data, hard + STALE_IF_ERROR[namespace], generation)
     return data
 
 
-# ─── Cache wrapper: meteo storico ────────────────────────────────────────────
+async def cached_fetch_weather(lat: float, lon: float, fetch_fn):
+    coord = _coord_key(lat, lon)
+    return await _cached_wx("wx:forecast", f"wx:forecast:{coord}", f"forecast {coord}", "Open-Meteo",
+                            TTL_FORECAST, lambda: fetch_fn(lat, lon), limiter=FORECAST_LIMITER)
+
 
 async def cached_fetch_weather_history(lat: float, lon: float, days: int, fetch_fn):
-    key = f"wx:history:{_coord_key(lat, lon)}:d{days}"
-    cached = _redis_get(key)
-    if cached is not None:
-        print(f"  📦 Cache HIT history {_coord_key(lat, lon)} days={days}")
-        return cached
-
-    print(f"  🌐 Cache MISS history {_coord_key(lat, lon)} days={days} — chiamo Archive API")
-    async with _ARCHIVE_SEMAPHORE:
-        # Ricontrollo cache dentro il semaforo: un'altra coroutine potrebbe
-        # aver già scritto il risultato mentre aspettavamo il semaforo
-        cached = _redis_get(key)
-        if cached is not None:
-            print(f"  📦 Cache HIT history {_coord_key(lat, lon)} days={days} (post-semaphore)")
-            return cached
-        data = await fetch_fn(lat, lon, days)
-    _redis_set(key, data, TTL_HISTORY)
-    return data
+    coord = _coord_key(lat, lon)
+    return await _cached_wx("wx:history", f"wx:history:{coord}:d{days}", f"history {coord} days={days}", "Archive API",
+                            TTL_HISTORY, lambda: fetch_fn(lat, lon, days), limiter=ARCHIVE_LIMITER)
 
 
 # ─── Cache wrapper: Strava starred segments ───────────────────────────────────
+# Ogni segmento ha due chiavi:
+#   strava:segment:<id>:static   → geometria e metadati (TTL lungo)
+#   strava:segment:<id>:dynamic  → contatori, PR, KOM, local legend
+# più la lista starred in strava:starred_list. Le voci "soft" sono salvate come
+# {"v": valore, "ts": epoch} per sapere quando sono da rinfrescare.
+# _STRAVA_L1 è una copia in-process (funziona anche senza Upstash).
+
+STRAVA_LIST_KEY = "strava:starred_list"
+_STRAVA_L1: dict = {}                 # key → (valore, scadenza epoch)
+_STRAVA_REFRESHING: set = set()       # id segmenti / "list" con refresh in corso
+memory.track("strava:l1", lambda: _STRAVA_L1)
+
+
+def _segment_key(seg_id, part: str) -> str:
+    return f"strava:segment:{seg_id}:{part}"
+
+
+def _strava_get_many(keys: list) -> dict:
+    """Legge più chiavi: prima dalla copia in-process, poi una pipeline Redis."""
+    now    = time.time()
+    found  = {}
+    remote = []
+    for k in keys:
+        hit = _STRAVA_L1.get(k)
+        if hit and hit[1] > now:
+            found[k] = hit[0]
+        else:
+            remote.append(k)
+    if remote:
+        results = _pipeline([["GET", k] for k in remote]) or []
+        for k, res in zip(remote, results):
+            raw = res.get("result") if isinstance(res, dict) else None
+            if raw is None:
+                continue
+            try:
+                found[k] = json.loads(raw)
+            except Exception:
+                continue
+    return found
+
+
+def _strava_set_many(items: list):
+    """items: [(key, valore, ttl)] — scrive in-process + una sola pipeline Redis."""
+    now  = time.time()
+    cmds = []
+    for key, value, ttl in items:
+        _STRAVA_L1[key] = (value, now + ttl)
+        cmds.append(["SET", key, json.dumps(value, ensure_ascii=False)])
+        cmds.append(["EXPIRE", key, ttl])
+    if cmds:
+        _pipeline(cmds)
+
+
+def _store_segments(starred: list, details: list):
+    """Salva statico + dinamico per ogni segmento; i fallback solo per TTL_STRAVA_RETRY."""
+    from strava_client import _segment_from_base, split_segment
+    now   = time.time()
+    items = []
+    segments = []
+    for base, detail in zip(starred, details):
+        seg = detail or _segment_from_base(base)
+        static, dynamic = split_segment(seg)
+        items.append((_segment_key(seg["id"], "static"), static,
+                      TTL_STRAVA_STATIC if detail else TTL_STRAVA_RETRY))
+        items.append((_segment_key(seg["id"], "dynamic"), {"v": dynamic, "ts": now},
+                      TTL_STRAVA_DYNAMIC[1]))
+        segments.append(seg)
+    _strava_set_many(items)
+    return segments
+
+
+async def _refresh_segments(starred: list, fetch_details_fn):
+    """Refresh in background dei contatori dei segmenti indicati."""
+    try:
+        details = await fetch_details_fn(starred, priority="background")
+        # In background non sovrascriviamo dati buoni con il fallback
+        ok = [(s, d) for s, d in zip(starred, details) if d]
+        if ok:
+            _store_segments([s for s, _ in ok], [d for _, d in ok])
+        log.info("  🔄 Strava: aggiornati {n_ok}/{n_starred} segmenti in background",
+                 n_ok=len(ok), n_starred=len(starred))
+    except Exception as e:
+        log.warning("⚠️ Refresh segmenti Strava fallito: {error}", error=e)
+    finally:
+        for s in starred:
+            _STRAVA_REFRESHING.discard(s["id"])
+
+
+async def _refresh_starred_list(fetch_list_fn, fetch_details_fn):
+    """Refresh in background della lista starred (+ dettagli dei segmenti nuovi)."""
+    try:
+        starred = await fetch_list_fn(priority="background")
+        if starred is None:
+            return
+        _strava_set_many([(STRAVA_LIST_KEY, {"v": starred, "ts": time.time()}, TTL_STRAVA_LIST[1])])
+        known = _strava_get_many([_segment_key(s["id"], "static") for s in starred])
+        new   = [s for s in starred if _segment_key(s["id"], "static") not in known]
+        if new:
+            _store_segments(new, await fetch_details_fn(new, priority="background"))
+    except Exception as e:
+        log.warning("⚠️ Refresh lista Strava fallito: {error}", error=e)
+    finally:
+        _STRAVA_REFRESHING.discard("list")
 
-async def cached_fetch_starred_segments(fetch_fn):
-    key = "strava:starred_segments"
-    cached = _redis_get(key)
-    if cached is not None:
-        print(f"  📦 Cache HIT Strava starred segments")
-        return cached
-
-    print(f"  🌐 Cache MISS Strava starred segments — chiamo API Strava")
-    data = await fetch_fn()
-    if data:
-        _redis_set(key, data, TTL_STRAVA)
-    return data
+
+async def cached_starred_segments(fetch_list_fn, fetch_details_fn):
+    """
+    Segmenti starred con cache per-segmento e stale-while-revalidate.
+
+    1. Lista starred: se scaduta (soft) si serve la copia e si aggiorna in background;
+       se assente si scarica subito.
+    2. Diff con la cache: si scaricano in linea solo i segmenti mai visti
+       (o senza dettaglio); quelli con contatori vecchi vengono serviti
+       subito e rinfrescati in background.
+    """
+    now   = time.time()
+    entry = _strava_get_many([STRAVA_LIST_KEY]).get(STRAVA_LIST_KEY)
+
+    if entry is None:
+        cache_result("strava:list", "miss")
+        log.info("  🌐 Cache MISS Strava starred list — chiamo API Strava")
+        starred = await fetch_list_fn()
+        if not starred:
+            return []
+        _strava_set_many([(STRAVA_LIST_KEY, {"v": starred, "ts": now}, TTL_STRAVA_LIST[1])])
+    else:
+        starred = entry["v"]
+        if now - entry["ts"] <= TTL_STRAVA_LIST[0]:
+            cache_result("strava:list", "hit")
+        elif "list" in _STRAVA_REFRESHING:
+            cache_result("strava:list", "coalesced")
+        else:
+            cache_result("strava:list", "stale")
+            _STRAVA_REFRESHING.add("list")
+            _spawn(_refresh_starred_list(fetch_list_fn, fetch_details_fn))
+
+    keys   = [_segment_key(s["id"], p) for s in starred for p in ("static", "dynamic")]
+    cached = _strava_get_many(keys)
+
+    missing, stale, coalesced = [], [], 0
+    for s in starred:
+        static  = cached.get(_segment_key(s["id"], "static"))
+        dynamic = cached.get(_segment_key(s["id"], "dynamic"))
+        if static is None or dynamic is None:
+            missing.append(s)
+        elif now - dynamic["ts"] > TTL_STRAVA_DYNAMIC[0]:
+            if s["id"] in _STRAVA_REFRESHING:
+                coalesced += 1
+            else:
+                stale.append(s)
+    cache_result("strava", "hit", len(starred) - len(missing) - len(stale) - coalesced)
+    cache_result("strava", "miss", len(missing))
+    cache_result("strava", "stale", len(stale))
+    cache_result("strava", "coalesced", coalesced)
+
+    fresh = {}
+    if missing:
+        log.info("  🌐 Cache MISS Strava {n_missing}/{n_starred} segmenti — chiamo API Strava",
+                 n_missing=len(missing), n_starred=len(starred))
+        for seg in _store_segments(missing, await fetch_details_fn(missing)):
+            fresh[seg["id"]] = seg
+    if stale:
+        log.info("  📦 Cache STALE Strava {n_stale} segmenti — refresh in background", n_stale=len(stale))
+        _STRAVA_REFRESHING.update(s["id"] for s in stale)
+        _spawn(_refresh_segments(stale, fetch_details_fn))
+
+    segments = []
+    for s in starred:
+        if s["id"] in fresh:
+            segments.append(fresh[s["id"]])
+            continue
+        static  = cached[_segment_key(s["id"], "static")]
+        dynamic = cached[_segment_key(s["id"], "dynamic")]["v"]
+        segments.append({**static, **dynamic})
+    return segments
 
 
 # ─── Utility: invalidazione manuale ──────────────────────────────────────────
 
 def invalidate_weather_cache(lat: float, lon: float):
     coord = _coord_key(lat, lon)
-    _pipeline([
-        ["DEL", f"wx:forecast:{coord}"],
-        ["DEL", f"wx:history:{coord}:d5"],
-        ["DEL", f"wx:history:{coord}:d7"],
-    ])
+    unlink_keys([f"wx:forecast:{coord}", f"wx:history:{coord}:d5", f"wx:history:{coord}:d7"])
 
 
-def invalidate_strava_cache():
-    _pipeline([["DEL", "strava:starred_segments"]])
-    print("🗑️ Cache Strava invalidata")
+def invalidate_all_weather_cache() -> int:
+    """Invalida tutte le voci wx:* con un solo INCR. Restituisce la nuova generazione."""
+    results = _pipeline([["INCR", _generation_key(WX_NAMESPACE)]])
+    generation = results[0].get("result") if results else None
+    log.info("🗑️ Cache meteo invalidata (generazione {generation})", generation=generation)
+    return generation
 
 
-def get_cache_status() -> dict:
-    """Stato attuale della cache — usato da /admin/cache."""
-    if not UPSTASH_URL or not UPSTASH_TOKEN:
-        return {"error": "Upstash non configurato"}
+def invalidate_strava_cache() -> int:
+    """Elimina lista starred e tutte le chiavi per-segmento. Restituisce le chiavi eliminate."""
+    _STRAVA_L1.clear()
+    removed = unlink_keys([STRAVA_LIST_KEY, *scan_keys("strava:segment:*")])
+    log.info("🗑️ Cache Strava invalidata ({removed} chiavi)", removed=removed)
+    return removed
 
-    status = {"timestamp": datetime.now().isoformat(), "keys": []}
+
+def get_cache_status(cursor: str = "0", count: int = 200) -> dict:
+    """
+    Una pagina di chiavi cache con TTL — usato da /admin/cache.
+    Un solo SCAN da `count` chiavi per chiamata: "cursor" nel risultato è la
+    pagina successiva ("0" = finito).
+    """
+    status = {"timestamp": datetime.now().isoformat(), "backend": storage.get_backend().name,
+              "keys": [], "cursor": "0", "generations": {}}
     try:
-        # Lista chiavi wx:* e strava:*
         results = _pipeline([
-            ["KEYS", "wx:*"],
-            ["KEYS", "strava:*"],
+            ["SCAN", cursor, "COUNT", count],
+            ["GET", _generation_key(WX_NAMESPACE)],
         ])
         if not results:
             return status
-
-        wx_keys     = results[0].get("result", []) or []
-        strava_keys = results[1].get("result", []) or []
-        all_keys    = wx_keys + strava_keys
-
-        if all_keys:
-            ttl_cmds = [["TTL", k] for k in all_keys]
-            ttl_results = _pipeline(ttl_cmds)
-            for i, k in enumerate(all_keys):
+        next_cursor, page = results[0].get("result") or ["0", []]
+        status["cursor"] = str(next_cursor)
+        status["generations"][WX_NAMESPACE] = int(results[1].get("result") or 0)
+
+        keys = sorted(k for k in page if k.startswith(CACHE_PREFIXES))
+        if keys:
+            ttl_results = _pipeline([["TTL", k] for k in keys])
+            for i, k in enumerate(keys):
                 ttl = ttl_results[i].get("result", -1) if ttl_results else -1
                 status["keys"].append({
                     "key":         k,
@@ -1,27 +1,6 @@
-import os
-import httpx
 from datetime import datetime
 
-UPSTASH_URL   = os.getenv("UPSTASH_REDIS_REST_URL")
-UPSTASH_TOKEN = os.getenv("UPSTASH_REDIS_REST_TOKEN")
-
-def _headers():
-    return {"Authorization": f"Bearer {UPSTASH_TOKEN}"}
-
-def _redis(*args):
-    """
-    Esegue un comando Redis su Upstash REST API.
-    Esempio: _redis("INCR", "visits:total")
-    """
-    cmd = "/".join(str(a) for a in args)
-    url = f"{UPSTASH_URL}/{cmd}"
-    try:
-        r = httpx.get(url, headers=_headers(), timeout=5.0)
-        r.raise_for_status()
-        return r.json().get("result")
-    except Exception as e:
-        print(f"⚠️ Upstash Redis error: {e}")
-        return None
+import storage
 
 def increment_visit(page: str = "dashboard"):
     """
@@ -42,19 +21,21 @@ def increment_visit(page: str = "dashboard"):
     key_page       = f"visits:page:{page}"
     key_page_today = f"visits:page:{page}:day:{today}"
 
-    total       = _redis("INCR", key_total)
-    today_count = _redis("INCR", key_today)
-    month_count = _redis("INCR", key_month)
-    page_total  = _redis("INCR", key_page)
-    page_today  = _redis("INCR", key_page_today)
+    # Tutti gli INCR in una sola round-trip
+    results = storage.pipeline([["INCR", k] for k in (key_total, key_today, key_month, key_page, key_page_today)]) or []
+    total, today_count, month_count, page_total, page_today = (
+        [r.get("result") for r in results] + [None] * 5
+    )[:5]
 
     # TTL: giornaliero scade dopo 2 giorni, mensile dopo 35 giorni
+    expires = []
     if today_count == 1:
-        _redis("EXPIRE", key_today, 172800)       # 2 giorni
+        expires.append(["EXPIRE", key_today, 172800])       # 2 giorni
     if month_count == 1:
-        _redis("EXPIRE", key_month, 3024000)      # 35 giorni
+        expires.append(["EXPIRE", key_month, 3024000])      # 35 giorni
     if page_today == 1:
-        _redis("EXPIRE", key_page_today, 172800)  # 2 giorni
+        expires.append(["EXPIRE", key_page_today, 172800])  # 2 giorni
+    storage.pipeline(expires)
 
     return {
         "total":      total       or 0,
@@ -0,0 +1,186 @@
+"""
+feedbacks.py — Segnalazioni della community dal Google Form (CSV pubblicato).
+
+Il CSV non viene più scaricato ad ogni richiesta di /avvisi:
+  - un job in background lo riscarica ogni FEEDBACK_REFRESH secondi
+  - richiesta condizionale (If-None-Match / If-Modified-Since): se Google
+    risponde 304 non si scarica né si analizza nulla
+  - parsing incrementale: vengono elaborate solo le righe nuove in fondo al
+    foglio; un hash delle righe già viste rivela quelle modificate sul posto
+    (in quel caso si rielabora tutto)
+  - in memoria restano solo le ultime FEEDBACK_LIMIT voci
+  - /avvisi legge le ultime 10 voci già pronte; il "X ore fa" è calcolato
+    al momento della lettura, così resta corretto tra un refresh e l'altro
+"""
+
+import io
+import csv
+import hashlib
+import asyncio
+import httpx
+from datetime import datetime
+
+from metrics import track_upstream
+import memory
+import log
+
+CSV_URL = "https://docs.google.com/spreadsheets/d/e/2PACX-1vRdLrCbwcB8E9zjahAbON9zAHQJKH6_PHONk40EGhhzrF23jX0NA8oLd3xIk-Hj98-ZLq2CnST_Fpzq/pub?gid=2136983056&single=true&output=csv"
+
+FEEDBACK_REFRESH = 5 * 60   # secondi tra due controlli del CSV
+FEEDBACK_LIMIT   = 10       # voci mostrate in /avvisi
+COLD_START_WAIT  = 2.0      # al primo accesso si attende al massimo 2s il primo download
+
+_state = {
+    "etag":          None,
+    "last_modified": None,
+    "header":        None,   # intestazione CSV dell'ultimo parsing
+    "rows":          0,      # righe dati già elaborate
+    "digest":        None,   # hash di quelle righe, per accorgersi delle modifiche
+    "entries":       [],     # ultime FEEDBACK_LIMIT voci, in ordine di foglio
+    "loaded":        False,
+}
+_first_load: asyncio.Task = None
+memory.track("feedbacks", lambda: _state["entries"])
+
+
+def _time_ago(dt: datetime, timestamp: str, now: datetime) -> str:
+    if dt is None:
+        return timestamp or "Ora sconosciuta"
+    diff = now - dt
+    if diff.days == 0:
+        hours = diff.seconds // 3600
+        if hours == 0:
+            mins = diff.seconds // 60
+            return "Pochi minuti fa" if mins < 5 else f"{mins} min fa"
+        return "1 ora fa" if hours == 1 else f"{hours} ore fa"
+    if diff.days == 1:
+        return "Ieri"
+    if diff.days < 7:
+        return f"{diff.days} giorni fa"
+    return dt.strftime("%d/%m/%Y")
+
+
+def _parse_row(row: dict, cols: list):
+    """Una riga del form → voce, o None se manca la località."""
+    timestamp_col = next((c for c in cols if "Informazioni" in c or "cronolog" in c), cols[0] if cols else "")
+    location_col  = next((c for c in cols if "Sentiero" in c or "Localit" in c), cols[1] if len(cols) > 1 else "")
+    condition_col = next((c for c in cols if "Condizione" in c), cols[2] if len(cols) > 2 else "")
+    details_col   = next((c for c in cols if "Dettagli" in c), cols[4] if len(cols) > 4 else "")
+    timestamp = row.get(timestamp_col, "")
+    location  = row.get(location_col, "")
+    condition = row.get(condition_col, "")
+    details   = row.get(details_col, "")
+    if not location or not location.strip():
+        return None
+
+    dt = None
+    if timestamp:
+        try:
+            dt = datetime.strptime(timestamp.replace(".", ":"), "%d/%m/%Y %H:%M:%S")
+        except Exception as e:
+            log.warning("Errore parsing data '{timestamp}': {error}", timestamp=timestamp, error=e)
+
+    full_description = condition
+    if details and details.strip():
+        full_description += f" - {details}"
+    return {"location": location, "description": full_description, "timestamp": timestamp, "dt": dt}
+
+
+def _ingest(text: str):
+    """Aggiorna le voci dal CSV: elabora solo le righe successive a quelle già viste (se invariate)."""
+    reader = csv.reader(io.StringIO(text.strip()))
+    header = next(reader, None)
+    if not header:
+        return
+
+    # Intestazione cambiata (colonne aggiunte/rinominate) → rielabora tutto
+    if header != _state["header"]:
+        _state.update({"header": header, "rows": 0, "digest": None, "entries": []})
+
+    new_entries = []
+    rows   = 0
+    digest = hashlib.blake2b(digest_size=16)
+    for rows, values in enumerate(reader, 1):
+        digest.update("\x1f".join(values).encode() + b"\x1e")
+        if rows < _state["rows"]:
+            continue
+        if rows == _state["rows"]:
+            if digest.hexdigest() != _state["digest"]:
+                # Righe già viste modificate sul posto: rielabora tutto
+                _state.update({"header": None, "rows": 0, "digest": None, "entries": []})
+                return _ingest(text)
+            continue
+        entry = _parse_row(dict(zip(header, values)), header)
+        if entry:
+            new_entries.append(entry)
+
+    if rows < _state["rows"]:
+        # Righe eliminate dal foglio: gli indici non sono più affidabili
+        _state.update({"header": None, "rows": 0, "digest": None, "entries": []})
+        return _ingest(text)
+
+    _state["rows"]    = rows
+    _state["digest"]  = digest.hexdigest()
+    _state["entries"] = (_state["entries"] + new_entries)[-FEEDBACK_LIMIT:]
+    if new_entries:
+        log.info("  📝 Feedback form: {n_new} nuove segnalazioni", n_new=len(new_entries))
+
+
+async def refresh_feedbacks():
+    """Scarica il CSV solo se cambiato (richiesta condizionale) e aggiorna le voci."""
+    headers = {}
+    if _state["etag"]:
+        headers["If-None-Match"] = _state["etag"]
+    if _state["last_modified"]:
+        headers["If-Modified-Since"] = _state["last_modified"]
+    try:
+        with track_upstream("docs.google.com"):
+            async with httpx.AsyncClient(follow_redirects=True) as client:
+                response = await client.get(CSV_URL, headers=headers, timeout=10.0)
+        if response.status_code == 304:
+            return
+        response.raise_for_status()
+        _state["etag"]          = response.headers.get("ETag")
+        _state["last_modified"] = response.headers.get("Last-Modified")
+        _ingest(response.text)
+    except Exception as e:
+        log.warning("Errore recupero feedbacks: {error}", error=e)
+    finally:
+        _state["loaded"] = True
+
+
+async def feedback_loop():
+    """Job di background: refresh periodico del CSV."""
+    while True:
+        await refresh_feedbacks()
+        await asyncio.sleep(FEEDBACK_REFRESH)
+
+
+def start_feedback_loop():
+    """Avviato allo startup: il primo download parte subito."""
+    global _first_load
+    _first_load = asyncio.get_running_loop().create_task(feedback_loop())
+
+
+async def get_form_feedbacks() -> list:
+    """Ultime FEEDBACK_LIMIT segnalazioni, più recenti prima. Non attende Google."""
+    if not _state["loaded"]:
+        if _first_load is None:
+            await refresh_feedbacks()   # nessun job attivo (es. test): download diretto
+        else:
+            # Cold start: attende brevemente il primo download già in corso
+            waited = 0.0
+            while not _state["loaded"] and waited < COLD_START_WAIT:
+                await asyncio.sleep(0.1)
+                waited += 0.1
+
+    now = datetime.now()
+    return [
+        {
+            "location":    e["location"],
+            "description": e["description"],
+            "date":        _time_ago(e["dt"], e["timestamp"], now),
+            "timestamp":   e["timestamp"],
+        }
+        for e in _state["entries"][::-1][:FEEDBACK_LIMIT]
+    ]
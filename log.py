@@ -0,0 +1,145 @@
+"""
+log.py — Logger strutturato, non bloccante e campionato.
+
+Sostituisce i print() sui percorsi caldi (cache hit, segmenti Strava, errori
+Redis...). Le chiamate non scrivono su stdout: mettono il record in una coda
+e un thread dedicato (QueueListener) fa l'I/O, fuori dall'event loop.
+
+  log.info("📦 Cache HIT forecast {coord}", event="cache.hit", coord=coord)
+
+  - livello minimo: LOG_LEVEL (DEBUG, INFO, WARNING, ERROR; default INFO),
+    modificabile a runtime con set_level()
+  - formato: LOG_FORMAT=text (default, messaggi come prima) o json (una riga
+    JSON per evento: ts, level, event, msg e i campi passati)
+  - campionamento per evento: gli eventi frequenti ne scrivono solo una
+    frazione. Default in SAMPLING, sovrascrivibili con
+    LOG_SAMPLING="cache.hit=0.1,strava.segment=1"
+  - il messaggio viene formattato con i campi solo se l'evento viene scritto
+  - coda piena (picchi): il record viene scartato e contato, mai attesa
+"""
+
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from datetime import datetime
+
+LEVEL      = getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
+FORMAT     = os.getenv("LOG_FORMAT", "text").lower()
+QUEUE_SIZE = 10_000
+
+# Frazione di eventi scritti (1 = tutti)
+SAMPLING = {
+    "cache.hit":      0.05,
+    "strava.segment": 0.1,
+}
+for _item in filter(None, os.getenv("LOG_SAMPLING", "").split(",")):
+    _name, _, _rate = _item.partition("=")
+    try:
+        SAMPLING[_name.strip()] = float(_rate)
+    except ValueError:
+        pass
+
+_dropped = 0
+
+
+class _Formatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, "fields", {})
+        msg    = record.msg
+        if fields:
+            try:
+                msg = msg.format(**fields)
+            except Exception:
+                pass
+        if FORMAT != "json":
+            return msg
+        return json.dumps({
+            "ts":    datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "event": getattr(record, "event", None),
+            "msg":   msg,
+            **{k: v if isinstance(v, (int, float, bool, type(None))) else str(v) for k, v in fields.items()},
+        }, ensure_ascii=False)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Non blocca mai: a coda piena scarta il record."""
+
+    def prepare(self, record):
+        return record      # la formattazione avviene nel thread del listener
+
+    def enqueue(self, record):
+        global _dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped += 1
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """Scrive sul sys.stdout del momento, non su quello dell'import (redirect_stdout funziona)."""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+_queue   = queue.Queue(QUEUE_SIZE)
+_stream  = _StdoutHandler()
+_stream.setFormatter(_Formatter())
+_listener = logging.handlers.QueueListener(_queue, _stream)
+_listener.start()
+atexit.register(_listener.stop)
+
+_logger = logging.getLogger("castelli")
+_logger.setLevel(LEVEL)
+_logger.propagate = False
+_logger.addHandler(_DroppingQueueHandler(_queue))
+
+
+def _log(level: int, msg: str, event: str = None, **fields):
+    if level < LEVEL:
+        return
+    rate = SAMPLING.get(event, 1.0) if event else 1.0
+    if rate < 1.0 and random.random() >= rate:
+        return
+    _logger.log(level, msg, extra={"event": event, "fields": fields})
+
+
+def set_level(level):
+    """Livello minimo a runtime: logging.INFO o "INFO". Restituisce quello precedente."""
+    global LEVEL
+    previous = LEVEL
+    LEVEL = level if isinstance(level, int) else getattr(logging, str(level).upper(), LEVEL)
+    _logger.setLevel(LEVEL)
+    return previous
+
+
+def debug(msg: str, event: str = None, **fields):
+    _log(logging.DEBUG, msg, event, **fields)
+
+
+def info(msg: str, event: str = None, **fields):
+    _log(logging.INFO, msg, event, **fields)
+
+
+def warning(msg: str, event: str = None, **fields):
+    _log(logging.WARNING, msg, event, **fields)
+
+
+def error(msg: str, event: str = None, **fields):
+    _log(logging.ERROR, msg, event, **fields)
+
+
+def dropped() -> int:
+    """Record scartati per coda piena dall'avvio."""
+    return _dropped
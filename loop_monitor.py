@@ -0,0 +1,129 @@
+"""
+loop_monitor.py — Misura il ritardo (lag) dell'event loop e cattura chi lo blocca.
+
+Una coroutine dorme LOOP_LAG_INTERVAL_MS e misura di quanto si sveglia in
+ritardo: quel ritardo è il tempo in cui il loop era occupato da codice
+sincrono (I/O bloccante, calcoli lunghi) e non poteva servire altre richieste.
+
+Un thread "watchdog" controlla che la coroutine si svegli in tempo: se il
+ritardo supera LOOP_STALL_MS mentre il blocco è ancora in corso, legge lo
+stack del thread dell'event loop — cioè il codice che sta bloccando. Gli
+ultimi blocchi (lag, stack, funzione dell'app responsabile) finiscono nel log
+e in /admin/lente.
+
+Metriche:
+  event_loop_lag_seconds                      istogramma di tutti i campioni
+  event_loop_lag_quantile_seconds{quantile}   p50 / p95 / p99 / max sull'ultimo minuto
+  event_loop_stalls_total                     blocchi oltre LOOP_STALL_MS
+
+LOOP_LAG_INTERVAL_MS=0 disattiva il monitor.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import threading
+from collections import deque
+from datetime import datetime
+
+import profiler
+import metrics
+import log
+
+INTERVAL    = float(os.getenv("LOOP_LAG_INTERVAL_MS", "100")) / 1000
+STALL       = float(os.getenv("LOOP_STALL_MS", "100")) / 1000
+WINDOW      = 600            # campioni per i quantili (~1 minuto a 100ms)
+MAX_STALLS  = 20
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_APP_FILES = {f for f in os.listdir(os.path.dirname(os.path.abspath(__file__))) if f.endswith(".py")} - {"loop_monitor.py"}
+
+_samples = deque(maxlen=WINDOW)
+_stalls  = deque(maxlen=MAX_STALLS)
+_tick    = {"deadline": None, "stack": None}
+_lock    = threading.Lock()
+_started = False
+_task    = None        # riferimento forte al task di _monitor
+
+
+def quantiles() -> dict:
+    """Lag (secondi) sull'ultima finestra: p50, p95, p99, max."""
+    with _lock:
+        values = sorted(_samples)
+    if not values:
+        return {}
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {"0.5": pick(0.5), "0.95": pick(0.95), "0.99": pick(0.99), "1": values[-1]}
+
+
+def recent_stalls() -> list:
+    """Ultimi blocchi dell'event loop, dal più recente."""
+    with _lock:
+        return list(reversed(_stalls))
+
+
+LOOP_LAG = metrics.Histogram(
+    "event_loop_lag_seconds", "Ritardo dell'event loop rispetto al risveglio atteso", (), LAG_BUCKETS)
+LOOP_LAG_QUANTILES = metrics.Gauge(
+    "event_loop_lag_quantile_seconds", "Quantili del lag dell'event loop sull'ultimo minuto", ("quantile",),
+    fn=lambda: {(q,): round(v, 6) for q, v in quantiles().items()})
+LOOP_STALLS = metrics.Counter(
+    "event_loop_stalls_total", "Blocchi dell'event loop oltre LOOP_STALL_MS")
+
+
+def _blamed(stack: list) -> str:
+    """Frame più interno appartenente all'app: di solito la chiamata sincrona colpevole."""
+    for label in reversed(stack):
+        if label.split(":", 1)[0] in _APP_FILES:
+            return label
+    return stack[-1] if stack else "?"
+
+
+def _watchdog(loop_thread_id: int):
+    while True:
+        time.sleep(min(INTERVAL, STALL) / 4)
+        deadline = _tick["deadline"]
+        if deadline is None or _tick["stack"] is not None:
+            continue
+        if time.perf_counter() - deadline >= STALL:
+            frame = sys._current_frames().get(loop_thread_id)
+            _tick["stack"] = profiler.stack(frame) if frame is not None else []
+
+
+async def _monitor():
+    while True:
+        start = time.perf_counter()
+        _tick["stack"]    = None
+        _tick["deadline"] = start + INTERVAL
+        await asyncio.sleep(INTERVAL)
+        lag = max(0.0, time.perf_counter() - start - INTERVAL)
+        _tick["deadline"] = None
+        LOOP_LAG.observe(lag)
+        with _lock:
+            _samples.append(lag)
+        if lag < STALL:
+            continue
+
+        stack = _tick["stack"] or []
+        stall = {
+            "ts":     datetime.now().isoformat(timespec="seconds"),
+            "lag_ms": round(lag * 1000, 1),
+            "where":  _blamed(stack),
+            "stack":  stack,
+        }
+        with _lock:
+            _stalls.append(stall)
+        LOOP_STALLS.inc()
+        log.warning("🧊 Event loop bloccato {lag_ms:.0f}ms — {where}", event="loop.stall",
+                    lag_ms=stall["lag_ms"], where=stall["where"])
+
+
+def start_loop_monitor():
+    """Avviato allo startup, dal thread dell'event loop. Idempotente."""
+    global _started, _task
+    if _started or INTERVAL <= 0:
+        return
+    _started = True
+    threading.Thread(target=_watchdog, args=(threading.get_ident(),), name="loop-watchdog", daemon=True).start()
+    _task = asyncio.get_running_loop().create_task(_monitor())
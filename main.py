@@ -1,33 +1,53 @@
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import HTMLResponse, RedirectResponse, PlainTextResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from locations import LOCATIONS
 from weather_client import fetch_weather, fetch_weather_history
 from scraper import get_all_alerts
-from strava_client import fetch_starred_segments
+from strava_client import fetch_starred_list, fetch_starred_details, CASTELLI_BBOX
 from counter import increment_visit
 from reports import save_report, get_active_reports, delete_report
-from cache import cached_fetch_weather, cached_fetch_weather_history, cached_fetch_starred_segments, invalidate_strava_cache, get_cache_status
+from cache import cached_fetch_weather, cached_fetch_weather_history, cached_starred_segments, invalidate_strava_cache, get_cache_status
+from zone_index import build_zone_index, lookup_zone, track_zone_shares
+from soil_state import load_states, soil_state_loop
+from segment_match import match_segments_to_tracks
+from feedbacks import get_form_feedbacks, start_feedback_loop
+from page_data import assemble, source
+from timing import TimedTemplates, server_timing_middleware, slow_requests
+from loop_monitor import start_loop_monitor
+import metrics
+import memory
 from datetime import datetime, timedelta
-import csv
+import math
 import httpx
 import os
 import xml.etree.ElementTree as ET
 from dotenv import load_dotenv
+import log
 
 load_dotenv()
 
 app = FastAPI(title="Castelli Weather API")
-templates = Jinja2Templates(directory="templates")
+templates = TimedTemplates(directory="templates")
+app.middleware("http")(server_timing_middleware)
+app.middleware("http")(metrics.metrics_middleware)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+_soil_task = None   # riferimento forte: il loop tiene solo riferimenti deboli ai task
+
 @app.on_event("startup")
 async def startup_event():
     """Pre-carica i file GPX in memoria al boot — evita parsing XML ad ogni request."""
     import asyncio
+    global _soil_task
+    # Lag dell'event loop: avviato per primo, così misura anche il resto dello startup
+    start_loop_monitor()
     loop = asyncio.get_event_loop()
     await loop.run_in_executor(None, preload_gpx_cache)
+    # Stato terreno per zona: avanzato in background un giorno alla volta
+    _soil_task = asyncio.create_task(soil_state_loop(ZONE_GEOLOGY, fetch_weather_history))
+    # Feedback Google Form: scaricati in background, /avvisi legge la copia pronta
+    start_feedback_loop()
 
 # ─── Health check ────────────────────────────────────────────────────────────
 @app.head("/")
@@ -56,21 +76,25 @@ def _load_gpx_config() -> list:
     try:
         with open(_GPX_CONFIG_PATH, "r", encoding="utf-8") as _f:
             _data = _json.load(_f)
-        print(f"✅ gpx_config.json caricato: {len(_data)} percorsi")
+        log.info("✅ gpx_config.json caricato: {n_data} percorsi", n_data=len(_data))
         return _data
     except FileNotFoundError:
-        print(f"⚠️ gpx_config.json non trovato in {_GPX_CONFIG_PATH} — uso lista vuota")
+        log.warning("⚠️ gpx_config.json non trovato in {gpx_config_path} — uso lista vuota",
+                    gpx_config_path=_GPX_CONFIG_PATH)
         return []
     except _json.JSONDecodeError as _e:
-        print(f"❌ Errore parsing gpx_config.json: {_e} — uso lista vuota")
+        log.error("❌ Errore parsing gpx_config.json: {error} — uso lista vuota", error=_e)
         return []
 
 GPX_FILES = _load_gpx_config()
 
 # ─── Cache in-memory GPX (popolata una sola volta al primo accesso) ────────────
 # I file GPX non cambiano mai a runtime — non ha senso rileggerli ad ogni request.
-# Struttura: { "gpx-0": {"centroid": (lat, lon), "coords": [[lat,lon], ...]}, ... }
+# Struttura: { "gpx-0": {"centroid": (lat, lon), "coords": [[lat,lon], ...], "track": [[lat,lon], ...]}, ... }
+#   coords: ≤300 punti per Leaflet — track: ≤3000 punti per l'abbinamento segmenti Strava
 _GPX_CACHE: dict = {}
+memory.track("gpx", lambda: _GPX_CACHE)
+memory.track("slow_requests", slow_requests)   # richieste lente con la traccia delle risposte upstream
 
 def _parse_gpx_points(filepath: str):
     """Parsing XML interno — chiamato una sola volta per file."""
@@ -92,7 +116,7 @@ def _ensure_gpx_cached(key: str, filepath: str, max_points: int = 300):
     try:
         points = _parse_gpx_points(filepath)
         if not points:
-            _GPX_CACHE[key] = {"centroid": (None, None), "coords": []}
+            _GPX_CACHE[key] = {"centroid": (None, None), "coords": [], "track": []}
             return
 
         # Coordinate complete campionate per Leaflet
@@ -101,6 +125,11 @@ def _ensure_gpx_cached(key: str, filepath: str, max_points: int = 300):
         coords = [[round(float(p.get("lat")), 5), round(float(p.get("lon")), 5)]
                   for p in sample if p.get("lat") and p.get("lon")]
 
+        # Tracciato denso per l'abbinamento con i segmenti Strava (segment_match.py)
+        step3 = max(1, math.ceil(len(points) / 3000))   # // darebbe fino a ~6000 punti
+        track = [[round(float(p.get("lat")), 5), round(float(p.get("lon")), 5)]
+                 for p in points[::step3] if p.get("lat") and p.get("lon")]
+
         # Centroide (media su tutti i punti, non solo il campione)
         step2  = max(1, len(points) // 200)
         sample2 = points[::step2]
@@ -108,11 +137,11 @@ def _ensure_gpx_cached(key: str, filepath: str, max_points: int = 300):
         lons   = [float(p.get("lon")) for p in sample2 if p.get("lon")]
         centroid = (round(sum(lats)/len(lats), 5), round(sum(lons)/len(lons), 5)) if lats else (None, None)
 
-        _GPX_CACHE[key] = {"centroid": centroid, "coords": coords}
-        print(f"  📍 GPX cachato in memoria: {filepath} ({len(coords)} punti)")
+        _GPX_CACHE[key] = {"centroid": centroid, "coords": coords, "track": track}
+        log.info("  📍 GPX cachato in memoria: {filepath} ({n_coords} punti)", filepath=filepath, n_coords=len(coords))
     except Exception as e:
-        print(f"  ⚠️ Errore lettura GPX {filepath}: {e}")
-        _GPX_CACHE[key] = {"centroid": (None, None), "coords": []}
+        log.warning("  ⚠️ Errore lettura GPX {filepath}: {error}", filepath=filepath, error=e)
+        _GPX_CACHE[key] = {"centroid": (None, None), "coords": [], "track": []}
 
 
 def get_gpx_centroid(filepath: str):
@@ -129,12 +158,19 @@ def get_gpx_coords(filepath: str, max_points: int = 300):
     return _GPX_CACHE[key]["coords"]
 
 
+def get_gpx_track(filepath: str):
+    """Restituisce il tracciato denso di un GPX (dalla cache in memoria)."""
+    key = next((g["key"] for g in GPX_FILES if g["file"] == filepath), filepath)
+    _ensure_gpx_cached(key, filepath)
+    return _GPX_CACHE[key].get("track", [])
+
+
 def preload_gpx_cache():
     """Chiamata al startup — carica tutti i GPX in memoria una sola volta."""
-    print("🗺️ Pre-caricamento GPX in memoria...")
+    log.info("🗺️ Pre-caricamento GPX in memoria...")
     for g in GPX_FILES:
         _ensure_gpx_cached(g["key"], g["file"])
-    print(f"  ✅ {len(_GPX_CACHE)}/{len(GPX_FILES)} GPX cachati")
+    log.info("  ✅ {cached}/{total} GPX cachati", cached=len(_GPX_CACHE), total=len(GPX_FILES))
 
 
 
@@ -316,61 +352,6 @@ def find_best_riding_windows(hourly_data):
 
     return daily_windows
 
-async def fetch_form_feedbacks():
-    csv_url = "https://docs.google.com/spreadsheets/d/e/2PACX-1vRdLrCbwcB8E9zjahAbON9zAHQJKH6_PHONk40EGhhzrF23jX0NA8oLd3xIk-Hj98-ZLq2CnST_Fpzq/pub?gid=2136983056&single=true&output=csv"
-    try:
-        async with httpx.AsyncClient(follow_redirects=True) as client:
-            response = await client.get(csv_url, timeout=10.0)
-            response.raise_for_status()
-            lines  = response.text.strip().split("\n")
-            if len(lines) < 2:
-                return []
-            reader    = csv.DictReader(lines)
-            feedbacks = []
-            now       = datetime.now()
-            for row in reader:
-                cols          = list(row.keys())
-                timestamp_col = next((c for c in cols if "Informazioni" in c or "cronolog" in c), cols[0] if cols else "")
-                location_col  = next((c for c in cols if "Sentiero" in c or "Localit" in c), cols[1] if len(cols) > 1 else "")
-                condition_col = next((c for c in cols if "Condizione" in c), cols[2] if len(cols) > 2 else "")
-                details_col   = next((c for c in cols if "Dettagli" in c), cols[4] if len(cols) > 4 else "")
-                timestamp = row.get(timestamp_col, "")
-                location  = row.get(location_col, "")
-                condition = row.get(condition_col, "")
-                details   = row.get(details_col, "")
-                if not location or not location.strip():
-                    continue
-                time_ago = "Ora sconosciuta"
-                if timestamp:
-                    try:
-                        dt   = datetime.strptime(timestamp.replace(".", ":"), "%d/%m/%Y %H:%M:%S")
-                        diff = now - dt
-                        if diff.days == 0:
-                            hours = diff.seconds // 3600
-                            if hours == 0:
-                                mins = diff.seconds // 60
-                                time_ago = "Pochi minuti fa" if mins < 5 else f"{mins} min fa"
-                            else:
-                                time_ago = "1 ora fa" if hours == 1 else f"{hours} ore fa"
-                        elif diff.days == 1:
-                            time_ago = "Ieri"
-                        elif diff.days < 7:
-                            time_ago = f"{diff.days} giorni fa"
-                        else:
-                            time_ago = dt.strftime("%d/%m/%Y")
-                    except Exception as e:
-                        print(f"Errore parsing data '{timestamp}': {e}")
-                        time_ago = timestamp
-                full_description = condition
-                if details and details.strip():
-                    full_description += f" - {details}"
-                feedbacks.append({"location": location, "description": full_description, "date": time_ago, "timestamp": timestamp})
-            return feedbacks[::-1][:10] if feedbacks else []
-    except Exception as e:
-        print(f"Errore recupero feedbacks: {e}")
-        return []
-
-
 def calculate_soil_dryness(history_daily):
     """
     Calcola l'indice di asciugatura del terreno dagli ultimi 14 giorni.
@@ -491,15 +472,18 @@ def calculate_soil_dryness_5d(history_daily):
     }
 
 
-async def calculate_zone_matrix_5d(hourly_forecast: dict) -> list:
+async def calculate_zone_matrix_5d(hourly_forecast: dict, soils: dict = None) -> list:
     """
     Variante 5 giorni di calculate_zone_matrix.
     Usa storico 5gg e calculate_soil_dryness_5d per SMI e proiezioni.
+    soils: stato terreno per zona già raccolto (get_zone_soils), se disponibile.
     """
     from datetime import datetime, timedelta
 
     now = datetime.now()
 
+    forecast_ok     = _forecast_available(hourly_forecast)
+    hourly_forecast = hourly_forecast or {}
     daily_forecast_precip = {}
     for i, t in enumerate(hourly_forecast.get("time", [])):
         try:
@@ -510,23 +494,24 @@ async def calculate_zone_matrix_5d(hourly_forecast: dict) -> list:
         except Exception:
             continue
 
+    if soils is None:
+        soils = await get_zone_soils(list(ZONE_GEOLOGY), 5)
     matrix = []
     for zone_key, geo in ZONE_GEOLOGY.items():
-        try:
-            history = await cached_fetch_weather_history(geo["lat"], geo["lon"], 5, fetch_weather_history)
-            soil    = calculate_soil_dryness_5d(history)
-        except Exception:
-            soil = None
+        soil = soils.get(zone_key)
+        if soil is None:
+            matrix.append(_zone_no_data(zone_key, geo, now))
+            continue
 
-        rain_5d   = soil["rain_7d"] if soil else 0  # chiave mantenuta per compatibilità
-        dry_days  = soil["dry_days"] if soil else 0
+        rain_5d   = soil["rain_7d"]  # chiave mantenuta per compatibilità
+        dry_days  = soil["dry_days"]
         smi_now   = calculate_smi(rain_5d, geo["field_capacity"])
         rec_days  = estimate_recovery_days(smi_now, geo["drainage_rate"])
 
         days_out = []
         for offset in range(3):
             day    = (now + timedelta(days=offset)).date()
-            rain_f = round(daily_forecast_precip.get(day, 0), 1)
+            rain_f = round(daily_forecast_precip.get(day, 0), 1) if forecast_ok else None
 
             smi_proj = smi_now
             for d in range(offset):
@@ -537,7 +522,7 @@ async def calculate_zone_matrix_5d(hourly_forecast: dict) -> list:
                 elif prev_rain > 10:
                     smi_proj = min(2.0, smi_proj + 0.2)
 
-            gng = gonogo(smi_proj, rain_f, dry_days + offset)
+            gng = gonogo(smi_proj, rain_f, dry_days + offset) if forecast_ok else NO_DATA
 
             if offset == 0:   label = "Oggi"
             elif offset == 1: label = "Domani"
@@ -546,7 +531,7 @@ async def calculate_zone_matrix_5d(hourly_forecast: dict) -> list:
             days_out.append({
                 "label":  label,
                 "date":   day.isoformat(),
-                "smi":    round(smi_proj, 2),
+                "smi":    round(smi_proj, 2) if forecast_ok or offset == 0 else None,
                 "rain_f": rain_f,
                 **gng,
             })
@@ -564,6 +549,7 @@ async def calculate_zone_matrix_5d(hourly_forecast: dict) -> list:
             "geology_detail": geo["geology_detail"],
             "field_capacity": geo["field_capacity"],
             "drainage_rate":  geo["drainage_rate"],
+            "available":      True,
             "rain_7d":        rain_5d,
             "dry_days":       dry_days,
             "smi":            smi_now,
@@ -815,23 +801,38 @@ ZONE_GEOLOGY = {
 
 
 
+# Raster Voronoi delle zone sulla bbox del Parco — costruito una volta all'import
+_ZONE_INDEX = build_zone_index(ZONE_GEOLOGY, CASTELLI_BBOX)
+
+
 def nearest_zone(lat: float, lon: float) -> dict:
     """
     Restituisce il dizionario ZONE_GEOLOGY più vicino alle coordinate date.
-    Distanza euclidea semplice (sufficiente per zone ravvicinate come i Castelli).
+    Lookup O(1) sul raster precalcolato (vedi zone_index.py).
+    """
+    return ZONE_GEOLOGY[lookup_zone(_ZONE_INDEX, lat, lon)]
+
+
+def get_gpx_zone_shares(filepath: str) -> list:
     """
-    best_key, best_dist = None, float("inf")
-    for key, geo in ZONE_GEOLOGY.items():
-        dist = (lat - geo["lat"]) ** 2 + (lon - geo["lon"]) ** 2
-        if dist < best_dist:
-            best_dist, best_key = dist, key
-    return ZONE_GEOLOGY[best_key]
+    Ripartizione del tracciato per zona geologica (km e quota sul totale),
+    calcolata punto per punto una sola volta e tenuta in _GPX_CACHE.
+    """
+    key = next((g["key"] for g in GPX_FILES if g["file"] == filepath), filepath)
+    _ensure_gpx_cached(key, filepath)
+    entry = _GPX_CACHE[key]
+    if "zones" not in entry:
+        entry["zones"] = track_zone_shares(_ZONE_INDEX, entry["coords"])
+    return entry["zones"]
 
 
-def project_soil_forecast_smi(rain_5d: float, zone: dict, hourly_data: dict, riding_windows: list) -> list:
+def project_soil_forecast_smi(rain_5d: float, zone: dict, hourly_data: dict, riding_windows: list,
+                              smi_now: float = None) -> list:
     """
     Proiezione 3 giorni usando SMI + gonogo() con parametri geologici della zona.
     Allineato alla logica della matrice Go/NoGo — nessuna soglia flat.
+    smi_now: SMI di partenza già calcolato (es. pesato sulle zone del tracciato);
+             se assente viene calcolato da rain_5d e field_capacity della zona.
 
     Per ogni giorno:
       - SMI proiettato: diminuisce di drainage_rate*0.15 per ogni giorno <2mm
@@ -862,7 +863,8 @@ def project_soil_forecast_smi(rain_5d: float, zone: dict, hourly_data: dict, rid
         except Exception:
             pass
 
-    smi_now = calculate_smi(rain_5d, field_capacity)
+    if smi_now is None:
+        smi_now = calculate_smi(rain_5d, field_capacity)
     now     = datetime.now()
     forecast = []
 
@@ -913,6 +915,42 @@ def calculate_smi(rain_7d: float, field_capacity: float) -> float:
     return round(rain_7d / field_capacity, 2)
 
 
+async def get_zone_soils(zone_keys: list, days: int = 5) -> dict:
+    """
+    Stato terreno per zona: {zona: soil_dryness o None}.
+    Legge i record incrementali (soil_state.py) con una sola pipeline; per le
+    zone senza record recente ricade sullo storico Archive come prima.
+    """
+    import asyncio
+    calc   = calculate_soil_dryness_5d if days == 5 else calculate_soil_dryness
+    # Pipeline storage sincrona: in un thread, come le altre fonti sync di page_data
+    states = await asyncio.to_thread(load_states, zone_keys)
+    soils  = {}
+
+    for k, st in states.items():
+        # Stessa finestra di `days` giorni dello storico Archive: dry_days (e quindi
+        # motivi e soglie del rating) resta limitato alla finestra, non il contatore persistito
+        soils[k] = calc({"daily": {"time": st["days"][-days:], "precipitation_sum": st["precip"][-days:]}})
+
+    missing = [k for k in zone_keys if k not in states]
+    results = await asyncio.gather(*[
+        cached_fetch_weather_history(ZONE_GEOLOGY[k]["lat"], ZONE_GEOLOGY[k]["lon"], days, fetch_weather_history)
+        for k in missing
+    ], return_exceptions=True)
+    for k, history in zip(missing, results):
+        soils[k] = None
+        if isinstance(history, Exception):
+            log.warning("⚠️ Storico non disponibile per {name}: {history}",
+                        name=ZONE_GEOLOGY[k]['name'], history=history)
+            continue
+        try:
+            soils[k] = calc(history)
+        except Exception as e:
+            log.warning("⚠️ Storico non calcolabile per {name}: {error}", name=ZONE_GEOLOGY[k]['name'], error=e)
+
+    return soils
+
+
 def estimate_recovery_days(smi: float, drainage_rate: float) -> int:
     """
     Stima giorni al recupero (SMI < 0.5 = Go sicuro).
@@ -922,12 +960,9 @@ def estimate_recovery_days(smi: float, drainage_rate: float) -> int:
         return 0
     # Ogni giorno senza pioggia il terreno recupera ~drainage_rate * 0.15 di SMI
     daily_recovery = drainage_rate * 0.15
-    days = 0
-    current = smi
-    while current > 0.5 and days < 30:
-        current -= daily_recovery
-        days += 1
-    return days
+    if daily_recovery <= 0:
+        return 30
+    return min(30, math.ceil(round((smi - 0.5) / daily_recovery, 9)))
 
 
 def gonogo(smi: float, rain_forecast_mm: float, dry_days: int) -> dict:
@@ -949,15 +984,54 @@ def gonogo(smi: float, rain_forecast_mm: float, dry_days: int) -> dict:
         return {"status": "go",      "label": "Praticabile","emoji": "🟢", "color": "#27ae60"}
 
 
-async def calculate_zone_matrix(hourly_forecast: dict) -> list:
+# Senza forecast o senza stato terreno non si dà nessun giudizio: pioggia 0 e
+# SMI 0 al posto dei dati mancanti darebbero "Praticabile" ovunque
+NO_DATA   = {"status": "unknown", "label": "Dati non disponibili", "emoji": "⚪", "color": "#95a5a6"}
+DAY_NAMES = ("Oggi", "Domani", "Dopodomani")
+
+
+def _forecast_available(hourly_forecast: dict) -> bool:
+    return bool(hourly_forecast and hourly_forecast.get("time"))
+
+
+def _zone_no_data(zone_key: str, geo: dict, now) -> dict:
+    """Riga della matrice per una zona senza stato terreno: nessun rating, solo i dati geologici."""
+    from datetime import timedelta
+    return {
+        "key":            zone_key,
+        "name":           geo["name"],
+        "elevation":      geo["elevation"],
+        "geology":        geo["geology"],
+        "geology_detail": geo["geology_detail"],
+        "field_capacity": geo["field_capacity"],
+        "drainage_rate":  geo["drainage_rate"],
+        "available":      False,
+        "rain_7d":        None,
+        "dry_days":       None,
+        "smi":            None,
+        "rec_days":       None,
+        "terrain_label":  NO_DATA["label"],
+        "terrain_emoji":  NO_DATA["emoji"],
+        "days": [
+            {"label": name, "date": (now + timedelta(days=offset)).date().isoformat(),
+             "smi": None, "rain_f": None, **NO_DATA}
+            for offset, name in enumerate(DAY_NAMES)
+        ],
+    }
+
+
+async def calculate_zone_matrix(hourly_forecast: dict, soils: dict = None) -> list:
     """
     Per ogni zona: recupera storico 7gg, calcola SMI, proietta Go/NoGo per 3 giorni.
+    soils: stato terreno per zona già raccolto (get_zone_soils), se disponibile.
     """
     from datetime import datetime, timedelta
 
     now = datetime.now()
 
     # Precipitazioni previste per i prossimi 3 giorni dall'hourly forecast
+    forecast_ok     = _forecast_available(hourly_forecast)
+    hourly_forecast = hourly_forecast or {}
     daily_forecast_precip = {}
     for i, t in enumerate(hourly_forecast.get("time", [])):
         try:
@@ -970,16 +1044,17 @@ async def calculate_zone_matrix(hourly_forecast: dict) -> list:
 
     LEVELS = ["saturated", "wet", "damp", "dry"]
 
+    if soils is None:
+        soils = await get_zone_soils(list(ZONE_GEOLOGY), 7)
     matrix = []
     for zone_key, geo in ZONE_GEOLOGY.items():
-        try:
-            history = await cached_fetch_weather_history(geo["lat"], geo["lon"], 7, fetch_weather_history)
-            soil    = calculate_soil_dryness(history)
-        except Exception:
-            soil = None
+        soil = soils.get(zone_key)
+        if soil is None:
+            matrix.append(_zone_no_data(zone_key, geo, now))
+            continue
 
-        rain_7d   = soil["rain_7d"] if soil else 0
-        dry_days  = soil["dry_days"] if soil else 0
+        rain_7d   = soil["rain_7d"]
+        dry_days  = soil["dry_days"]
         smi_now   = calculate_smi(rain_7d, geo["field_capacity"])
         rec_days  = estimate_recovery_days(smi_now, geo["drainage_rate"])
 
@@ -987,7 +1062,7 @@ async def calculate_zone_matrix(hourly_forecast: dict) -> list:
         days_out = []
         for offset in range(3):
             day      = (now + timedelta(days=offset)).date()
-            rain_f   = round(daily_forecast_precip.get(day, 0), 1)
+            rain_f   = round(daily_forecast_precip.get(day, 0), 1) if forecast_ok else None
 
             # SMI proiettato: migliora di drainage_rate*0.15 per ogni giorno senza pioggia
             smi_proj = smi_now
@@ -999,7 +1074,7 @@ async def calculate_zone_matrix(hourly_forecast: dict) -> list:
                 elif prev_rain > 10:
                     smi_proj = min(2.0, smi_proj + 0.2)
 
-            gng = gonogo(smi_proj, rain_f, dry_days + offset)
+            gng = gonogo(smi_proj, rain_f, dry_days + offset) if forecast_ok else NO_DATA
 
             if offset == 0:   label = "Oggi"
             elif offset == 1: label = "Domani"
@@ -1008,7 +1083,7 @@ async def calculate_zone_matrix(hourly_forecast: dict) -> list:
             days_out.append({
                 "label":    label,
                 "date":     day.isoformat(),
-                "smi":      round(smi_proj, 2),
+                "smi":      round(smi_proj, 2) if forecast_ok or offset == 0 else None,
                 "rain_f":   rain_f,
                 **gng,
             })
@@ -1027,6 +1102,7 @@ async def calculate_zone_matrix(hourly_forecast: dict) -> list:
             "geology_detail": geo["geology_detail"],
             "field_capacity": geo["field_capacity"],
             "drainage_rate":  geo["drainage_rate"],
+            "available":      True,
             "rain_7d":        rain_7d,
             "dry_days":       dry_days,
             "smi":            smi_now,
@@ -1038,7 +1114,26 @@ async def calculate_zone_matrix(hourly_forecast: dict) -> list:
 
     return matrix
 
+def _data_notice(forecast_ok: bool, matrix: list) -> str:
+    """Avviso da mostrare in pagina quando forecast o stato terreno mancano (None = dati completi)."""
+    if not forecast_ok:
+        return "Previsioni meteo temporaneamente non disponibili: nessun giudizio sui giorni, riprova tra poco."
+    missing = [z for z in matrix if not z["available"]]
+    if missing and len(missing) == len(matrix):
+        return "Stato del terreno temporaneamente non disponibile: nessun giudizio sulle zone, riprova tra poco."
+    if missing:
+        return "Stato del terreno non disponibile per alcune zone: per quelle non viene dato alcun giudizio."
+    return None
+
 # ─── Routes ──────────────────────────────────────────────────────────────────
+# Budget di latenza per fonte (secondi) — vedi page_data.py
+BUDGET_UPSTASH  = 2.0    # contatore visite, segnalazioni
+BUDGET_WEATHER  = 8.0    # forecast + storico Open-Meteo (timeout client 10-15s)
+BUDGET_STRAVA   = 6.0    # segmenti starred (cache per-segmento, miss rari)
+BUDGET_FEEDBACK = 3.0    # copia in memoria del Google Form
+
+EMPTY_VISIT_STATS = {"total": 0, "today": 0, "this_month": 0, "page": "", "page_total": 0, "page_today": 0}
+
 @app.get("/")
 def root():
     return RedirectResponse(url="/dashboard-completa")
@@ -1090,7 +1185,7 @@ async def _fetch_all_locations():
 
     for (loc_key, loc_info), forecast, history in zip(loc_items, forecasts, histories):
         if isinstance(forecast, Exception):
-            print(f"⚠️ Forecast non disponibile per {loc_info['name']}: {forecast}")
+            log.warning("⚠️ Forecast non disponibile per {name}: {forecast}", name=loc_info['name'], forecast=forecast)
             continue
         hourly = forecast["hourly"]
 
@@ -1101,9 +1196,9 @@ async def _fetch_all_locations():
                 if soil_dryness is None:
                     soil_dryness = loc_soil
             except Exception as e:
-                print(f"⚠️ Storico non calcolabile per {loc_info['name']}: {e}")
+                log.warning("⚠️ Storico non calcolabile per {name}: {error}", name=loc_info['name'], error=e)
         else:
-            print(f"⚠️ Storico non disponibile per {loc_info['name']}: {history}")
+            log.warning("⚠️ Storico non disponibile per {name}: {history}", name=loc_info['name'], history=history)
 
         all_data.append({
             "name":        loc_info["name"],
@@ -1117,25 +1212,36 @@ async def _fetch_all_locations():
 
 @app.get("/dashboard-completa", response_class=HTMLResponse)
 async def dashboard_completa(request: Request):
-    visit_stats = increment_visit(page="dashboard")
-
-    all_data, soil_dryness = await _fetch_all_locations()
-
-    first_hourly             = all_data[0]["hourly"] if all_data else {}
-    overall_trail_conditions = calculate_trail_conditions(first_hourly)
-    overall_riding_windows   = find_best_riding_windows(first_hourly)
-    overall_riding_windows   = adjust_windows_for_soil(overall_riding_windows, soil_dryness, first_hourly)
-
-    current_conditions = calculate_current_conditions(soil_dryness)
-    soil_forecast      = project_soil_forecast(soil_dryness, first_hourly, overall_riding_windows)
+    data = await assemble(
+        "/dashboard-completa",
+        visit_stats = source(increment_visit, page="dashboard", budget=BUDGET_UPSTASH, fallback=EMPTY_VISIT_STATS),
+        locations   = source(_fetch_all_locations, budget=BUDGET_WEATHER, fallback=([], None)),
+        zone_soils  = source(get_zone_soils, list(ZONE_GEOLOGY), 5, budget=BUDGET_WEATHER,
+                             fallback=dict.fromkeys(ZONE_GEOLOGY)),
+    )
+    visit_stats            = data["visit_stats"]
+    all_data, soil_dryness = data["locations"]
+
+    if all_data:
+        first_hourly             = all_data[0]["hourly"]
+        overall_trail_conditions = calculate_trail_conditions(first_hourly)
+        overall_riding_windows   = find_best_riding_windows(first_hourly)
+        overall_riding_windows   = adjust_windows_for_soil(overall_riding_windows, soil_dryness, first_hourly)
+        current_conditions       = calculate_current_conditions(soil_dryness)
+        soil_forecast            = project_soil_forecast(soil_dryness, first_hourly, overall_riding_windows)
+    else:
+        # Forecast oltre budget o in errore per tutte le località: pagina con avviso, nessun giudizio
+        first_hourly = overall_trail_conditions = overall_riding_windows = None
+        current_conditions = soil_forecast = None
 
     try:
-        matrix = await calculate_zone_matrix_5d(first_hourly)
+        matrix = await calculate_zone_matrix_5d(first_hourly, data["zone_soils"])
     except Exception as e:
-        print(f"⚠️ Matrice terreno non disponibile: {e}")
+        log.warning("⚠️ Matrice terreno non disponibile: {error}", error=e)
         matrix = []
 
     return templates.TemplateResponse("dashboard_completa.html", {
+        "notice":              _data_notice(bool(all_data), matrix),
         "request": request,
         "locations_data":      all_data,
         "trail_conditions":    overall_trail_conditions,
@@ -1170,7 +1276,7 @@ async def home_test(request: Request):
                 soil_dryness = loc_soil_dryness
                 overall_riding_windows = adjust_windows_for_soil(overall_riding_windows, soil_dryness, hourly)
         except Exception as e:
-            print(f"⚠️ Storico meteo non disponibile per {loc_info['name']}: {e}")
+            log.warning("⚠️ Storico meteo non disponibile per {name}: {error}", name=loc_info['name'], error=e)
 
         all_data.append({
             "name": loc_info["name"], "elevation": loc_info["elevation"],
@@ -1186,7 +1292,7 @@ async def home_test(request: Request):
     try:
         matrix = await calculate_zone_matrix_5d(all_data[0]["hourly"] if all_data else {})
     except Exception as e:
-        print(f"⚠️ Matrice terreno non disponibile: {e}")
+        log.warning("⚠️ Matrice terreno non disponibile: {error}", error=e)
         matrix = []
 
     return templates.TemplateResponse("admin/home-test.html", {
@@ -1215,12 +1321,21 @@ async def terreno(request: Request):
     """Pagina principale: matrice Go/NoGo per zona."""
     # Prendi hourly forecast dalla prima location per le precipitazioni previste
     first_loc = list(LOCATIONS.values())[0]
-    data    = await cached_fetch_weather(first_loc["lat"], first_loc["lon"], fetch_weather)
-    hourly  = data["hourly"]
-    matrix  = await calculate_zone_matrix(hourly)
-    reports = get_active_reports()
+    data = await assemble(
+        "/terreno",
+        forecast   = source(cached_fetch_weather, first_loc["lat"], first_loc["lon"], fetch_weather,
+                            budget=BUDGET_WEATHER, fallback=None),
+        zone_soils = source(get_zone_soils, list(ZONE_GEOLOGY), 7, budget=BUDGET_WEATHER,
+                            fallback=dict.fromkeys(ZONE_GEOLOGY)),
+        reports    = source(get_active_reports, budget=BUDGET_UPSTASH, fallback=[]),
+    )
+    forecast = data["forecast"]
+    hourly   = forecast.get("hourly") if forecast else None
+    matrix   = await calculate_zone_matrix(hourly, data["zone_soils"])
+    reports  = data["reports"]
     return templates.TemplateResponse("terreno.html", {
         "request": request,
+        "notice":  _data_notice(_forecast_available(hourly), matrix),
         "matrix":  matrix,
         "reports": reports,
         "updated": datetime.now().strftime("%d/%m/%Y %H:%M"),
@@ -1279,21 +1394,37 @@ async def admin_elimina(report_id: str, pwd: str = ""):
     return {"ok": ok}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint(pwd: str = "", token: str = ""):
+    """
+    Metriche Prometheus (cache, upstream, storage, latenza route).
+    Come le pagine admin richiede ?pwd=, oppure ?token=METRICS_TOKEN per lo
+    scraper; pubbliche solo con METRICS_PUBLIC=1.
+    """
+    authorized = pwd == ADMIN_PASSWORD or (metrics.METRICS_TOKEN and token == metrics.METRICS_TOKEN)
+    if not (metrics.METRICS_PUBLIC or authorized):
+        raise HTTPException(status_code=403, detail="Non autorizzato")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/admin/cache", response_class=HTMLResponse)
-async def admin_cache(request: Request, pwd: str = ""):
-    """Pagina admin per monitorare e invalidare la cache Redis."""
+async def admin_cache(request: Request, pwd: str = "", cursor: str = "0"):
+    """Pagina admin per monitorare e invalidare la cache Redis (una pagina SCAN alla volta)."""
+    import asyncio
     if pwd != ADMIN_PASSWORD:
         return HTMLResponse("<p>Non autorizzato</p>", status_code=401)
-    status = get_cache_status()
+    status = await asyncio.to_thread(get_cache_status, cursor)
     keys_html = ""
     for k in status.get("keys", []):
         ttl = k["ttl_seconds"]
         mins = ttl // 60 if ttl > 0 else 0
-        color = "#27ae60" if ttl > 600 else ("#f7b733" if ttl > 0 else "#e74c3c")
+        color = "#27ae60" if ttl > 600 or ttl == -1 else ("#f7b733" if ttl > 0 else "#e74c3c")
         keys_html += f"""<tr>
           <td style="font-family:monospace;font-size:12px">{k['key']}</td>
-          <td style="color:{color};font-weight:bold">{mins}m {ttl % 60}s</td>
+          <td style="color:{color};font-weight:bold">{"permanente" if ttl == -1 else f"{mins}m {ttl % 60}s"}</td>
         </tr>"""
+    next_page = (f'<a href="/admin/cache?pwd={pwd}&cursor={status["cursor"]}" style="color:#3498db">Pagina successiva →</a>'
+                 if status["cursor"] != "0" else "")
     return HTMLResponse(f"""<!DOCTYPE html><html><head><meta charset="UTF-8">
     <title>Admin — Cache</title>
     <style>body{{font-family:Arial,sans-serif;padding:20px;background:#f0f2f5}}
@@ -1305,39 +1436,180 @@ async def admin_cache(request: Request, pwd: str = ""):
     background:#e74c3c;color:white;text-decoration:none;font-size:13px}}</style>
     </head><body>
     <h2>🗄️ Cache Redis — stato attuale</h2>
-    <p style="color:#7f8c8d;font-size:13px">Aggiornato: {status['timestamp']}</p>
+    <p style="color:#7f8c8d;font-size:13px">Aggiornato: {status['timestamp']} · backend {status['backend']} ·
+    generazione cache meteo {status['generations'].get('wx', 0)}</p>
     <table><thead><tr><th>Chiave</th><th>TTL residuo</th></tr></thead>
     <tbody>{keys_html}</tbody></table>
+    {next_page}
     <br>
     <a class="btn" href="/admin/cache/invalidate?pwd={pwd}&target=weather">🌐 Invalida cache meteo</a>
     <a class="btn" href="/admin/cache/invalidate?pwd={pwd}&target=strava">⭐ Invalida cache Strava</a>
     <a class="btn" href="/admin/cache/invalidate?pwd={pwd}&target=all" style="background:#c0392b">🗑️ Invalida tutto</a>
+    <a class="btn" href="/admin/profile?pwd={pwd}&seconds=10&format=speedscope" style="background:#8e44ad">🔬 Profilo 10s (speedscope)</a>
+    <a class="btn" href="/admin/lente?pwd={pwd}" style="background:#2980b9">🐢 Richieste lente</a>
+    <a class="btn" href="/admin/memoria?pwd={pwd}" style="background:#16a085">🧠 Memoria</a>
     <br><br><a href="/admin/segnalazioni?pwd={pwd}" style="color:#3498db">← Torna alle segnalazioni</a>
     </body></html>""")
 
 
 @app.get("/admin/cache/invalidate")
 async def admin_cache_invalidate(pwd: str = "", target: str = "all"):
-    """Invalida manualmente la cache Redis."""
+    """Invalida manualmente la cache Redis: meteo con un INCR di generazione, Strava con SCAN + UNLINK."""
+    import asyncio
     if pwd != ADMIN_PASSWORD:
         raise HTTPException(status_code=403, detail="Non autorizzato")
-    import httpx as _httpx
-    from cache import UPSTASH_URL, _headers
-    deleted = []
+    result = {"ok": True}
     if target in ("weather", "all"):
-        try:
-            r = _httpx.get(f"{UPSTASH_URL}/keys/wx:*", headers=_headers(), timeout=5.0)
-            keys = r.json().get("result", [])
-            for k in keys:
-                _httpx.get(f"{UPSTASH_URL}/del/{k}", headers=_headers(), timeout=3.0)
-                deleted.append(k)
-        except Exception as e:
-            print(f"⚠️ Errore invalidazione cache meteo: {e}")
+        from cache import invalidate_all_weather_cache
+        result["weather_generation"] = await asyncio.to_thread(invalidate_all_weather_cache)
     if target in ("strava", "all"):
         from cache import invalidate_strava_cache
-        invalidate_strava_cache()
-        deleted.append("strava:starred_segments")
-    return {"ok": True, "invalidated": deleted}
+        result["strava_keys_removed"] = await asyncio.to_thread(invalidate_strava_cache)
+    return result
+
+
+@app.get("/admin/lente", response_class=HTMLResponse)
+async def admin_lente(pwd: str = "", format: str = "html"):
+    """Ultime richieste oltre SLOW_REQUEST_MS con la traccia di cache, storage e upstream."""
+    import html
+    from timing import SLOW_REQUEST_MS, SLOW_LOG_SIZE
+    from loop_monitor import recent_stalls, quantiles, STALL
+    if pwd != ADMIN_PASSWORD:
+        return HTMLResponse("<p>Non autorizzato</p>", status_code=401)
+    entries = slow_requests()
+    stalls  = recent_stalls()
+    if format == "json":
+        return JSONResponse({"requests": entries, "loop_stalls": stalls, "loop_lag": quantiles()})
+
+    lag = " · ".join(f"{'max' if q == '1' else 'p' + str(int(float(q) * 100))} {v * 1000:.1f}ms" for q, v in quantiles().items())
+    stalls_html = "".join(f"""<details><summary><b>{s['lag_ms']:.0f}ms</b> — <code>{html.escape(s['where'])}</code>
+          <span style="color:#7f8c8d;font-size:12px">{s['ts']}</span></summary>
+          <pre style="font-size:11px;overflow-x:auto">{html.escape(chr(10).join(s['stack']))}</pre></details>""" for s in stalls)
+
+    colors = {"hit": "#27ae60", "coalesced": "#27ae60", "stale": "#f7b733", "miss": "#e74c3c"}
+    rows_html = ""
+    for e in entries:
+        spans = " · ".join(f"{k} {v:.0f}ms" for k, v in e["spans_ms"].items())
+        events_html = ""
+        for ev in e["events"]:
+            detail = {k: v for k, v in ev.items() if k not in ("at_ms", "kind", "name", "result", "ms")}
+            result = ev.get("result") or ev.get("error") or ev.get("status", "")
+            color  = colors.get(ev.get("result"), "#e74c3c" if "error" in ev else "#2c3e50")
+            events_html += f"""<tr>
+              <td>+{ev['at_ms']:.0f}ms</td><td>{ev['kind']}</td><td>{html.escape(ev['name'])}</td>
+              <td style="color:{color};font-weight:bold">{html.escape(str(result))}</td>
+              <td>{f"{ev['ms']:.0f}ms" if "ms" in ev else ""}</td>
+              <td style="font-family:monospace;font-size:11px">{html.escape(str(detail)) if detail else ""}</td>
+            </tr>"""
+        rows_html += f"""<details><summary>
+          <b>{e['total_ms']:.0f}ms</b> — {e['method']} {html.escape(e['path'])} → {e['status']}
+          <span style="color:#7f8c8d;font-size:12px">{e['ts']} · {spans} · compute {e['compute_ms']:.0f}ms ·
+          {e['storage_commands']} comandi storage · {len(e['events'])} eventi</span></summary>
+          <table><thead><tr><th>Quando</th><th>Tipo</th><th>Nome</th><th>Esito</th><th>Durata</th><th>Dettagli</th></tr></thead>
+          <tbody>{events_html}</tbody></table></details>"""
+    return HTMLResponse(f"""<!DOCTYPE html><html><head><meta charset="UTF-8">
+    <title>Admin — Richieste lente</title>
+    <style>body{{font-family:Arial,sans-serif;padding:20px;background:#f0f2f5}}
+    h2{{color:#2c3e50}} table{{background:white;border-radius:8px;margin:8px 0 16px;
+    box-shadow:0 2px 8px rgba(0,0,0,0.08);border-collapse:collapse;width:100%;font-size:13px}}
+    th{{background:#2c3e50;color:white;padding:6px 10px;text-align:left}}
+    td{{padding:6px 10px;border-bottom:1px solid #ecf0f1}}
+    details{{background:white;border-radius:8px;padding:10px 14px;margin:8px 0}}
+    summary{{cursor:pointer}}</style>
+    </head><body>
+    <h2>🐢 Richieste lente</h2>
+    <p style="color:#7f8c8d;font-size:13px">Ultime {SLOW_LOG_SIZE} richieste oltre {SLOW_REQUEST_MS:.0f}ms
+    (in memoria, per processo) — <a href="/admin/lente?pwd={pwd}&format=json">JSON</a></p>
+    {rows_html or "<p>Nessuna richiesta lenta registrata.</p>"}
+    <h2>🧊 Blocchi dell'event loop</h2>
+    <p style="color:#7f8c8d;font-size:13px">Lag ultimo minuto: {lag or "n/d"} — blocchi oltre {STALL * 1000:.0f}ms con lo stack del codice sincrono</p>
+    {stalls_html or "<p>Nessun blocco registrato.</p>"}
+    <br><a href="/admin/cache?pwd={pwd}" style="color:#3498db">← Torna alla cache</a>
+    </body></html>""")
+
+
+@app.get("/admin/memoria", response_class=HTMLResponse)
+async def admin_memoria(pwd: str = "", trace: str = "", format: str = "html"):
+    """Ingombro delle cache in-process e diff tracemalloc su richiesta (trace=start|diff|stop)."""
+    import html
+    import asyncio
+    if pwd != ADMIN_PASSWORD:
+        return HTMLResponse("<p>Non autorizzato</p>", status_code=401)
+    # Snapshot tracemalloc e stima delle cache richiedono secondi: fuori dall'event loop
+    diff = []
+    if trace == "start":
+        await asyncio.to_thread(memory.trace_start)
+    elif trace == "diff":
+        diff = await asyncio.to_thread(memory.trace_diff)
+    elif trace == "stop":
+        memory.trace_stop()
+    caches = await asyncio.to_thread(memory.cache_sizes, True)
+    status = memory.trace_status()
+    if format == "json":
+        return JSONResponse({"rss_bytes": memory.rss_bytes(), "caches": caches, "tracemalloc": status, "diff": diff})
+
+    mb = lambda b: f"{b / 1_048_576:.2f} MB" if b >= 1_048_576 else f"{b / 1024:.1f} KB"
+    caches_html = ""
+    for name, c in sorted(caches.items(), key=lambda kv: -kv[1]["bytes"]):
+        largest = "<br>".join(f"<code>{html.escape(e['key'])}</code> {mb(e['bytes'])}" for e in c["largest"])
+        caches_html += f"""<tr><td><b>{name}</b></td><td>{c['entries']}</td><td>{mb(c['bytes'])}</td>
+          <td style="font-size:12px">{largest}</td></tr>"""
+    diff_html = "".join(f"""<tr><td style="font-family:monospace;font-size:12px">{html.escape(d['where'])}</td>
+          <td style="color:{'#e74c3c' if d['size_diff'] > 0 else '#27ae60'};font-weight:bold">{d['size_diff'] / 1024:+.1f} KB</td>
+          <td>{mb(d['size'])}</td><td>{d['count_diff']:+d}</td></tr>""" for d in diff)
+    if status["tracing"]:
+        trace_html = f"""<p style="font-size:13px">tracemalloc attivo — tracciati {mb(status['traced_bytes'])}
+          (picco {mb(status['peak_bytes'])}), ultimo snapshot {status['baseline_ts']}</p>
+          <a class="btn" href="/admin/memoria?pwd={pwd}&trace=diff">📸 Diff dall'ultimo snapshot</a>
+          <a class="btn" href="/admin/memoria?pwd={pwd}&trace=stop" style="background:#c0392b">⏹️ Ferma tracemalloc</a>"""
+    else:
+        trace_html = f"""<p style="font-size:13px">tracemalloc spento (rallenta ogni allocazione: attivarlo solo per indagare)</p>
+          <a class="btn" href="/admin/memoria?pwd={pwd}&trace=start">▶️ Avvia tracemalloc</a>"""
+    if diff_html:
+        trace_html += f"""<table><thead><tr><th>Riga</th><th>Δ memoria</th><th>Totale</th><th>Δ blocchi</th></tr></thead>
+          <tbody>{diff_html}</tbody></table>"""
+    return HTMLResponse(f"""<!DOCTYPE html><html><head><meta charset="UTF-8">
+    <title>Admin — Memoria</title>
+    <style>body{{font-family:Arial,sans-serif;padding:20px;background:#f0f2f5}}
+    h2{{color:#2c3e50}} table{{background:white;border-radius:8px;margin:8px 0 16px;
+    box-shadow:0 2px 8px rgba(0,0,0,0.08);border-collapse:collapse;width:100%;font-size:13px}}
+    th{{background:#2c3e50;color:white;padding:6px 10px;text-align:left}}
+    td{{padding:6px 10px;border-bottom:1px solid #ecf0f1;vertical-align:top}}
+    .btn{{display:inline-block;margin:8px 4px;padding:8px 16px;border-radius:6px;
+    background:#16a085;color:white;text-decoration:none;font-size:13px}}</style>
+    </head><body>
+    <h2>🧠 Memoria del processo: {mb(memory.rss_bytes())} RSS</h2>
+    <table><thead><tr><th>Cache</th><th>Voci</th><th>Ingombro stimato</th><th>Voci più grandi</th></tr></thead>
+    <tbody>{caches_html}</tbody></table>
+    <h2>🔍 tracemalloc</h2>
+    {trace_html}
+    <br><br><a href="/admin/cache?pwd={pwd}" style="color:#3498db">← Torna alla cache</a>
+    </body></html>""")
+
+
+@app.get("/admin/profile")
+async def admin_profile(pwd: str = "", seconds: float = 10, format: str = "collapsed", interval_ms: float = 5):
+    """Campiona gli stack di event loop e thread per `seconds` secondi (max 60).
+    format=collapsed (flamegraph.pl) o speedscope (JSON per speedscope.app)."""
+    import asyncio
+    import threading
+    import profiler
+    if pwd != ADMIN_PASSWORD:
+        raise HTTPException(status_code=403, detail="Non autorizzato")
+    if format not in ("collapsed", "speedscope"):
+        raise HTTPException(status_code=400, detail="format: collapsed o speedscope")
+    log.info("🔬 Profilo avviato: {seconds}s ogni {interval_ms}ms", seconds=seconds, interval_ms=interval_ms)
+    try:
+        # Il campionamento gira in un thread: l'event loop continua a servire (ed essere campionato)
+        profile = await asyncio.to_thread(profiler.run, seconds, interval_ms / 1000, threading.get_ident())
+    except profiler.ProfilerBusy:
+        raise HTTPException(status_code=409, detail="Profilo già in corso")
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    if format == "speedscope":
+        return JSONResponse(profiler.to_speedscope(profile, name=f"castelli-weather {stamp}"),
+                            headers={"Content-Disposition": f'attachment; filename="profile-{stamp}.speedscope.json"'})
+    return PlainTextResponse(profiler.to_collapsed(profile),
+                             headers={"Content-Disposition": f'attachment; filename="profile-{stamp}.collapsed.txt"'})
 
 @app.post("/segnala")
 async def segnala(request: Request):
@@ -1359,73 +1631,99 @@ async def segnala(request: Request):
 
 @app.get("/avvisi", response_class=HTMLResponse)
 async def avvisi(request: Request):
-    increment_visit(page="avvisi")
-    alerts    = await get_all_alerts()
-    feedbacks = await fetch_form_feedbacks()
-    reports   = get_active_reports()
+    data = await assemble(
+        "/avvisi",
+        visit     = source(increment_visit, page="avvisi", budget=BUDGET_UPSTASH),
+        alerts    = source(get_all_alerts, fallback=[]),
+        feedbacks = source(get_form_feedbacks, budget=BUDGET_FEEDBACK, fallback=[]),
+        reports   = source(get_active_reports, budget=BUDGET_UPSTASH, fallback=[]),
+    )
     return templates.TemplateResponse("avvisi.html", {
         "request":   request,
-        "alerts":    alerts,
-        "feedbacks": feedbacks,
-        "reports":   reports,
+        "alerts":    data["alerts"],
+        "feedbacks": data["feedbacks"],
+        "reports":   data["reports"],
     })
 
 @app.get("/percorsi", response_class=HTMLResponse)
 async def percorsi(request: Request):
     """Mappa percorsi GPX con meteo calcolato dal centroide del tracciato + dati Strava"""
-    increment_visit(page="percorsi")
 
-    # Calcola coordinate centroide per ogni GPX + zona geologica più vicina
+    # Calcola coordinate centroide per ogni GPX + ripartizione per zona geologica
     gpx_with_coords = []
     for gpx in GPX_FILES:
         lat, lon = get_gpx_centroid(gpx["file"])
         if lat is None:
             lat, lon = 41.745, 12.720
-        zone = nearest_zone(lat, lon)
         coords = get_gpx_coords(gpx["file"])
-        gpx_with_coords.append({**gpx, "lat": lat, "lon": lon, "zone": zone, "coords": coords})
+        shares = get_gpx_zone_shares(gpx["file"]) or [{"key": lookup_zone(_ZONE_INDEX, lat, lon), "km": 0, "share": 1.0}]
+        zone   = ZONE_GEOLOGY[shares[0]["key"]]  # zona prevalente
+        gpx_with_coords.append({**gpx, "lat": lat, "lon": lon, "zone": zone, "zone_shares": shares, "coords": coords})
+
+    # Storico: una sola chiamata per zona attraversata da almeno un tracciato
+    zone_keys = sorted({s["key"] for g in gpx_with_coords for s in g["zone_shares"]})
 
-    # Fetch meteo + storico per ogni GPX in PARALLELO
+    # Tutte le fonti indipendenti in PARALLELO: meteo, stato terreno, Strava, segnalazioni, visite
     import asyncio
-    weather_results = await asyncio.gather(*[
-        cached_fetch_weather(g["lat"], g["lon"], fetch_weather)
-        for g in gpx_with_coords
-    ], return_exceptions=True)
 
-    history_results = await asyncio.gather(*[
-        cached_fetch_weather_history(g["zone"]["lat"], g["zone"]["lon"], 5, fetch_weather_history)
-        for g in gpx_with_coords
-    ], return_exceptions=True)
+    async def _gpx_weather():
+        return await asyncio.gather(*[
+            cached_fetch_weather(g["lat"], g["lon"], fetch_weather)
+            for g in gpx_with_coords
+        ], return_exceptions=True)
+
+    data = await assemble(
+        "/percorsi",
+        visit    = source(increment_visit, page="percorsi", budget=BUDGET_UPSTASH),
+        weather  = source(_gpx_weather, budget=BUDGET_WEATHER, fallback=[None] * len(gpx_with_coords)),
+        soils    = source(get_zone_soils, zone_keys, 5, budget=BUDGET_WEATHER, fallback=dict.fromkeys(zone_keys)),
+        segments = source(cached_starred_segments, fetch_starred_list, fetch_starred_details,
+                          budget=BUDGET_STRAVA, fallback=[]),
+        reports  = source(get_active_reports, budget=BUDGET_UPSTASH, fallback=[]),
+    )
+    weather_results  = data["weather"]
+    soil_by_zone     = data["soils"]
+    starred_segments = data["segments"]
 
     gpx_forecasts = []
-    for gpx, weather, history in zip(gpx_with_coords, weather_results, history_results):
-        if isinstance(weather, Exception):
-            print(f"⚠️ Meteo non disponibile per {gpx['name']}: {weather}")
+    for gpx, weather in zip(gpx_with_coords, weather_results):
+        if weather is None or isinstance(weather, Exception):
+            log.warning("⚠️ Meteo non disponibile per {name}: {weather}", name=gpx['name'], weather=weather)
             continue
 
-        zone = gpx["zone"]
+        zone   = gpx["zone"]
+        shares = gpx["zone_shares"]
         hourly = weather["hourly"]
 
-        # Soil dryness dalla zona geologica più vicina (non più da Monte Cavo fisso)
-        gpx_soil_dryness = None
-        if not isinstance(history, Exception):
-            try:
-                gpx_soil_dryness = calculate_soil_dryness_5d(history)
-            except Exception as e:
-                print(f"⚠️ Storico non calcolabile per {gpx['name']}: {e}")
-
+        # Soil dryness dalla zona prevalente del tracciato (per il cap sulle finestre)
+        gpx_soil_dryness = soil_by_zone.get(shares[0]["key"])
         rain_5d = gpx_soil_dryness["rain_7d"] if gpx_soil_dryness else 0
+        # Senza lo stato di tutte le zone attraversate niente SMI né giudizio sul terreno
+        soil_ok = all(soil_by_zone.get(s["key"]) is not None for s in shares)
+
+        # SMI e drenaggio pesati sui km percorsi in ciascuna zona
+        total_share = sum(s["share"] for s in shares) or 1.0
+        smi_now  = 0.0
+        drainage = 0.0
+        for s in shares:
+            geo       = ZONE_GEOLOGY[s["key"]]
+            soil_z    = soil_by_zone.get(s["key"])
+            w         = s["share"] / total_share
+            smi_now  += w * calculate_smi(soil_z["rain_7d"] if soil_z else 0, geo["field_capacity"])
+            drainage += w * geo["drainage_rate"]
+        smi_now = round(smi_now, 2)
 
         conditions     = calculate_trail_conditions(hourly)
         riding_windows = find_best_riding_windows(hourly)
         riding_windows = adjust_windows_for_soil(riding_windows, gpx_soil_dryness, hourly)
 
-        # Proiezione SMI con geologia della zona più vicina — allineato alla matrice
-        soil_forecast = project_soil_forecast_smi(rain_5d, zone, hourly, riding_windows)
+        # Proiezione SMI con geologia pesata sul tracciato — allineato alla matrice
+        soil_forecast = project_soil_forecast_smi(rain_5d, {**zone, "drainage_rate": drainage},
+                                                  hourly, riding_windows, smi_now=smi_now) if soil_ok else []
 
         # Badge terreno attuale basato su SMI (non più su soglie flat)
-        smi_now = calculate_smi(rain_5d, zone["field_capacity"])
-        if smi_now > 1.2:    terrain_label, terrain_emoji = "Saturo",      "🔴"
+        if not soil_ok:      terrain_label, terrain_emoji = NO_DATA["label"], NO_DATA["emoji"]
+        elif smi_now > 1.2:  terrain_label, terrain_emoji = "Saturo",      "🔴"
         elif smi_now > 0.8:  terrain_label, terrain_emoji = "Fangoso",     "🟠"
         elif smi_now > 0.5:  terrain_label, terrain_emoji = "Umido",       "🟡"
         else:                terrain_label, terrain_emoji = "Praticabile", "🟢"
@@ -1439,7 +1737,8 @@ async def percorsi(request: Request):
             "lat":            gpx["lat"],
             "lon":            gpx["lon"],
             "zone_name":      zone["name"],
-            "smi":            round(smi_now, 2),
+            "zones":          [{"name": ZONE_GEOLOGY[z["key"]]["name"], "km": z["km"], "share": z["share"]} for z in shares],
+            "smi":            round(smi_now, 2) if soil_ok else None,
             "terrain_label":  terrain_label,
             "terrain_emoji":  terrain_emoji,
             "conditions":     conditions,
@@ -1449,7 +1748,7 @@ async def percorsi(request: Request):
 
     # current_conditions generale (prima zona come riferimento — solo per compatibilità template)
     percorsi_current_conditions = None
-    if gpx_forecasts:
+    if gpx_forecasts and gpx_forecasts[0]["smi"] is not None:
         first = gpx_forecasts[0]
         percorsi_current_conditions = {
             "rating":       "poor" if first["smi"] > 1.2 else ("good" if first["smi"] > 0.5 else "excellent"),
@@ -1460,9 +1759,17 @@ async def percorsi(request: Request):
 
     #strava_club_info      = await fetch_club_info()
     #strava_all_activities = await fetch_all_club_activities()
-    starred_segments      = await cached_fetch_starred_segments(fetch_starred_segments)
 
-    reports = get_active_reports()
+    # Segmenti che giacciono su ciascun tracciato (ricalcolato solo se cambiano segmenti o GPX):
+    # in un thread, un ricalcolo costa ~0.3s e bloccherebbe l'event loop
+    segment_matches = await asyncio.to_thread(
+        lambda: match_segments_to_tracks({g["key"]: get_gpx_track(g["file"]) for g in GPX_FILES},
+                                         starred_segments or [])
+    )
+    for g in gpx_forecasts:
+        g["segments"] = segment_matches.get(g["key"], [])
+
+    reports = data["reports"]
     return templates.TemplateResponse("percorsi.html", {
         "request":                   request,
         "gpx_forecasts":             gpx_forecasts,
@@ -0,0 +1,198 @@
+"""
+memory.py — Quanta memoria occupano le cache in-process (/admin/memoria).
+
+Ogni modulo registra le proprie strutture in memoria:
+
+  memory.track("gpx", lambda: _GPX_CACHE)
+
+e questo modulo ne stima l'ingombro (sys.getsizeof ricorsivo su dict, liste,
+tuple, set e stringhe; gli oggetti condivisi sono contati una volta sola),
+trova le voci più grandi e lo espone su /metrics:
+
+  inprocess_cache_bytes{cache}     ingombro stimato
+  inprocess_cache_entries{cache}   numero di voci
+  process_resident_memory_bytes    RSS del processo (da /proc)
+
+La stima percorre tutti gli oggetti (decine di ms), quindi non gira mai
+sull'event loop: le gauge leggono l'ultima misura e, se è più vecchia di
+SIZE_TTL secondi, ne avviano una nuova in un thread. Il primo scrape dopo
+l'avvio vede quindi le cache vuote.
+
+Per la crescita non attribuibile a una cache c'è tracemalloc, attivato solo
+su richiesta (ha un costo su ogni allocazione): start, poi diff successivi
+rispetto all'ultimo snapshot, poi stop.
+"""
+
+import os
+import sys
+import time
+import threading
+import tracemalloc
+
+import metrics
+import log
+
+SIZE_TTL       = 30          # secondi di validità della stima
+TOP_ENTRIES    = 5           # voci più grandi mostrate per cache
+TRACE_FRAMES   = 10          # profondità degli stack registrati da tracemalloc
+
+_tracked: dict = {}          # nome → funzione che restituisce la struttura
+_lock     = threading.Lock()   # una misura alla volta
+_measuring = threading.Lock()  # misura in background già avviata
+_report   = {"ts": 0.0, "caches": {}}
+_baseline = {"snapshot": None, "ts": None}
+
+
+def track(name: str, getter):
+    """Registra una struttura in-process; `getter` la restituisce (o None)."""
+    _tracked[name] = getter
+
+
+def deep_size(obj, seen: set = None) -> int:
+    """Ingombro approssimato di obj e di ciò che contiene (byte)."""
+    if seen is None:
+        seen = set()
+    size  = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        elif hasattr(o, "__dict__") and not isinstance(o, type):
+            stack.append(o.__dict__)
+    return size
+
+
+def _entries(obj):
+    if isinstance(obj, dict):
+        return list(obj.items())
+    if isinstance(obj, (list, tuple)) or hasattr(obj, "__len__") and hasattr(obj, "__iter__"):
+        return list(enumerate(obj))
+    return []
+
+
+def _measure() -> dict:
+    caches = {}
+    seen   = set()     # condiviso: un oggetto in due cache conta nella prima
+    for name, getter in list(_tracked.items()):
+        try:
+            obj = getter()
+        except Exception as e:
+            log.warning("⚠️ Memoria {name} non leggibile: {error}", name=name, error=e)
+            continue
+        if obj is None:
+            continue
+        entries = _entries(obj)
+        sizes   = sorted(((str(k), deep_size(v, seen)) for k, v in entries), key=lambda kv: -kv[1])
+        caches[name] = {
+            "entries": len(entries),
+            "bytes":   sys.getsizeof(obj) + sum(s for _, s in sizes),
+            "largest": [{"key": k[:120], "bytes": s} for k, s in sizes[:TOP_ENTRIES]],
+        }
+    return caches
+
+
+def _refresh():
+    with _lock:
+        _report["caches"] = _measure()
+        _report["ts"]     = time.time()
+
+
+def _background_refresh():
+    try:
+        _refresh()
+    finally:
+        _measuring.release()
+
+
+def cache_sizes(force: bool = False) -> dict:
+    """
+    {nome: {"entries", "bytes", "largest": [...]}} dall'ultima misura, senza attenderne
+    una nuova: se è scaduta la si ricalcola in un thread. force=True misura subito
+    (bloccante: da chiamare fuori dall'event loop).
+    """
+    if force:
+        _refresh()
+    elif time.time() - _report["ts"] > SIZE_TTL and _measuring.acquire(blocking=False):
+        threading.Thread(target=_background_refresh, name="memory-measure", daemon=True).start()
+    return _report["caches"]
+
+
+def rss_bytes() -> int:
+    """Memoria residente del processo (0 se /proc non è disponibile)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+# ─── tracemalloc su richiesta ────────────────────────────────────────────────
+
+def trace_status() -> dict:
+    current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+    return {"tracing": tracemalloc.is_tracing(), "traced_bytes": current, "peak_bytes": peak,
+            "baseline_ts": _baseline["ts"]}
+
+
+def _snapshot() -> tracemalloc.Snapshot:
+    """Snapshot senza le allocazioni di tracemalloc stesso e dell'import machinery:
+    baseline e confronto devono usare gli stessi filtri, o il diff li conta come liberati."""
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ))
+
+
+def trace_start():
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACE_FRAMES)
+        log.info("🧠 tracemalloc avviato")
+    _baseline["snapshot"] = _snapshot()
+    _baseline["ts"]       = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def trace_stop():
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+        log.info("🧠 tracemalloc fermato")
+    _baseline["snapshot"] = _baseline["ts"] = None
+
+
+def trace_diff(top: int = 25, group_by: str = "lineno") -> list:
+    """Differenze rispetto all'ultimo snapshot (che viene poi sostituito). Avvia tracemalloc se serve."""
+    if not tracemalloc.is_tracing() or _baseline["snapshot"] is None:
+        trace_start()
+        return []
+    snapshot = _snapshot()
+    stats = snapshot.compare_to(_baseline["snapshot"], group_by)
+    _baseline["snapshot"] = snapshot
+    _baseline["ts"]       = time.strftime("%Y-%m-%dT%H:%M:%S")
+    return [{
+        "where":      str(s.traceback[0]) if s.traceback else "?",
+        "size_diff":  s.size_diff,
+        "size":       s.size,
+        "count_diff": s.count_diff,
+    } for s in stats[:top]]
+
+
+# ─── Metriche ────────────────────────────────────────────────────────────────
+
+CACHE_BYTES = metrics.Gauge(
+    "inprocess_cache_bytes", "Ingombro stimato delle cache in-process", ("cache",),
+    fn=lambda: {(name, ): c["bytes"] for name, c in cache_sizes().items()})
+CACHE_ENTRIES = metrics.Gauge(
+    "inprocess_cache_entries", "Voci nelle cache in-process", ("cache",),
+    fn=lambda: {(name, ): c["entries"] for name, c in cache_sizes().items()})
+RSS = metrics.Gauge(
+    "process_resident_memory_bytes", "Memoria residente del processo", (), fn=lambda: {(): rss_bytes()})
@@ -0,0 +1,207 @@
+"""
+metrics.py — Metriche in formato testo Prometheus, esposte su /metrics.
+
+Registro minimale in-process (nessuna dipendenza): contatori e istogrammi
+con etichette, thread-safe perché lo storage gira anche in thread.
+
+  cache_requests_total{namespace, result}     hit / miss / coalesced / stale / stale_if_error
+                                              per wx:forecast, wx:history, strava
+  upstream_request_duration_seconds{host}     latenza chiamate a Open-Meteo, Strava, ...
+  upstream_errors_total{host}                 errori (eccezioni o status >= 400)
+  storage_commands_total{backend}             comandi inviati allo storage (Upstash)
+  storage_commands_per_request                comandi storage per richiesta HTTP
+  http_request_duration_seconds{route, method, status}
+
+Le metriche sono per processo: con più worker Prometheus le somma per istanza.
+"""
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+import timing
+import log
+
+LATENCY_BUCKETS  = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COMMAND_BUCKETS  = (0, 1, 2, 5, 10, 20, 50, 100)
+METRICS_TOKEN    = os.getenv("METRICS_TOKEN", "")    # token dedicato per lo scraper (?token=), oltre a ?pwd= admin
+METRICS_PUBLIC   = os.getenv("METRICS_PUBLIC", "").lower() in ("1", "true", "yes")   # opt-in: /metrics senza credenziali
+
+_REGISTRY: list = []
+_lock = threading.Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self.values = {}
+        _REGISTRY.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, v in sorted(self.values.items()):
+            lines.append(f"{self.name}{_fmt_labels(self.labels, key)} {v}")
+        return lines
+
+
+class Gauge:
+    """Valore istantaneo; con `fn` viene letto al momento dello scrape ({etichette: valore})."""
+
+    def __init__(self, name: str, help: str, labels: tuple = (), fn=None):
+        self.name, self.help, self.labels, self.fn = name, help, labels, fn
+        self.values = {}
+        _REGISTRY.append(self)
+
+    def set(self, value: float, **labels):
+        with _lock:
+            self.values[tuple(labels.get(n, "") for n in self.labels)] = value
+
+    def render(self) -> list:
+        values = dict(self.values)
+        if self.fn is not None:
+            try:
+                values.update(self.fn())
+            except Exception as e:
+                log.warning("⚠️ Gauge {name} non disponibile: {error}", name=self.name, error=e)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for key, v in sorted(values.items()):
+            lines.append(f"{self.name}{_fmt_labels(self.labels, key)} {v}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self.values = {}     # key → [conteggi per bucket..., somma, totale]
+        _REGISTRY.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with _lock:
+            row = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, row in sorted(self.values.items()):
+            for i, b in enumerate(self.buckets):
+                le = f'le="{b}"'
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, le)} {row[i]}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, le)} {row[-1]}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labels, key)} {round(row[-2], 6)}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labels, key)} {row[-1]}")
+        return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ─── Metriche dell'app ───────────────────────────────────────────────────────
+
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "Letture cache per namespace ed esito", ("namespace", "result"))
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_duration_seconds", "Latenza delle chiamate HTTP agli upstream", ("host",))
+UPSTREAM_ERRORS = Counter(
+    "upstream_errors_total", "Chiamate upstream fallite (eccezione o status >= 400)", ("host",))
+STORAGE_COMMANDS = Counter(
+    "storage_commands_total", "Comandi inviati allo storage (Upstash/Redis/memory)", ("backend",))
+STORAGE_PER_REQUEST = Histogram(
+    "storage_commands_per_request", "Comandi storage per richiesta HTTP", (), COMMAND_BUCKETS)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "Latenza delle route HTTP", ("route", "method", "status"))
+LOG_DROPPED = Gauge(
+    "log_records_dropped", "Record di log scartati per coda piena dall'avvio", (), fn=lambda: {(): log.dropped()})
+
+
+def cache_result(namespace: str, result: str, n: int = 1, key: str = None):
+    if not n:
+        return
+    CACHE_REQUESTS.inc(n, namespace=namespace, result=result)
+    if key is not None:
+        timing.trace("cache", namespace, result=result, key=key)
+    else:
+        timing.trace("cache", namespace, result=result, n=n)
+
+
+@contextmanager
+def track_upstream(host: str):
+    """Misura una chiamata upstream: istogramma per host, errori e span Server-Timing."""
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        UPSTREAM_ERRORS.inc(host=host)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        UPSTREAM_LATENCY.observe(elapsed, host=host)
+        timing.add("upstream", elapsed)
+        timing.trace("upstream", host, ms=round(elapsed * 1000, 1), **({"error": error} if error else {}))
+
+
+# ─── Hook httpx (client Strava): tempo fino agli header della risposta ──────
+
+async def _on_request(request):
+    request.extensions["metrics_start"] = time.perf_counter()
+
+
+async def _on_response(response):
+    start = response.request.extensions.get("metrics_start")
+    host  = response.request.url.host
+    if start is not None:
+        elapsed = time.perf_counter() - start
+        UPSTREAM_LATENCY.observe(elapsed, host=host)
+        timing.add("upstream", elapsed)
+        timing.trace("upstream", host, ms=round(elapsed * 1000, 1), status=response.status_code,
+                     path=response.request.url.path)
+    if response.status_code >= 400:
+        UPSTREAM_ERRORS.inc(host=host)
+
+
+HTTPX_HOOKS = {"request": [_on_request], "response": [_on_response]}
+
+
+# ─── Middleware: latenza per route e comandi storage per richiesta ──────────
+
+async def metrics_middleware(request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+
+    route = request.scope.get("route")
+    path  = getattr(route, "path", None) or ("/static" if request.url.path.startswith("/static") else "other")
+    HTTP_LATENCY.observe(elapsed, route=path, method=request.method, status=response.status_code)
+
+    spans = getattr(request.state, "server_timing", None)
+    if spans is not None and path != "/static":
+        STORAGE_PER_REQUEST.observe(spans.get("storage_commands", 0))
+    return response
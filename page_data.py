@@ -0,0 +1,74 @@
+"""
+page_data.py — Raccolta concorrente dei dati di una pagina.
+
+Le route elencano le fonti indipendenti (meteo, storico, Strava, segnalazioni,
+contatore visite...) e assemble() le esegue tutte insieme: la latenza della
+pagina diventa quella della fonte più lenta, non la somma.
+
+Ogni fonte ha il suo budget di latenza e un valore di fallback: se sfora o
+fallisce la pagina viene comunque servita con il fallback, e nel log compare
+quale fonte era lenta. Le funzioni sincrone (Upstash via httpx sincrono)
+vengono eseguite in un thread per non bloccare l'event loop.
+"""
+
+import time
+import asyncio
+import inspect
+
+from timing import span
+import log
+
+DEFAULT_BUDGET = 5.0    # secondi
+SLOW_FRACTION  = 0.8    # oltre l'80% del budget la fonte viene segnalata come lenta
+
+
+def source(fn, *args, budget: float = DEFAULT_BUDGET, fallback=None, **kwargs) -> dict:
+    """Descrive una fonte dati: funzione (async o sync), argomenti, budget e fallback."""
+    return {"fn": fn, "args": args, "kwargs": kwargs, "budget": budget, "fallback": fallback}
+
+
+async def _run(name: str, src: dict):
+    fn, args, kwargs = src["fn"], src["args"], src["kwargs"]
+    if inspect.iscoroutinefunction(fn):
+        coro = fn(*args, **kwargs)
+    else:
+        coro = asyncio.to_thread(fn, *args, **kwargs)
+
+    # shield: una fonte oltre budget non viene cancellata ma completa in background,
+    # così il risultato finisce comunque in cache per la richiesta successiva
+    start = time.perf_counter()
+    task  = asyncio.ensure_future(coro)
+    try:
+        value = await asyncio.wait_for(asyncio.shield(task), timeout=src["budget"])
+        status = "ok"
+    except asyncio.TimeoutError:
+        value, status = src["fallback"], "timeout"
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    except Exception as e:
+        log.warning("⚠️ Fonte '{name}' in errore: {error}", name=name, error=e)
+        value, status = src["fallback"], "error"
+    return value, {"status": status, "duration": time.perf_counter() - start, "budget": src["budget"]}
+
+
+async def assemble(page: str, **sources) -> dict:
+    """
+    Esegue tutte le fonti in parallelo.
+    Restituisce {nome: valore}; i tempi per fonte sono in result["_timings"].
+    """
+    names   = list(sources)
+    with span("data"):
+        results = await asyncio.gather(*[_run(n, sources[n]) for n in names])
+
+    data, timings = {}, {}
+    for name, (value, timing) in zip(names, results):
+        data[name]    = value
+        timings[name] = timing
+        if timing["status"] == "timeout":
+            log.warning("🐢 {page}: fonte '{name}' oltre il budget di {budget:.1f}s — uso il fallback",
+                        page=page, name=name, budget=timing['budget'])
+        elif timing["duration"] > timing["budget"] * SLOW_FRACTION:
+            log.warning("🐢 {page}: fonte '{name}' lenta ({duration:.2f}s su {budget:.1f}s)",
+                        page=page, name=name, duration=timing['duration'], budget=timing['budget'])
+
+    data["_timings"] = timings
+    return data
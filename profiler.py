@@ -0,0 +1,137 @@
+"""
+profiler.py — Profiler a campionamento per la produzione (/admin/profile).
+
+Un thread dedicato legge ogni `interval` secondi lo stack di tutti i thread
+(sys._current_frames) per la durata richiesta: nessun hook di tracing, quindi
+l'overhead resta basso e l'app continua a servire traffico reale mentre si
+campiona. Il thread dell'event loop viene etichettato come "event-loop", gli
+altri con il loro nome (thread pool di asyncio.to_thread, listener dei log...).
+
+Formati di uscita:
+  collapsed  : "thread;modulo:funzione:riga;... conteggio" (flamegraph.pl, speedscope)
+  speedscope : JSON "sampled" per https://www.speedscope.app, un profilo per thread
+
+Un solo profilo alla volta per processo.
+"""
+
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+MAX_SECONDS      = 60
+DEFAULT_INTERVAL = 0.005    # 200 Hz
+MIN_INTERVAL     = 0.001
+
+_running = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def _short_path(filename: str) -> str:
+    """Percorso relativo per i file dell'app, "pacchetto/file.py" per librerie e stdlib."""
+    if filename.startswith(_ROOT + os.sep):
+        return os.path.relpath(filename, _ROOT)
+    if "site-packages" + os.sep in filename:
+        return filename.split("site-packages" + os.sep, 1)[1]
+    return os.path.join(*filename.split(os.sep)[-2:]) if os.sep in filename else filename
+
+
+def _frame_label(frame) -> tuple:
+    code = frame.f_code
+    return (code.co_name, _short_path(code.co_filename), frame.f_lineno)
+
+
+def stack(frame) -> list:
+    """Stack di un frame come ["file:funzione:riga", ...], dal più esterno."""
+    labels = []
+    while frame is not None:
+        name, file, line = _frame_label(frame)
+        labels.append(f"{file}:{name}:{line}")
+        frame = frame.f_back
+    return labels[::-1]
+
+
+def _sample(seconds: float, interval: float, loop_thread_id: int) -> tuple:
+    """Campiona gli stack; restituisce (Counter {(thread, stack): n}, durata effettiva)."""
+    me      = threading.get_ident()
+    names   = {}
+    samples = Counter()
+    start   = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        for t in threading.enumerate():
+            names.setdefault(t.ident, t.name)
+        for tid, frame in sys._current_frames().items():
+            if tid == me:
+                continue
+            frames = []
+            while frame is not None:
+                frames.append(_frame_label(frame))
+                frame = frame.f_back
+            thread = "event-loop" if tid == loop_thread_id else names.get(tid, f"thread-{tid}")
+            samples[(thread, tuple(reversed(frames)))] += 1
+        time.sleep(interval)
+    return samples, time.perf_counter() - start
+
+
+def run(seconds: float, interval: float = DEFAULT_INTERVAL, loop_thread_id: int = None) -> dict:
+    """Esegue il campionamento (bloccante: da chiamare in un thread). ProfilerBusy se già in corso."""
+    seconds  = max(0.1, min(float(seconds), MAX_SECONDS))
+    interval = max(MIN_INTERVAL, float(interval))
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy("profilo già in corso")
+    try:
+        samples, duration = _sample(seconds, interval, loop_thread_id)
+    finally:
+        _running.release()
+    return {"samples": samples, "duration": duration, "interval": interval}
+
+
+def to_collapsed(profile: dict) -> str:
+    lines = []
+    for (thread, stack), n in sorted(profile["samples"].items(), key=lambda kv: -kv[1]):
+        frames = ";".join(f"{file}:{name}:{line}" for name, file, line in stack)
+        lines.append(f"{thread};{frames} {n}")
+    return "\n".join(lines) + "\n"
+
+
+def to_speedscope(profile: dict, name: str = "castelli-weather") -> dict:
+    frames, index = [], {}
+    by_thread = {}
+    for (thread, stack), n in profile["samples"].items():
+        ids = []
+        for name_, file, line in stack:
+            key = (name_, file, line)
+            if key not in index:
+                index[key] = len(frames)
+                frames.append({"name": f"{name_}:{line}", "file": file, "line": line})
+            ids.append(index[key])
+        entry = by_thread.setdefault(thread, {"samples": [], "weights": []})
+        entry["samples"].append(ids)
+        entry["weights"].append(n * profile["interval"])
+
+    profiles = []
+    for thread, entry in sorted(by_thread.items(), key=lambda kv: kv[0] != "event-loop"):
+        profiles.append({
+            "type":       "sampled",
+            "name":       thread,
+            "unit":       "seconds",
+            "startValue": 0,
+            "endValue":   sum(entry["weights"]),
+            "samples":    entry["samples"],
+            "weights":    entry["weights"],
+        })
+    return {
+        "$schema":  "https://www.speedscope.app/file-format-schema.json",
+        "name":     name,
+        "exporter": "castelli-weather profiler.py",
+        "shared":   {"frames": frames},
+        "profiles": profiles,
+    }
@@ -1,43 +1,20 @@
-import os
 import json
 import uuid
-import httpx
 from datetime import datetime, timedelta
 
-UPSTASH_URL      = os.getenv("UPSTASH_REDIS_REST_URL", "").rstrip("/")
-UPSTASH_TOKEN    = os.getenv("UPSTASH_REDIS_REST_TOKEN", "")
+import storage
+
 REPORT_TTL_DAYS  = 21
 MIN_REPORTS      = 5        # mantieni sempre almeno le ultime N segnalazioni
 REPORTS_ZSET_KEY = "reports:index"
 
 
-def _headers():
-    return {
-        "Authorization": f"Bearer {UPSTASH_TOKEN}",
-        "Content-Type": "application/json",
-    }
-
-
 def _pipeline(commands: list):
-    try:
-        r = httpx.post(
-            f"{UPSTASH_URL}/pipeline",
-            headers=_headers(),
-            content=json.dumps(commands),
-            timeout=5.0,
-        )
-        r.raise_for_status()
-        return r.json()
-    except Exception as e:
-        print(f"⚠️ Upstash pipeline error: {e}")
-        return None
+    return storage.pipeline(commands)
 
 
 def _cmd(*args):
-    result = _pipeline([list(args)])
-    if result and isinstance(result, list):
-        return result[0].get("result")
-    return None
+    return storage.command(*args)
 
 
 def save_report(lat: float, lon: float, kind: str, description: str = "") -> dict:
@@ -0,0 +1,157 @@
+"""
+segment_match.py — Abbinamento segmenti Strava ↔ tracciati GPX.
+
+Per ogni tracciato si costruisce una spatial hash: la bbox di ogni tratto
+(coppia di punti consecutivi), allargata della tolleranza, viene registrata
+nelle celle di una griglia regolare. Per ogni punto di un segmento Strava
+basta quindi controllare i tratti nella sua cella — niente confronto
+segmenti × punti.
+
+Un tratto del segmento conta come "sul percorso" se il suo punto medio dista
+meno di MATCH_TOLERANCE_M dal tracciato. La quota abbinata è pesata sulla
+lunghezza; sotto MIN_FRACTION il segmento non viene associato.
+
+Il risultato dipende solo da polyline dei segmenti e coordinate dei GPX:
+viene calcolato una volta per combinazione (fingerprint) e poi riusato.
+Le route lo chiamano da un thread (asyncio.to_thread): un lock evita che due
+richieste concorrenti ricalcolino la stessa combinazione.
+"""
+
+import math
+import hashlib
+import threading
+
+import memory
+import log
+
+MATCH_TOLERANCE_M = 40      # distanza max dal tracciato
+MIN_FRACTION      = 0.5     # almeno metà del segmento sul percorso
+CELL_DEG          = 0.002   # ~220m lat, ~165m lon
+
+_M_PER_DEG_LAT = 111_320.0
+
+_MATCH_CACHE: dict = {"fingerprint": None, "result": {}}
+_match_lock = threading.Lock()
+memory.track("segment_match", lambda: _MATCH_CACHE["result"])
+
+
+def decode_polyline(encoded: str) -> list:
+    """Decodifica una Google Encoded Polyline (formato Strava) in [[lat, lon], ...]."""
+    coords = []
+    index = lat = lon = 0
+    length = len(encoded)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                b = ord(encoded[index]) - 63
+                index += 1
+                result |= (b & 0x1F) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        coords.append([lat / 1e5, lon / 1e5])
+    return coords
+
+
+def _build_hash(coords: list, kx: float) -> dict:
+    """Spatial hash {(riga, colonna): [(lat1, lon1, lat2, lon2), ...]} dei tratti del tracciato."""
+    grid = {}
+    pad_lat = MATCH_TOLERANCE_M / _M_PER_DEG_LAT
+    pad_lon = pad_lat / kx
+    for (lat1, lon1), (lat2, lon2) in zip(coords, coords[1:]):
+        r0 = int((min(lat1, lat2) - pad_lat) // CELL_DEG)
+        r1 = int((max(lat1, lat2) + pad_lat) // CELL_DEG)
+        c0 = int((min(lon1, lon2) - pad_lon) // CELL_DEG)
+        c1 = int((max(lon1, lon2) + pad_lon) // CELL_DEG)
+        edge = (lat1, lon1, lat2, lon2)
+        for r in range(r0, r1 + 1):
+            for c in range(c0, c1 + 1):
+                grid.setdefault((r, c), []).append(edge)
+    return grid
+
+
+def _dist_to_edge_m(lat: float, lon: float, edge: tuple, kx: float) -> float:
+    """Distanza punto-tratto in metri (proiezione equirettangolare locale)."""
+    lat1, lon1, lat2, lon2 = edge
+    px, py = (lon - lon1) * kx, lat - lat1
+    dx, dy = (lon2 - lon1) * kx, lat2 - lat1
+    seg2 = dx * dx + dy * dy
+    t = 0.0 if seg2 == 0 else max(0.0, min(1.0, (px * dx + py * dy) / seg2))
+    ex, ey = px - t * dx, py - t * dy
+    return math.sqrt(ex * ex + ey * ey) * _M_PER_DEG_LAT
+
+
+def _near_track(lat: float, lon: float, grid: dict, kx: float) -> bool:
+    edges = grid.get((int(lat // CELL_DEG), int(lon // CELL_DEG)), ())
+    return any(_dist_to_edge_m(lat, lon, e, kx) <= MATCH_TOLERANCE_M for e in edges)
+
+
+def match_fraction(seg_coords: list, grid: dict, kx: float) -> float:
+    """Quota (0-1) della lunghezza del segmento che giace sul tracciato."""
+    total = matched = 0.0
+    for (lat1, lon1), (lat2, lon2) in zip(seg_coords, seg_coords[1:]):
+        length = math.hypot((lon2 - lon1) * kx, lat2 - lat1)
+        total += length
+        if _near_track((lat1 + lat2) / 2, (lon1 + lon2) / 2, grid, kx):
+            matched += length
+    return matched / total if total > 0 else 0.0
+
+
+def _fingerprint(tracks: dict, segments: list) -> str:
+    h = hashlib.sha1()
+    for key in sorted(tracks):
+        coords = tracks[key]
+        h.update(f"{key}:{len(coords)}:{coords[:1]}:{coords[-1:]}".encode())
+    for s in segments:
+        h.update(f"{s.get('id')}:{s.get('polyline') or ''}".encode())
+    return h.hexdigest()
+
+
+def match_segments_to_tracks(tracks: dict, segments: list) -> dict:
+    """
+    tracks:   {gpx_key: [[lat, lon], ...]}
+    segments: segmenti starred (con "id", "name", "polyline")
+    Restituisce {gpx_key: [{"id", "name", "fraction"}, ...]} ordinato per quota.
+    Ricalcola solo se segmenti o tracciati sono cambiati.
+    """
+    fp = _fingerprint(tracks, segments)
+    with _match_lock:
+        if _MATCH_CACHE["fingerprint"] == fp:
+            return _MATCH_CACHE["result"]
+        result = _match(tracks, segments)
+        _MATCH_CACHE["result"] = result
+        _MATCH_CACHE["fingerprint"] = fp
+    log.info("  🧭 Segmenti Strava abbinati ai GPX: {matches} abbinamenti", matches=sum(len(v) for v in result.values()))
+    return result
+
+
+def _match(tracks: dict, segments: list) -> dict:
+    decoded = []
+    for s in segments:
+        try:
+            coords = decode_polyline(s.get("polyline") or "")
+        except Exception:
+            coords = []
+        if len(coords) > 1:
+            decoded.append((s, coords))
+
+    result = {}
+    for key, coords in tracks.items():
+        if len(coords) < 2:
+            result[key] = []
+            continue
+        kx   = math.cos(math.radians(sum(c[0] for c in coords) / len(coords)))
+        grid = _build_hash(coords, kx)
+        found = []
+        for s, seg_coords in decoded:
+            fraction = match_fraction(seg_coords, grid, kx)
+            if fraction >= MIN_FRACTION:
+                found.append({"id": s["id"], "name": s.get("name", ""), "fraction": round(fraction, 2)})
+        found.sort(key=lambda m: m["fraction"], reverse=True)
+        result[key] = found
+    return result
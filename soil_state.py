@@ -0,0 +1,145 @@
+"""
+soil_state.py — Stato del terreno per zona, avanzato un giorno alla volta.
+
+Invece di ricostruire l'umidità del suolo ad ogni request (fetch storico 5/7gg
+per zona + somma della finestra), ogni zona ha un piccolo record persistito:
+
+  soil:state:<zona> = {
+      "date":     "2026-10-17",           # ultimo giorno osservato incluso
+      "days":     ["2026-10-11", ...],    # ultimi WINDOW_DAYS giorni
+      "precip":   [0.0, 3.2, ...],        # precipitazione giornaliera (mm)
+      "dry_days": 4,                      # giorni consecutivi < 2mm (senza limite di finestra, solo log)
+  }
+
+Un job in background (soil_state_loop, avviato allo startup) aggiunge il nuovo
+giorno osservato dall'Archive API quando disponibile. Le pagine leggono tutti i
+record con una sola pipeline Redis (in un thread) e calcolano SMI/rating sulla
+finestra già pronta — stessa definizione documentata in /metodologia
+(SMI = pioggia ultimi 5gg ÷ field capacity). Anche i giorni senza pioggia
+vengono ricontati sulla finestra, come con lo storico Archive: il contatore
+"dry_days" del record non entra nelle pagine.
+
+Giorni con precipitazione None (lag dell'Archive API) non vengono mai inclusi:
+il record resta indietro e il giorno viene ripreso al giro successivo.
+"""
+
+import json
+import asyncio
+from datetime import datetime, timedelta
+
+from cache import _pipeline, _redis_set, cached_fetch_weather_history
+import memory
+import upstream
+import log
+
+WINDOW_DAYS    = 7                  # copre sia la variante 5gg che quella 7gg
+TTL_SOIL_STATE = 10 * 24 * 60 * 60  # 10 giorni: oltre la finestra il record va ricostruito
+MAX_STALE_DAYS = 3                  # record più vecchi → le pagine ricalcolano dallo storico
+DRY_THRESHOLD  = 2.0                # mm, stessa soglia di calculate_soil_dryness
+ADVANCE_EVERY  = 60 * 60            # il job controlla ogni ora se c'è un nuovo giorno
+
+# Copia in-process: usata se lo storage non risponde
+_LOCAL_STATE: dict = {}
+memory.track("soil_state", lambda: _LOCAL_STATE)
+
+
+def _state_key(zone_key: str) -> str:
+    return f"soil:state:{zone_key}"
+
+
+def advance_state(state: dict, day: str, precip: float) -> dict:
+    """
+    Avanza lo stato di un giorno. Idempotente: giorni già inclusi vengono ignorati.
+    day: data ISO (YYYY-MM-DD), precip: mm caduti quel giorno.
+    """
+    if state.get("date") and day <= state["date"]:
+        return state
+
+    days    = (state.get("days", []) + [day])[-WINDOW_DAYS:]
+    values  = (state.get("precip", []) + [round(precip, 1)])[-WINDOW_DAYS:]
+    dry     = state.get("dry_days", 0) + 1 if precip < DRY_THRESHOLD else 0
+
+    return {"date": day, "days": days, "precip": values, "dry_days": dry}
+
+
+def load_states(zone_keys: list, fresh_only: bool = True) -> dict:
+    """
+    Legge i record di tutte le zone con una sola pipeline.
+    Restituisce {zona: stato} per i record presenti (e recenti, se fresh_only).
+    """
+    states = {}
+    results = _pipeline([["GET", _state_key(k)] for k in zone_keys])
+    for i, k in enumerate(zone_keys):
+        raw = results[i].get("result") if results else None
+        try:
+            state = json.loads(raw) if raw else _LOCAL_STATE.get(k)
+        except Exception:
+            state = _LOCAL_STATE.get(k)
+        if state and (not fresh_only or is_fresh(state)):
+            states[k] = state
+    return states
+
+
+def save_state(zone_key: str, state: dict):
+    _LOCAL_STATE[zone_key] = state
+    _redis_set(_state_key(zone_key), state, TTL_SOIL_STATE)
+
+
+def is_fresh(state: dict) -> bool:
+    try:
+        last = datetime.fromisoformat(state["date"]).date()
+    except Exception:
+        return False
+    return (datetime.now().date() - last).days <= MAX_STALE_DAYS
+
+
+async def advance_zone(zone_key: str, geo: dict, fetch_fn) -> dict:
+    """
+    Porta lo stato della zona fino a ieri (o all'ultimo giorno disponibile).
+    Scarica solo i giorni mancanti; se il record manca o è più vecchio della
+    finestra lo ricostruisce dagli ultimi WINDOW_DAYS giorni.
+    """
+    state     = (await asyncio.to_thread(load_states, [zone_key], False)).get(zone_key, {})
+    yesterday = datetime.now().date() - timedelta(days=1)
+
+    gap = WINDOW_DAYS
+    if state.get("date"):
+        gap = (yesterday - datetime.fromisoformat(state["date"]).date()).days
+        if gap <= 0:
+            return state
+        if gap > WINDOW_DAYS:
+            state, gap = {}, WINDOW_DAYS
+
+    history = await cached_fetch_weather_history(geo["lat"], geo["lon"], gap, fetch_fn)
+    daily   = history.get("daily", {})
+    before  = state.get("date")
+    for day, precip in zip(daily.get("time", []), daily.get("precipitation_sum", [])):
+        if precip is None:
+            break
+        state = advance_state(state, day, precip)
+
+    if state.get("date") and state["date"] != before:
+        save_state(zone_key, state)
+        log.info("  🌱 Soil state {zone_key} → {date} (dry_days={dry_days})",
+                 zone_key=zone_key, date=state['date'], dry_days=state['dry_days'])
+    return state
+
+
+async def advance_all_zones(zones: dict, fetch_fn):
+    results = await asyncio.gather(*[
+        advance_zone(k, geo, fetch_fn) for k, geo in zones.items()
+    ], return_exceptions=True)
+    for k, r in zip(zones, results):
+        if isinstance(r, Exception):
+            log.warning("⚠️ Soil state {k} non aggiornato: {error}", k=k, error=r)
+
+
+async def soil_state_loop(zones: dict, fetch_fn):
+    """Job di background: avanza lo stato di tutte le zone, poi ricontrolla ogni ora."""
+    upstream.set_priority("maintenance")    # le chiamate all'Archive API passano dopo quelle dei visitatori
+    while True:
+        try:
+            await advance_all_zones(zones, fetch_fn)
+        except Exception as e:
+            log.warning("⚠️ Soil state loop error: {error}", error=e)
+        await asyncio.sleep(ADVANCE_EVERY)
@@ -0,0 +1,315 @@
+"""
+storage.py — Backend di storage intercambiabili per cache, contatori e segnalazioni.
+
+Tutti i moduli parlano con lo storage nello stesso modo: una lista di comandi
+Redis eseguiti in pipeline, con risposta nel formato Upstash
+[{"result": ...}, ...]. Il backend si sceglie con STORAGE_BACKEND:
+
+  upstash : Upstash REST (POST /pipeline) — UPSTASH_REDIS_REST_URL/TOKEN
+  redis   : connessione Redis nativa (REDIS_URL, es. redis://localhost:6379/0)
+            per deploy self-hosted con Redis co-locato; richiede il pacchetto `redis`
+  memory  : store in-process, per modalità single-node, test e benchmark offline
+
+Senza STORAGE_BACKEND: upstash se configurato, altrimenti redis se c'è
+REDIS_URL, altrimenti memory (prima i dati andavano semplicemente persi).
+"""
+
+import os
+import json
+import time
+import fnmatch
+import threading
+import httpx
+
+import timing
+from metrics import STORAGE_COMMANDS
+import upstream
+import memory
+import log
+
+UPSTASH_URL   = os.getenv("UPSTASH_REDIS_REST_URL", "").rstrip("/")
+UPSTASH_TOKEN = os.getenv("UPSTASH_REDIS_REST_TOKEN", "")
+REDIS_URL     = os.getenv("REDIS_URL", "")
+
+# Script Lua usati con EVAL (Upstash e Redis li eseguono in modo atomico;
+# il backend memory ne ha un equivalente Python in MemoryBackend._SCRIPTS)
+DELETE_IF_EQUALS = (
+    "if redis.call('GET', KEYS[1]) == ARGV[1] then "
+    "return redis.call('DEL', KEYS[1]) else return 0 end"
+)
+
+
+class UpstashBackend:
+    """
+    Upstash REST: una POST /pipeline per lista di comandi (JSON nel body).
+    Un solo client httpx (thread-safe) riusa le connessioni keep-alive invece
+    di rifare handshake TCP+TLS ad ogni comando. Con Upstash irraggiungibile il
+    circuit breaker dell'host fa fallire subito le chiamate invece di
+    attendere ogni volta il timeout.
+    """
+
+    name = "upstash"
+
+    def __init__(self, url: str, token: str, timeout: float = 5.0):
+        self.url     = url.rstrip("/")
+        self.token   = token
+        self.timeout = timeout
+        self.client  = httpx.Client(timeout=timeout, limits=httpx.Limits(max_keepalive_connections=20))
+        self.breaker = upstream.breaker(httpx.URL(self.url).host)
+
+    def headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {self.token}",
+            "Content-Type":  "application/json",
+        }
+
+    def pipeline(self, commands: list) -> list:
+        self.breaker.allow()
+        try:
+            r = self.client.post(
+                f"{self.url}/pipeline",
+                headers=self.headers(),
+                content=json.dumps(commands),
+            )
+            r.raise_for_status()
+        except Exception:
+            self.breaker.failure()
+            raise
+        self.breaker.success()
+        return r.json()
+
+
+class RedisBackend:
+    """Redis nativo via redis-py: pipeline senza transazione, risposte decodificate."""
+
+    name = "redis"
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("STORAGE_BACKEND=redis richiede il pacchetto 'redis' (pip install redis)") from e
+        self.client = redis.Redis.from_url(url, decode_responses=True, socket_timeout=5.0)
+
+    def pipeline(self, commands: list) -> list:
+        pipe = self.client.pipeline(transaction=False)
+        for cmd in commands:
+            pipe.execute_command(*cmd)
+        out = []
+        for cmd, res in zip(commands, pipe.execute(raise_on_error=False)):
+            if isinstance(res, Exception):
+                out.append({"error": str(res)})
+            else:
+                out.append({"result": _normalize(str(cmd[0]).upper(), res)})
+        return out
+
+
+def _normalize(op: str, value):
+    """Allinea i tipi redis-py al formato JSON di Upstash (SET → "OK", bool → 0/1, set → list)."""
+    if op == "SET" and value is True:
+        return "OK"
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    return value
+
+
+class MemoryBackend:
+    """
+    Store in-process con il sottoinsieme di comandi usato dall'app.
+    Thread-safe: le funzioni sincrone possono girare in thread (page_data.py).
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        self._data    = {}     # key → str | int | dict (sorted set: {member: score})
+        self._expires = {}     # key → epoch di scadenza
+        self._lock    = threading.Lock()
+
+    # ── helpers ──
+    def _alive(self, key) -> bool:
+        exp = self._expires.get(key)
+        if exp is not None and exp <= time.time():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return key in self._data
+
+    def _zset(self, key) -> dict:
+        return self._data.get(key, {}) if self._alive(key) else {}
+
+    @staticmethod
+    def _score_bound(v, upper: bool) -> float:
+        v = str(v)
+        if v in ("-inf", "+inf", "inf"):
+            return float(v)
+        if v.startswith("("):
+            return float(v[1:]) - (1e-9 if upper else -1e-9)
+        return float(v)
+
+    def pipeline(self, commands: list) -> list:
+        out = []
+        with self._lock:
+            for cmd in commands:
+                try:
+                    out.append({"result": self._execute([str(c) if not isinstance(c, str) else c for c in cmd])})
+                except Exception as e:
+                    out.append({"error": str(e)})
+        return out
+
+    def _delete_if_equals(self, keys: list, argv: list) -> int:
+        if self._alive(keys[0]) and self._data[keys[0]] == argv[0]:
+            return self._execute(["DEL", keys[0]])
+        return 0
+
+    _SCRIPTS = {DELETE_IF_EQUALS: _delete_if_equals}
+
+    def _execute(self, cmd: list):
+        op, args = cmd[0].upper(), cmd[1:]
+
+        if op == "GET":
+            if not self._alive(args[0]):
+                return None
+            if isinstance(self._data[args[0]], dict):
+                raise ValueError("WRONGTYPE Operation against a key holding the wrong kind of value")
+            return self._data[args[0]]
+        if op == "MGET":
+            return [self._execute(["GET", k]) for k in args]
+        if op == "SET":
+            key, value, opts = args[0], args[1], [a.upper() for a in args[2:]]
+            if "NX" in opts and self._alive(key):
+                return None
+            self._data[key] = value
+            self._expires.pop(key, None)
+            for flag, mult in (("EX", 1), ("PX", 0.001)):
+                if flag in opts:
+                    self._expires[key] = time.time() + float(args[2 + opts.index(flag) + 1]) * mult
+            return "OK"
+        if op == "EXPIRE":
+            if not self._alive(args[0]):
+                return 0
+            self._expires[args[0]] = time.time() + int(args[1])
+            return 1
+        if op == "TTL":
+            if not self._alive(args[0]):
+                return -2
+            exp = self._expires.get(args[0])
+            return -1 if exp is None else max(0, int(round(exp - time.time())))
+        if op == "INCR" or op == "INCRBY":
+            step  = int(args[1]) if op == "INCRBY" else 1
+            value = int(self._data[args[0]]) + step if self._alive(args[0]) else step
+            self._data[args[0]] = str(value)
+            return value
+        if op in ("DEL", "UNLINK"):
+            n = 0
+            for k in args:
+                if self._alive(k):
+                    n += 1
+                self._data.pop(k, None)
+                self._expires.pop(k, None)
+            return n
+        if op == "EVAL":
+            script, nkeys = args[0], int(args[1])
+            if script not in self._SCRIPTS:
+                raise ValueError("script EVAL non supportato dal backend memory")
+            return self._SCRIPTS[script](self, args[2:2 + nkeys], args[2 + nkeys:])
+        if op == "EXISTS":
+            return sum(1 for k in args if self._alive(k))
+        if op == "KEYS":
+            return [k for k in list(self._data) if self._alive(k) and fnmatch.fnmatchcase(k, args[0])]
+        if op == "SCAN":
+            # Come Redis: COUNT limita le chiavi esaminate, MATCH filtra dopo; cursore "0" = fine
+            opts    = [a.upper() for a in args[1:]]
+            pattern = args[1 + opts.index("MATCH") + 1] if "MATCH" in opts else "*"
+            count   = int(args[1 + opts.index("COUNT") + 1]) if "COUNT" in opts else 10
+            start   = int(args[0])
+            keys    = sorted(k for k in list(self._data) if self._alive(k))
+            page    = keys[start:start + count]
+            cursor  = start + count if start + count < len(keys) else 0
+            return [str(cursor), [k for k in page if fnmatch.fnmatchcase(k, pattern)]]
+        if op == "ZADD":
+            z = self._zset(args[0])
+            added = 0
+            for score, member in zip(args[1::2], args[2::2]):
+                added += member not in z
+                z[member] = float(score)
+            self._data[args[0]] = z
+            return added
+        if op == "ZCARD":
+            return len(self._zset(args[0]))
+        if op == "ZCOUNT":
+            lo, hi = self._score_bound(args[1], False), self._score_bound(args[2], True)
+            return sum(1 for s in self._zset(args[0]).values() if lo <= s <= hi)
+        if op == "ZRANGE":
+            members = [m for m, _ in sorted(self._zset(args[0]).items(), key=lambda kv: (kv[1], kv[0]))]
+            start, stop = int(args[1]), int(args[2])
+            stop = len(members) + stop if stop < 0 else stop
+            return members[start:stop + 1]
+        if op == "ZREM":
+            z = self._zset(args[0])
+            return sum(1 for m in args[1:] if z.pop(m, None) is not None)
+        if op == "ZREMRANGEBYSCORE":
+            z = self._zset(args[0])
+            lo, hi = self._score_bound(args[1], False), self._score_bound(args[2], True)
+            doomed = [m for m, s in z.items() if lo <= s <= hi]
+            for m in doomed:
+                del z[m]
+            return len(doomed)
+        raise ValueError(f"comando non supportato dal backend memory: {op}")
+
+
+def _create_backend():
+    choice = os.getenv("STORAGE_BACKEND", "").lower()
+    if not choice:
+        choice = "upstash" if UPSTASH_URL and UPSTASH_TOKEN else ("redis" if REDIS_URL else "memory")
+    if choice == "upstash":
+        return UpstashBackend(UPSTASH_URL, UPSTASH_TOKEN)
+    if choice == "redis":
+        return RedisBackend(REDIS_URL or "redis://localhost:6379/0")
+    return MemoryBackend()
+
+
+_backend = _create_backend()
+log.info("🗄️ Storage backend: {name}", name=_backend.name)
+memory.track("storage:memory", lambda: getattr(_backend, "_data", None))   # solo backend memory
+
+
+def get_backend():
+    return _backend
+
+
+def set_backend(backend):
+    """Sostituisce il backend (test, benchmark, emulatori)."""
+    global _backend
+    _backend = backend
+
+
+def pipeline(commands: list):
+    """Esegue più comandi in una sola richiesta. None su errore (come prima)."""
+    if not commands:
+        return []
+    try:
+        timing.count("storage_commands", len(commands))
+        STORAGE_COMMANDS.inc(len(commands), backend=_backend.name)
+        start = time.perf_counter()
+        with timing.span("cache"):
+            results = _backend.pipeline(commands)
+        timing.trace("storage", _backend.name, ms=round((time.perf_counter() - start) * 1000, 1),
+                     commands=len(commands), op=str(commands[0][0]).upper())
+        return results
+    except upstream.CircuitOpen:
+        timing.trace("storage", _backend.name, commands=len(commands), error="circuit open")
+        return None
+    except Exception as e:
+        timing.trace("storage", _backend.name, commands=len(commands), error=str(e)[:120])
+        log.warning("⚠️ Storage pipeline error ({name}): {error}", name=_backend.name, error=e)
+        return None
+
+
+def command(*args):
+    """Singolo comando: restituisce direttamente il campo "result" (o None)."""
+    result = pipeline([list(args)])
+    if result and isinstance(result, list):
+        return result[0].get("result")
+    return None
@@ -7,9 +7,16 @@ import httpx
 import os
 import json
 import time
-from datetime import datetime, timedelta
+import asyncio
+from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Optional
 from dotenv import load_dotenv
+from cache import _pipeline, _redis_get, _redis_set
+from storage import DELETE_IF_EQUALS
+from metrics import HTTPX_HOOKS
+import upstream
+import memory
+import log
 
 load_dotenv()
 
@@ -24,9 +31,10 @@ CASTELLI_BBOX = {
     "lon_est":   12.8597,
 }
 
-print(f"📦 Bounding Box Castelli Romani:")
-print(f"   Latitudine: {CASTELLI_BBOX['lat_sud']} → {CASTELLI_BBOX['lat_nord']}")
-print(f"   Longitudine: {CASTELLI_BBOX['lon_ovest']} → {CASTELLI_BBOX['lon_est']}")
+log.info("📦 Bounding Box Castelli Romani:")
+log.info("   Latitudine: {lat_sud} → {lat_nord}", lat_sud=CASTELLI_BBOX['lat_sud'], lat_nord=CASTELLI_BBOX['lat_nord'])
+log.info("   Longitudine: {lon_ovest} → {lon_est}",
+         lon_ovest=CASTELLI_BBOX['lon_ovest'], lon_est=CASTELLI_BBOX['lon_est'])
 
 # Club ID
 STRAVA_CLUB_ID = 1433598
@@ -39,6 +47,7 @@ TOKEN_FILE = "strava_tokens.json"
 # ─────────────────────────────────────────
 _cache = {}
 CACHE_TTL = 900  # 15 minuti in secondi
+memory.track("strava:client", lambda: _cache)
 
 def get_cache(key: str):
     """Restituisce il valore dalla cache se non scaduto"""
@@ -46,22 +55,226 @@ def get_cache(key: str):
         data, ts = _cache[key]
         if time.time() - ts < CACHE_TTL:
             remaining = int(CACHE_TTL - (time.time() - ts))
-            print(f"📦 Cache HIT: {key} (scade tra {remaining}s)")
+            log.info("📦 Cache HIT: {key} (scade tra {remaining}s)", event="cache.hit", key=key, remaining=remaining)
             return data
     return None
 
 def set_cache(key: str, data):
     """Salva il valore nella cache con timestamp"""
     _cache[key] = (data, time.time())
-    print(f"💾 Cache SET: {key}")
+    log.debug("💾 Cache SET: {key}", key=key)
 
 
 
 
+# ─────────────────────────────────────────
+# RATE LIMIT - token bucket sulle quote Strava
+# ─────────────────────────────────────────
+# Quote di lettura di default per applicazione: 100 richieste / 15 min,
+# 1000 / giorno. Un cold refresh dei 50 starred (+ la lista) ne consuma 51.
+STRAVA_RATE_15MIN  = int(os.getenv("STRAVA_RATE_15MIN", "100"))
+STRAVA_RATE_DAILY  = int(os.getenv("STRAVA_RATE_DAILY", "1000"))
+DETAIL_CONCURRENCY = 5      # richieste /segments/{id} simultanee
+# Coda per priorità condivisa da tutte le chiamate API: i refresh in background
+# (prefetch) non occupano i posti di una pagina /percorsi in attesa
+STRAVA_LIMITER = upstream.limiter("www.strava.com", initial=DETAIL_CONCURRENCY,
+                                  minimum=DETAIL_CONCURRENCY, maximum=DETAIL_CONCURRENCY)
+RATE_MAX_WAIT      = 5.0    # oltre questa attesa si usa il fallback ai dati base
+
+
+class TokenBucket:
+    """Token bucket con ricarica continua: `capacity` token ogni `period` secondi."""
+
+    def __init__(self, capacity: int, period: float):
+        self.capacity = capacity
+        self.rate     = capacity / period
+        self.tokens   = float(capacity)
+        self.updated  = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens  = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Secondi da attendere prima che sia disponibile un token."""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+
+_BUCKETS = [
+    TokenBucket(STRAVA_RATE_15MIN, 15 * 60),
+    TokenBucket(STRAVA_RATE_DAILY, 24 * 60 * 60),
+]
+
+
+async def acquire_rate_token(max_wait: float = RATE_MAX_WAIT, priority: str = "interactive") -> bool:
+    """
+    Prenota un token su entrambe le quote (15 min + giornaliera).
+    Restituisce False se il governor condiviso nega la chiamata per questa
+    priorità, o se servirebbe aspettare più di max_wait secondi:
+    il chiamante deve ripiegare su dati già disponibili invece di bloccarsi.
+    """
+    if not governor_allows(priority):
+        return False
+    waited = 0.0
+    while True:
+        wait = max(b.wait_time() for b in _BUCKETS)
+        if wait <= 0:
+            for b in _BUCKETS:
+                b.take()
+            return True
+        if waited + wait > max_wait:
+            return False
+        await asyncio.sleep(wait)
+        waited += wait
+
+
+# ─────────────────────────────────────────
+# RATE LIMIT GOVERNOR - quote reali condivise tra worker
+# ─────────────────────────────────────────
+# Strava restituisce su ogni risposta:
+#   X-RateLimit-Limit: "200,2000"   X-RateLimit-Usage: "37,512"
+#   X-ReadRateLimit-Limit / -Usage  (quote di sola lettura, più basse)
+# Il governor salva l'ultimo valore visto in Redis (chiave condivisa da tutti
+# i worker uvicorn) e nega le chiamate in base alla priorità prima di arrivare
+# al limite. Su 429 blocca tutto fino alla fine della finestra.
+#
+# Priorità → quota massima consumabile (frazione del limite)
+GOVERNOR_THRESHOLDS = {
+    "interactive": 0.95,   # page load: solo il margine finale è riservato
+    "background":  0.85,   # refresh SWR dei segmenti
+    "low":         0.70,   # club info/attività: i primi a essere sacrificati
+}
+GOVERNOR_KEY       = "strava:ratelimit"
+GOVERNOR_LOCAL_TTL = 5.0   # secondi: rilettura da Redis al massimo ogni 5s
+GOVERNOR_WRITE_MIN = 2.0   # secondi tra due scritture Redis (salvo 429)
+
+_governor       = {}       # ultimo stato noto (locale o letto da Redis)
+_governor_read  = 0.0
+_governor_write = 0.0
+
+
+def _window_15min(ts: float) -> int:
+    """Inizio della finestra 15 min corrente (Strava allinea a :00/:15/:30/:45 UTC)."""
+    return int(ts // 900 * 900)
+
+
+def _utc_day(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d")
+
+
+def _parse_pair(value: Optional[str]):
+    try:
+        a, b = value.split(",")
+        return int(a), int(b)
+    except Exception:
+        return None
+
+
+def _governor_state() -> Dict:
+    """Stato del governor: copia locale se recente, altrimenti riletto da Redis."""
+    global _governor, _governor_read
+    now = time.time()
+    if now - _governor_read > GOVERNOR_LOCAL_TTL:
+        _governor_read = now
+        shared = _redis_get(GOVERNOR_KEY)
+        if shared and shared.get("updated", 0) >= _governor.get("updated", 0):
+            _governor = shared
+    return _governor
+
+
+def _governor_save(state: Dict, force: bool = False):
+    global _governor, _governor_write
+    _governor = state
+    now = time.time()
+    if force or now - _governor_write > GOVERNOR_WRITE_MIN:
+        _governor_write = now
+        # La chiave vive fino alla fine del giorno UTC: oltre non è più significativa
+        _redis_set(GOVERNOR_KEY, state, 86400 - int(now % 86400) + 60)
+
+
+async def record_rate_limit(response: httpx.Response):
+    """Event hook httpx: aggiorna il governor con gli header di ogni risposta Strava."""
+    if "strava.com/api" not in str(response.request.url):
+        return
+    headers = response.headers
+    limit   = _parse_pair(headers.get("X-ReadRateLimit-Limit")) or _parse_pair(headers.get("X-RateLimit-Limit"))
+    usage   = _parse_pair(headers.get("X-ReadRateLimit-Usage")) or _parse_pair(headers.get("X-RateLimit-Usage"))
+    now     = time.time()
+    state   = dict(_governor)
+
+    if limit and usage:
+        state.update({
+            "limit_15":  limit[0], "limit_day": limit[1],
+            "usage_15":  usage[0], "usage_day": usage[1],
+            "window":    _window_15min(now), "day": _utc_day(now),
+        })
+    if response.status_code == 429:
+        # Fine finestra 15 min, o mezzanotte UTC se è finita la quota giornaliera
+        daily_out = usage and limit and usage[1] >= limit[1]
+        state["blocked_until"] = (now - now % 86400 + 86400) if daily_out else (_window_15min(now) + 900)
+        log.warning("🚦 Strava 429 — chiamate sospese fino a {until:%H:%M}",
+                    until=datetime.fromtimestamp(state['blocked_until']))
+
+    if state != _governor:
+        state["updated"] = now
+        _governor_save(state, force=response.status_code == 429)
+
+
+def governor_allows(priority: str = "interactive") -> bool:
+    """True se la chiamata con questa priorità rientra nel margine delle quote Strava."""
+    state = _governor_state()
+    now   = time.time()
+    if state.get("blocked_until", 0) > now:
+        return False
+
+    threshold = GOVERNOR_THRESHOLDS.get(priority, GOVERNOR_THRESHOLDS["low"])
+    if state.get("window") == _window_15min(now) and state.get("limit_15"):
+        if state["usage_15"] >= state["limit_15"] * threshold:
+            return False
+    if state.get("day") == _utc_day(now) and state.get("limit_day"):
+        if state["usage_day"] >= state["limit_day"] * threshold:
+            return False
+    return True
+
+
+def governor_status() -> Dict:
+    """Stato corrente del governor (per pagine admin / diagnostica)."""
+    return dict(_governor_state())
+
+
+def strava_http_client() -> httpx.AsyncClient:
+    """Client httpx per le API Strava: ogni risposta passa dal governor e dalle metriche."""
+    return httpx.AsyncClient(follow_redirects=True, event_hooks={
+        "request":  HTTPX_HOOKS["request"],
+        "response": [record_rate_limit, *HTTPX_HOOKS["response"]],
+    })
+
+
 # ─────────────────────────────────────────
 # TOKEN MANAGEMENT - Refresh automatico
 # ─────────────────────────────────────────
 
+# I token vivono in memoria (_tokens): il file viene letto una volta sola e
+# riscritto solo dopo un refresh. Il refresh è serializzato da un lock asyncio
+# (coroutine dello stesso worker) e da un lock Redis SET NX (altri worker):
+# chi non ottiene il lock attende e rilegge il file scritto dal vincitore.
+TOKEN_REFRESH_MARGIN    = 600          # sotto i 10 min: refresh bloccante
+TOKEN_PROACTIVE_MARGIN  = 30 * 60      # sotto i 30 min: refresh in background
+TOKEN_LOCK_KEY          = "strava:token_refresh_lock"
+TOKEN_LOCK_TTL          = 30           # secondi: il lock Redis scade da solo
+TOKEN_LOCK_WAIT         = 5.0          # attesa massima del refresh di un altro worker
+
+_tokens: Optional[Dict] = None
+_token_lock = asyncio.Lock()
+_token_refresh_task: Optional[asyncio.Task] = None
+
+
 def load_tokens():
     """Carica i token dal file locale (più recenti) o dalle env vars"""
     if os.path.exists(TOKEN_FILE):
@@ -81,68 +294,161 @@ def load_tokens():
     }
 
 def save_tokens(tokens):
-    """Salva i token aggiornati nel file locale"""
+    """Salva i token aggiornati nel file locale (scrittura atomica: tmp + rename)"""
+    tmp = f"{TOKEN_FILE}.{os.getpid()}.tmp"
     try:
-        with open(TOKEN_FILE, "w") as f:
+        with open(tmp, "w") as f:
             json.dump(tokens, f)
-        print(f"✅ Token Strava salvati, scadono: {datetime.fromtimestamp(tokens['expires_at'])}")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, TOKEN_FILE)
+        log.info("✅ Token Strava salvati, scadono: {expires}", expires=datetime.fromtimestamp(tokens['expires_at']))
     except Exception as e:
-        print(f"❌ Errore salvataggio token: {e}")
+        log.error("❌ Errore salvataggio token: {error}", error=e)
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
 
-async def refresh_access_token():
-    """Rinnova automaticamente l'access token usando il refresh token"""
-    tokens = load_tokens()
-    refresh_token = tokens.get("refresh_token")
-    client_id = os.getenv("STRAVA_CLIENT_ID")
-    client_secret = os.getenv("STRAVA_CLIENT_SECRET")
 
-    if not all([refresh_token, client_id, client_secret]):
-        print("❌ Credenziali Strava mancanti per il refresh")
-        return None
+def _get_tokens() -> Dict:
+    """Token correnti dalla memoria; il file viene letto solo al primo accesso."""
+    global _tokens
+    if _tokens is None:
+        _tokens = load_tokens()
+    return _tokens
 
-    print("🔄 Rinnovo token Strava in corso...")
 
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://www.strava.com/oauth/token",
-                data={
-                    "client_id": client_id,
-                    "client_secret": client_secret,
-                    "refresh_token": refresh_token,
-                    "grant_type": "refresh_token"
-                },
-                timeout=10.0
-            )
+def _expires_within(tokens: Dict, seconds: int) -> bool:
+    return time.time() > (tokens.get("expires_at", 0) - seconds)
+
+
+def _acquire_refresh_lock(owner: str) -> bool:
+    """Lock Redis tra worker. Senza Upstash configurato il lock è sempre concesso."""
+    result = _pipeline([["SET", TOKEN_LOCK_KEY, owner, "NX", "EX", TOKEN_LOCK_TTL]])
+    if result is None:
+        return True
+    return result[0].get("result") == "OK"
+
+
+def _release_refresh_lock(owner: str):
+    """
+    Rilascia il lock solo se è ancora nostro, con un unico EVAL atomico: con
+    GET e poi DEL separati, se il lock scade nel mezzo si cancellerebbe quello
+    appena preso da un altro worker. Se il lock è già scaduto non fa nulla.
+    """
+    _pipeline([["EVAL", DELETE_IF_EQUALS, 1, TOKEN_LOCK_KEY, owner]])
+
+
+async def _wait_for_other_refresh(margin: int) -> Optional[str]:
+    """Un altro worker sta rinnovando: rilegge il file finché il token è aggiornato."""
+    global _tokens
+    waited = 0.0
+    while waited < TOKEN_LOCK_WAIT:
+        await asyncio.sleep(0.5)
+        waited += 0.5
+        on_disk = load_tokens()
+        if not _expires_within(on_disk, margin):
+            _tokens = on_disk
+            return on_disk["access_token"]
+    # Nessun aggiornamento: il vecchio token resta utilizzabile se non ancora scaduto
+    current = _get_tokens()
+    return None if _expires_within(current, 0) else current.get("access_token")
+
+
+async def refresh_access_token(margin: int = TOKEN_REFRESH_MARGIN):
+    """
+    Rinnova l'access token usando il refresh token.
+    Una sola richiesta OAuth alla volta, anche con più worker: le altre
+    coroutine attendono il lock e trovano il token già rinnovato.
+    """
+    global _tokens
+    async with _token_lock:
+        tokens = _get_tokens()
+        if not _expires_within(tokens, margin):
+            return tokens.get("access_token")   # già rinnovato da chi aveva il lock
+
+        owner = f"{os.getpid()}:{time.time()}"
+        if not _acquire_refresh_lock(owner):
+            log.warning("⏳ Refresh token in corso su un altro worker — attendo")
+            return await _wait_for_other_refresh(margin)
 
-            if response.status_code != 200:
-                print(f"❌ Errore refresh: {response.status_code} - {response.text}")
+        try:
+            # Un altro worker potrebbe aver appena scritto token nuovi su file
+            on_disk = load_tokens()
+            if not _expires_within(on_disk, margin):
+                _tokens = on_disk
+                return on_disk["access_token"]
+
+            refresh_token = on_disk.get("refresh_token") or tokens.get("refresh_token")
+            client_id = os.getenv("STRAVA_CLIENT_ID")
+            client_secret = os.getenv("STRAVA_CLIENT_SECRET")
+
+            if not all([refresh_token, client_id, client_secret]):
+                log.error("❌ Credenziali Strava mancanti per il refresh")
                 return None
 
-            new_tokens = response.json()
-            updated = {
-                "access_token": new_tokens["access_token"],
-                "refresh_token": new_tokens["refresh_token"],
-                "expires_at": new_tokens["expires_at"]
-            }
-            save_tokens(updated)
-            print(f"✅ Token rinnovato con successo!")
-            return new_tokens["access_token"]
+            log.info("🔄 Rinnovo token Strava in corso...")
+
+            async with httpx.AsyncClient() as client:
+                response = await client.post(
+                    "https://www.strava.com/oauth/token",
+                    data={
+                        "client_id": client_id,
+                        "client_secret": client_secret,
+                        "refresh_token": refresh_token,
+                        "grant_type": "refresh_token"
+                    },
+                    timeout=10.0
+                )
+
+                if response.status_code != 200:
+                    log.error("❌ Errore refresh: {status_code} - {text}",
+                              status_code=response.status_code, text=response.text)
+                    return None
+
+                new_tokens = response.json()
+                updated = {
+                    "access_token": new_tokens["access_token"],
+                    "refresh_token": new_tokens["refresh_token"],
+                    "expires_at": new_tokens["expires_at"]
+                }
+                _tokens = updated
+                save_tokens(updated)
+                log.info("✅ Token rinnovato con successo!")
+                return new_tokens["access_token"]
+
+        except Exception as e:
+            log.error("❌ Errore durante refresh: {error}", error=e)
+            return None
+        finally:
+            _release_refresh_lock(owner)
+
+
+def _schedule_proactive_refresh():
+    """Avvia un refresh in background se non ce n'è già uno in corso."""
+    global _token_refresh_task
+    if _token_refresh_task is not None and not _token_refresh_task.done():
+        return
+    log.info("⏰ Token in scadenza tra meno di 30 min — rinnovo in background")
+    _token_refresh_task = asyncio.get_running_loop().create_task(
+        refresh_access_token(margin=TOKEN_PROACTIVE_MARGIN)
+    )
 
-    except Exception as e:
-        print(f"❌ Errore durante refresh: {e}")
-        return None
 
 async def get_valid_token():
     """Restituisce un token valido, rinnovandolo automaticamente se necessario"""
-    tokens = load_tokens()
-    expires_at = tokens.get("expires_at", 0)
+    tokens = _get_tokens()
 
-    # Rinnova se scade entro 10 minuti
-    if time.time() > (expires_at - 600):
-        print("⏰ Token in scadenza, rinnovo automatico...")
+    # Rinnova (bloccante) se scade entro 10 minuti
+    if _expires_within(tokens, TOKEN_REFRESH_MARGIN):
+        log.info("⏰ Token in scadenza, rinnovo automatico...")
         return await refresh_access_token()
 
+    # Entro 30 minuti: il token attuale è ancora buono, rinnovo in background
+    if _expires_within(tokens, TOKEN_PROACTIVE_MARGIN):
+        _schedule_proactive_refresh()
+
     return tokens.get("access_token")
 
 
@@ -156,15 +462,19 @@ async def fetch_club_info() -> Optional[Dict]:
     if cached is not None:
         return cached
 
+    if not await acquire_rate_token(max_wait=0, priority="low"):
+        log.warning("🚦 Quota Strava riservata alle pagine — salto info club")
+        return None
+
     token = await get_valid_token()
     if not token:
-        print("❌ STRAVA_ACCESS_TOKEN non configurato in .env")
+        log.error("❌ STRAVA_ACCESS_TOKEN non configurato in .env")
         return None
 
-    print(f"🔍 Recupero info club {STRAVA_CLUB_ID}...")
+    log.info("🔍 Recupero info club {club_id}...", club_id=STRAVA_CLUB_ID)
 
     try:
-        async with httpx.AsyncClient(follow_redirects=True) as client:
+        async with strava_http_client() as client:
             headers = {"Authorization": f"Bearer {token}"}
             url = f"https://www.strava.com/api/v3/clubs/{STRAVA_CLUB_ID}"
 
@@ -172,7 +482,7 @@ async def fetch_club_info() -> Optional[Dict]:
             response.raise_for_status()
 
             club = response.json()
-            print(f"✅ Club trovato: {club.get('name')}")
+            log.info("✅ Club trovato: {name}", name=club.get('name'))
 
             result = {
                 "name": club.get("name", "Club MTB"),
@@ -186,7 +496,7 @@ async def fetch_club_info() -> Optional[Dict]:
             return result
 
     except Exception as e:
-        print(f"❌ Errore info club: {e}")
+        log.error("❌ Errore info club: {error}", error=e)
         return None
 
 
@@ -203,14 +513,18 @@ async def fetch_all_club_activities() -> List[Dict]:
     if cached is not None:
         return cached
 
+    if not await acquire_rate_token(max_wait=0, priority="low"):
+        log.warning("🚦 Quota Strava riservata alle pagine — salto attività club")
+        return []
+
     token = await get_valid_token()
     if not token:
         return []
 
-    print(f"🔍 Recupero attività del club...")
+    log.info("🔍 Recupero attività del club...")
 
     try:
-        async with httpx.AsyncClient(follow_redirects=True) as client:
+        async with strava_http_client() as client:
             headers = {"Authorization": f"Bearer {token}"}
             url = f"https://www.strava.com/api/v3/clubs/{STRAVA_CLUB_ID}/activities"
             params = {"per_page": 10}
@@ -219,7 +533,7 @@ async def fetch_all_club_activities() -> List[Dict]:
             response.raise_for_status()
 
             activities = response.json()
-            print(f"✅ Recuperate {len(activities)} attività dal club")
+            log.info("✅ Recuperate {n_activities} attività dal club", n_activities=len(activities))
 
             result = []
             for idx, activity in enumerate(activities[:5], 1):
@@ -237,7 +551,9 @@ async def fetch_all_club_activities() -> List[Dict]:
                 elevation = int(activity.get("total_elevation_gain", 0))
                 moving_time = format_duration(activity.get("moving_time", 0))
 
-                print(f"  {idx}. {athlete_name}: {activity_name[:40]} - {distance_km}km, {elevation}m D+")
+                log.debug("  {idx}. {athlete_name}: {activity_name:.40} - {distance_km}km, {elevation}m D+",
+                          idx=idx, athlete_name=athlete_name, activity_name=activity_name,
+                          distance_km=distance_km, elevation=elevation)
 
                 result.append({
                     "athlete_name": athlete_name,
@@ -247,26 +563,30 @@ async def fetch_all_club_activities() -> List[Dict]:
                     "moving_time": moving_time,
                 })
 
-            print(f"✅ Mostro {len(result)} attività")
+            log.info("✅ Mostro {n_result} attività", n_result=len(result))
             set_cache("club_activities", result)
             return result
 
     except Exception as e:
-        print(f"❌ Errore recupero attività club: {e}")
+        log.error("❌ Errore recupero attività club: {error}", error=e)
         return []
 
 
 async def fetch_club_activities() -> List[Dict]:
     """Recupera le ultime attività del club nei Castelli Romani"""
+    if not await acquire_rate_token(max_wait=0, priority="low"):
+        log.warning("🚦 Quota Strava riservata alle pagine — salto attività club")
+        return []
+
     token = await get_valid_token()
     if not token:
-        print("❌ STRAVA_ACCESS_TOKEN non configurato in .env")
+        log.error("❌ STRAVA_ACCESS_TOKEN non configurato in .env")
         return []
 
-    print(f"🔍 Recupero attività club {STRAVA_CLUB_ID}...")
+    log.info("🔍 Recupero attività club {club_id}...", club_id=STRAVA_CLUB_ID)
 
     try:
-        async with httpx.AsyncClient(follow_redirects=True) as client:
+        async with strava_http_client() as client:
             headers = {"Authorization": f"Bearer {token}"}
             url = f"https://www.strava.com/api/v3/clubs/{STRAVA_CLUB_ID}/activities"
             params = {"per_page": 30}
@@ -275,7 +595,7 @@ async def fetch_club_activities() -> List[Dict]:
             response.raise_for_status()
 
             activities = response.json()
-            print(f"✅ Recuperate {len(activities)} attività totali dal club")
+            log.info("✅ Recuperate {n_activities} attività totali dal club", n_activities=len(activities))
 
             castelli_activities = []
             for activity in activities:
@@ -297,11 +617,12 @@ async def fetch_club_activities() -> List[Dict]:
                             "activity_id": activity.get("id"),
                         })
 
-            print(f"✅ Filtrate {len(castelli_activities)} attività nei Castelli Romani")
+            log.info("✅ Filtrate {n_castelli_activities} attività nei Castelli Romani",
+                     n_castelli_activities=len(castelli_activities))
             return castelli_activities[:10]
 
     except Exception as e:
-        print(f"❌ Errore recupero attività Strava: {e}")
+        log.error("❌ Errore recupero attività Strava: {error}", error=e)
         return []
 
 
@@ -348,13 +669,20 @@ async def fetch_club_stats() -> Dict:
 
 
 async def fetch_segment_details(segment_id: int) -> Optional[Dict]:
-    """Recupera dettagli aggiuntivi di un segmento Strava"""
+    """
+    Recupera dettagli aggiuntivi di un segmento Strava.
+    Due chiamate API (segmento + leaderboard), quindi due token: senza il
+    secondo l'ultima attività resta "N/A".
+    """
+    if not await acquire_rate_token(max_wait=0, priority="low"):
+        return None
+
     token = await get_valid_token()
     if not token:
         return None
 
     try:
-        async with httpx.AsyncClient(follow_redirects=True) as client:
+        async with strava_http_client() as client:
             headers = {"Authorization": f"Bearer {token}"}
 
             seg_url = f"https://www.strava.com/api/v3/segments/{segment_id}"
@@ -362,10 +690,12 @@ async def fetch_segment_details(segment_id: int) -> Optional[Dict]:
             seg_response.raise_for_status()
             segment = seg_response.json()
 
-            lb_url = f"https://www.strava.com/api/v3/segments/{segment_id}/leaderboard"
-            lb_response = await client.get(lb_url, headers=headers, params={"per_page": 1}, timeout=10.0)
-            lb_response.raise_for_status()
-            leaderboard = lb_response.json()
+            leaderboard = {}
+            if await acquire_rate_token(max_wait=0, priority="low"):
+                lb_url = f"https://www.strava.com/api/v3/segments/{segment_id}/leaderboard"
+                lb_response = await client.get(lb_url, headers=headers, params={"per_page": 1}, timeout=10.0)
+                lb_response.raise_for_status()
+                leaderboard = lb_response.json()
 
             last_activity_time = None
             if leaderboard.get("entries") and len(leaderboard["entries"]) > 0:
@@ -383,7 +713,7 @@ async def fetch_segment_details(segment_id: int) -> Optional[Dict]:
             }
 
     except Exception as e:
-        print(f"❌ Errore dettagli segmento {segment_id}: {e}")
+        log.error("❌ Errore dettagli segmento {segment_id}: {error}", segment_id=segment_id, error=e)
         return None
 
 
@@ -432,126 +762,192 @@ def format_duration(seconds: int) -> str:
 # STARRED SEGMENTS
 # ─────────────────────────────────────────
 
-async def fetch_starred_segments() -> List[Dict]:
-    """
-    Recupera i segmenti starred dell'atleta con statistiche complete.
-    Due step: 1) lista starred  2) dettaglio per ogni segmento
-    """
-    cached = get_cache("starred_segments")
-    if cached is not None:
-        return cached
+def _segment_from_detail(seg_id: int, d: Dict) -> Dict:
+    """Segmento completo dal dettaglio /segments/{id}."""
+    # PR personale
+    pr_stats = d.get("athlete_segment_stats", {})
+    pr_time = pr_stats.get("pr_elapsed_time", 0)
+    pr_date = pr_stats.get("pr_date", "")
+    pr_efforts = pr_stats.get("effort_count", 0)
+
+    # Local legend (chi ha percorso di più negli ultimi 90gg)
+    legend = d.get("local_legend", {})
+    legend_name = legend.get("title", "")
+    legend_efforts = legend.get("effort_count", "")
+
+    # KOM
+    xoms = d.get("xoms", {})
 
+    # Coordinate e polyline per visualizzazione su mappa
+    start_ll = d.get("start_latlng", [])
+    end_ll   = d.get("end_latlng", [])
+    polyline = d.get("map", {}).get("polyline", "")
+
+    return {
+        "id": seg_id,
+        "name": d.get("name", ""),
+        "distance_km": round(d.get("distance", 0) / 1000, 2),
+        "avg_grade": d.get("average_grade", 0),
+        "max_grade": d.get("maximum_grade", 0),
+        "elevation_gain": round(d.get("total_elevation_gain", 0)),
+        "effort_count": d.get("effort_count", 0),
+        "athlete_count": d.get("athlete_count", 0),
+        "kom": xoms.get("kom", "N/A"),
+        "elevation_profile": d.get("elevation_profiles", {}).get("light_url", ""),
+        "link": f"https://www.strava.com/segments/{seg_id}",
+        # PR personale
+        "pr_time": format_duration(pr_time) if pr_time else "N/A",
+        "pr_date": pr_date,
+        "pr_efforts": pr_efforts,
+        # Local legend
+        "legend_name": legend_name,
+        "legend_efforts": legend_efforts,
+        # Mappa
+        "start_latlng": start_ll,
+        "end_latlng":   end_ll,
+        "polyline":     polyline,
+    }
+
+
+def _segment_from_base(s: Dict) -> Dict:
+    """Fallback: segmento dai dati base già presenti nella lista starred."""
+    seg_id = s["id"]
+    return {
+        "id":               seg_id,
+        "name":             s.get("name", ""),
+        "distance_km":      round(s.get("distance", 0) / 1000, 2),
+        "avg_grade":        s.get("average_grade", 0),
+        "max_grade":        s.get("maximum_grade", 0),
+        "elevation_gain":   round(s.get("total_elevation_gain", 0)),
+        "effort_count":     s.get("effort_count", 0),
+        "athlete_count":    s.get("athlete_count", 0),
+        "kom":              "N/A",
+        "elevation_profile":"",
+        "link":             f"https://www.strava.com/segments/{seg_id}",
+        "pr_time":          "N/A",
+        "pr_date":          "",
+        "pr_efforts":       0,
+        "legend_name":      "",
+        "legend_efforts":   "",
+        "start_latlng":     s.get("start_latlng", []),
+        "end_latlng":       s.get("end_latlng", []),
+        "polyline":         s.get("map", {}).get("polyline", ""),
+    }
+
+
+async def _fetch_segment_detail(client: httpx.AsyncClient, headers: Dict, seg_id: int,
+                                sem: asyncio.Semaphore, priority: str = "interactive") -> Optional[Dict]:
+    """Dettaglio di un segmento starred; None su errore o quota esaurita."""
+    async with sem:
+        if not await acquire_rate_token(priority=priority):
+            log.warning("  ⏳ Quota Strava in esaurimento — segmento {seg_id} con dati base", seg_id=seg_id)
+            return None
+        try:
+            async with STRAVA_LIMITER:
+                detail_resp = await client.get(
+                    f"https://www.strava.com/api/v3/segments/{seg_id}",
+                    headers=headers,
+                    timeout=10.0
+                )
+            detail_resp.raise_for_status()
+            d = detail_resp.json()
+            log.info("  ✅ {name} - {efforts:,} tentativi", event="strava.segment", name=d.get("name"), efforts=d.get("effort_count", 0))
+            return _segment_from_detail(seg_id, d)
+        except Exception as e:
+            log.warning("  ⚠️ Errore dettaglio segmento {seg_id} — uso dati base: {error}", seg_id=seg_id, error=e)
+            return None
+
+
+async def fetch_starred_list(priority: str = "interactive") -> Optional[List[Dict]]:
+    """Step 1: lista dei segmenti starred (dati base). None se non disponibile."""
     token = await get_valid_token()
     if not token:
-        print("❌ Nessun token valido per starred segments")
-        return []
-
-    print("🔍 Recupero segmenti starred...")
+        log.error("❌ Nessun token valido per starred segments")
+        return None
+    if not await acquire_rate_token(priority=priority):
+        log.warning("⏳ Quota Strava esaurita — salto refresh starred segments")
+        return None
 
     try:
-        async with httpx.AsyncClient(follow_redirects=True) as client:
-            headers = {"Authorization": f"Bearer {token}"}
-
-            # Step 1: Lista ID dei segmenti starred
+        async with strava_http_client() as client, STRAVA_LIMITER:
             resp = await client.get(
                 "https://www.strava.com/api/v3/segments/starred",
-                headers=headers,
+                headers={"Authorization": f"Bearer {token}"},
                 params={"per_page": 50},
                 timeout=10.0
             )
             resp.raise_for_status()
             starred = resp.json()
-            print(f"⭐ Trovati {len(starred)} segmenti starred")
-
-            # Step 2: Dettaglio completo per ogni segmento
-            segments = []
-            for s in starred:
-                seg_id = s["id"]
-                try:
-                    detail_resp = await client.get(
-                        f"https://www.strava.com/api/v3/segments/{seg_id}",
-                        headers=headers,
-                        timeout=10.0
-                    )
-                    detail_resp.raise_for_status()
-                    d = detail_resp.json()
-
-                    # PR personale
-                    pr_stats = d.get("athlete_segment_stats", {})
-                    pr_time = pr_stats.get("pr_elapsed_time", 0)
-                    pr_date = pr_stats.get("pr_date", "")
-                    pr_efforts = pr_stats.get("effort_count", 0)
-
-                    # Local legend (chi ha percorso di più negli ultimi 90gg)
-                    legend = d.get("local_legend", {})
-                    legend_name = legend.get("title", "")
-                    legend_efforts = legend.get("effort_count", "")
-
-                    # KOM
-                    xoms = d.get("xoms", {})
-
-                    # Coordinate e polyline per visualizzazione su mappa
-                    start_ll = d.get("start_latlng", [])
-                    end_ll   = d.get("end_latlng", [])
-                    polyline = d.get("map", {}).get("polyline", "")
-
-                    segments.append({
-                        "id": seg_id,
-                        "name": d.get("name", ""),
-                        "distance_km": round(d.get("distance", 0) / 1000, 2),
-                        "avg_grade": d.get("average_grade", 0),
-                        "max_grade": d.get("maximum_grade", 0),
-                        "elevation_gain": round(d.get("total_elevation_gain", 0)),
-                        "effort_count": d.get("effort_count", 0),
-                        "athlete_count": d.get("athlete_count", 0),
-                        "kom": xoms.get("kom", "N/A"),
-                        "elevation_profile": d.get("elevation_profiles", {}).get("light_url", ""),
-                        "link": f"https://www.strava.com/segments/{seg_id}",
-                        # PR personale
-                        "pr_time": format_duration(pr_time) if pr_time else "N/A",
-                        "pr_date": pr_date,
-                        "pr_efforts": pr_efforts,
-                        # Local legend
-                        "legend_name": legend_name,
-                        "legend_efforts": legend_efforts,
-                        # Mappa
-                        "start_latlng": start_ll,
-                        "end_latlng":   end_ll,
-                        "polyline":     polyline,
-                    })
-
-                    print(f"  ✅ {d.get('name')} - {d.get('effort_count', 0):,} tentativi")
-
-                except Exception as e:
-                    print(f"  ⚠️ Errore dettaglio segmento {seg_id} — uso dati base: {e}")
-                    # Fallback: usa i dati base già disponibili dallo step 1
-                    segments.append({
-                        "id":               seg_id,
-                        "name":             s.get("name", ""),
-                        "distance_km":      round(s.get("distance", 0) / 1000, 2),
-                        "avg_grade":        s.get("average_grade", 0),
-                        "max_grade":        s.get("maximum_grade", 0),
-                        "elevation_gain":   round(s.get("total_elevation_gain", 0)),
-                        "effort_count":     s.get("effort_count", 0),
-                        "athlete_count":    s.get("athlete_count", 0),
-                        "kom":              "N/A",
-                        "elevation_profile":"",
-                        "link":             f"https://www.strava.com/segments/{seg_id}",
-                        "pr_time":          "N/A",
-                        "pr_date":          "",
-                        "pr_efforts":       0,
-                        "legend_name":      "",
-                        "legend_efforts":   "",
-                        "start_latlng":     s.get("start_latlng", []),
-                        "end_latlng":       s.get("end_latlng", []),
-                        "polyline":         s.get("map", {}).get("polyline", ""),
-                    })
-                    continue
-
-            print(f"✅ Recuperati {len(segments)} segmenti con dettagli")
-            set_cache("starred_segments", segments)
-            return segments
+            log.info("⭐ Trovati {n_starred} segmenti starred", n_starred=len(starred))
+            return starred
+    except Exception as e:
+        log.error("❌ Errore lista starred segments: {error}", error=e)
+        return None
+
+
+async def fetch_starred_details(starred: List[Dict], priority: str = "interactive") -> List[Optional[Dict]]:
+    """
+    Step 2: dettaglio completo per i segmenti dati — in parallelo, con
+    concorrenza limitata e token bucket sulle quote Strava.
+    Restituisce una lista allineata a `starred`, con None dove il dettaglio
+    non è disponibile (il chiamante decide il fallback).
+    """
+    if not starred:
+        return []
+    token = await get_valid_token()
+    if not token:
+        return [None] * len(starred)
+
+    async with strava_http_client() as client:
+        headers = {"Authorization": f"Bearer {token}"}
+        sem = asyncio.Semaphore(DETAIL_CONCURRENCY)
+        return await asyncio.gather(*[
+            _fetch_segment_detail(client, headers, s["id"], sem, priority) for s in starred
+        ])
+
+
+async def fetch_starred_segments() -> List[Dict]:
+    """
+    Recupera i segmenti starred dell'atleta con statistiche complete.
+    Due step: 1) lista starred  2) dettaglio per ogni segmento
+    (fallback ai dati base della lista se il dettaglio non è disponibile).
+    Per la cache per-segmento con TTL separati vedi cache.cached_starred_segments.
+    """
+    cached = get_cache("starred_segments")
+    if cached is not None:
+        return cached
+
+    log.info("🔍 Recupero segmenti starred...")
+
+    try:
+        starred = await fetch_starred_list()
+        if not starred:
+            return []
+        details  = await fetch_starred_details(starred)
+        segments = [d or _segment_from_base(s) for s, d in zip(starred, details)]
+
+        log.info("✅ Recuperati {n_segments} segmenti con dettagli", n_segments=len(segments))
+        set_cache("starred_segments", segments)
+        return segments
 
     except Exception as e:
-        print(f"❌ Errore fetch_starred_segments: {e}")
+        log.error("❌ Errore fetch_starred_segments: {error}", error=e)
         return []
+
+
+# Campi che non cambiano mai (geometria, metadati) vs contatori che derivano
+SEGMENT_STATIC_FIELDS = [
+    "id", "name", "distance_km", "avg_grade", "max_grade", "elevation_gain",
+    "elevation_profile", "link", "start_latlng", "end_latlng", "polyline",
+]
+SEGMENT_DYNAMIC_FIELDS = [
+    "effort_count", "athlete_count", "kom", "pr_time", "pr_date", "pr_efforts",
+    "legend_name", "legend_efforts",
+]
+
+
+def split_segment(segment: Dict):
+    """Divide un segmento in (statico, dinamico) per la cache con TTL separati."""
+    static  = {k: segment.get(k) for k in SEGMENT_STATIC_FIELDS}
+    dynamic = {k: segment.get(k) for k in SEGMENT_DYNAMIC_FIELDS}
+    return static, dynamic
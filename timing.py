@@ -0,0 +1,188 @@
+"""
+timing.py — Scomposizione dei tempi di ogni richiesta (header Server-Timing).
+
+Il middleware apre un accumulatore per richiesta (contextvar: lo ereditano
+anche i task creati da asyncio.gather e i thread di asyncio.to_thread) e i
+moduli registrano il tempo speso per categoria:
+
+  cache    : round-trip verso lo storage (storage.pipeline)
+  upstream : chiamate HTTP a Open-Meteo e Strava
+  data     : durata a parete della raccolta dati concorrente (page_data.assemble)
+  render   : rendering Jinja
+  compute  : il resto — total meno il tempo a parete coperto da almeno una
+             delle categorie precedenti
+
+Ogni categoria registra gli intervalli (inizio, fine) e ne riporta l'unione:
+con chiamate in parallelo il tempo a parete, non la somma, così cache e
+upstream non superano mai total. Oltre alle durate l'accumulatore conta i
+comandi storage della richiesta (count("storage_commands"), usato da
+metrics.py, non finisce nell'header). Il risultato finisce nell'header
+Server-Timing (visibile nei devtools del browser) e, per le richieste
+lente, nel log.
+
+Ogni richiesta raccoglie anche una traccia di eventi (trace): lookup cache
+con esito, comandi storage e chiamate upstream con durata, ciascuno con
+l'istante relativo all'inizio della richiesta. Le richieste oltre
+SLOW_REQUEST_MS finiscono, con traccia e scomposizione, in un ring buffer
+delle ultime SLOW_LOG_SIZE (slow_requests(), pagina /admin/lente).
+"""
+
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from datetime import datetime
+from contextlib import contextmanager
+
+from fastapi.templating import Jinja2Templates
+import log
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+LOG_ALL         = os.getenv("SERVER_TIMING_LOG", "") == "1"
+SLOW_LOG_SIZE   = int(os.getenv("SLOW_LOG_SIZE", "50"))
+MAX_TRACE_EVENTS = 300      # per richiesta: oltre si contano solo gli scarti
+CATEGORIES      = ("cache", "upstream", "data", "render")
+
+_current: contextvars.ContextVar = contextvars.ContextVar("server_timing", default=None)
+_trace:   contextvars.ContextVar = contextvars.ContextVar("server_trace", default=None)
+_lock = threading.Lock()
+_slow = deque(maxlen=SLOW_LOG_SIZE)
+
+
+def add(name: str, seconds: float):
+    """Attribuisce a `name` l'intervallo di `seconds` appena concluso (richiesta corrente, se c'è)."""
+    spans = _current.get()
+    if spans is None:
+        return
+    end = time.perf_counter()
+    with _lock:
+        spans.setdefault(name, []).append((end - seconds, end))
+
+
+def count(name: str, n: int = 1):
+    """Incrementa il contatore `name` della richiesta corrente (es. storage_commands)."""
+    spans = _current.get()
+    if spans is None:
+        return
+    with _lock:
+        spans[name] = spans.get(name, 0) + n
+
+
+def trace(kind: str, name: str, **detail):
+    """Aggiunge un evento (cache, storage, upstream...) alla traccia della richiesta corrente."""
+    current = _trace.get()
+    if current is None:
+        return
+    start, events = current
+    with _lock:
+        if len(events) >= MAX_TRACE_EVENTS:
+            events[-1]["dropped"] = events[-1].get("dropped", 0) + 1
+            return
+        events.append({"at_ms": round((time.perf_counter() - start) * 1000, 1), "kind": kind, "name": name, **detail})
+
+
+@contextmanager
+def span(name: str):
+    """Misura il blocco e lo attribuisce a `name`. Funziona sia in codice sync che async."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(name, time.perf_counter() - start)
+
+
+# ─── Template ────────────────────────────────────────────────────────────────
+
+class TimedTemplates(Jinja2Templates):
+    """Jinja2Templates che attribuisce il rendering (fatto nel costruttore della risposta) a "render"."""
+
+    def TemplateResponse(self, *args, **kwargs):
+        with span("render"):
+            return super().TemplateResponse(*args, **kwargs)
+
+
+# ─── Middleware ──────────────────────────────────────────────────────────────
+
+def _union(intervals, lo: float, hi: float) -> float:
+    """Durata dell'unione degli intervalli, ritagliati su [lo, hi]."""
+    covered, cur_start, cur_end = 0.0, None, None
+    for s, e in sorted(intervals):
+        s, e = max(s, lo), min(e, hi)
+        if e <= s:
+            continue
+        if cur_end is None or s > cur_end:
+            if cur_end is not None:
+                covered += cur_end - cur_start
+            cur_start, cur_end = s, e
+        else:
+            cur_end = max(cur_end, e)
+    if cur_end is not None:
+        covered += cur_end - cur_start
+    return covered
+
+
+def durations(spans: dict, start: float, end: float) -> dict:
+    """Tempo a parete per categoria, più compute (il tempo non coperto da nessuna)."""
+    result = {name: _union(spans[name], start, end) for name in CATEGORIES if name in spans}
+    busy   = _union([iv for name in CATEGORIES for iv in spans.get(name, ())], start, end)
+    result["compute"] = (end - start) - busy
+    return result
+
+
+def header_value(durations: dict, total: float) -> str:
+    parts = [f"{name};dur={durations[name] * 1000:.1f}" for name in (*CATEGORIES, "compute") if name in durations]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def slow_requests() -> list:
+    """Ultime richieste lente, dalla più recente."""
+    with _lock:
+        return list(reversed(_slow))
+
+
+def _record_slow(request, status: int, spans: dict, durations: dict, events: list, total: float):
+    route = request.scope.get("route")
+    entry = {
+        "ts":       datetime.now().isoformat(timespec="seconds"),
+        "method":   request.method,
+        "path":     request.url.path,
+        "route":    getattr(route, "path", request.url.path),
+        "status":   status,
+        "total_ms": round(total * 1000, 1),
+        "spans_ms": {k: round(v * 1000, 1) for k, v in durations.items() if k in CATEGORIES},
+        "compute_ms": round(durations["compute"] * 1000, 1),
+        "storage_commands": int(spans.get("storage_commands", 0)),
+        "events":   events,
+    }
+    with _lock:
+        _slow.append(entry)
+
+
+async def server_timing_middleware(request, call_next):
+    spans  = {}
+    events = []
+    request.state.server_timing = spans     # letto anche dal middleware delle metriche
+    start = time.perf_counter()
+    token = _current.set(spans)
+    trace_token = _trace.set((start, events))
+    try:
+        response = await call_next(request)
+    finally:
+        _current.reset(token)
+        _trace.reset(trace_token)
+    end   = time.perf_counter()
+    total = end - start
+
+    with _lock:
+        spent = durations(spans, start, end)
+    value = header_value(spent, total)
+    response.headers["Server-Timing"] = value
+    if not request.url.path.startswith("/static"):
+        if total * 1000 >= SLOW_REQUEST_MS:
+            _record_slow(request, response.status_code, spans, spent, events, total)
+        if LOG_ALL or total * 1000 >= SLOW_REQUEST_MS:
+            log.info("⏱️ {method} {path} {status_code} — {value}",
+                     method=request.method, path=request.url.path, status_code=response.status_code, value=value)
+    return response
@@ -0,0 +1,155 @@
+"""
+upstash_emulator.py — Emulatore locale dell'API REST di Upstash.
+
+Implementa il sottoinsieme del protocollo usato dall'app, sopra lo store
+in-process di storage.py (GET, SET, EXPIRE, INCR, ZADD, ZRANGE, ZCOUNT,
+KEYS, TTL, DEL, ...):
+
+  POST /pipeline          [["SET","k","v"], ["GET","k"]] → [{"result": ...}, ...]
+  POST /                  ["GET","k"]                    → {"result": ...}
+  GET  /<cmd>/<arg>/...   stile path (es. /incr/visits:total)
+
+Latenza ed errori iniettabili, per misurare l'app con un Redis realistico
+ma completamente offline:
+
+  python upstash_emulator.py --port 8079 --latency-ms 25 --jitter-ms 10 --error-rate 0.02
+
+poi avviare l'app con
+  UPSTASH_REDIS_REST_URL=http://127.0.0.1:8079 UPSTASH_REDIS_REST_TOKEN=local
+
+La configurazione si può cambiare a caldo con POST /_emulator/config
+({"latency_ms": 50, "error_rate": 0.1, "fail_commands": ["ZADD"]});
+GET /_emulator/stats restituisce richieste e comandi serviti.
+"""
+
+import os
+import random
+import asyncio
+import argparse
+from collections import Counter
+
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse
+
+from storage import MemoryBackend
+
+app = FastAPI(title="Upstash emulator")
+
+_store  = MemoryBackend()
+_config = {
+    "token":         os.getenv("EMULATOR_TOKEN", ""),   # vuoto = accetta qualsiasi token
+    "latency_ms":    float(os.getenv("EMULATOR_LATENCY_MS", "0")),
+    "jitter_ms":     float(os.getenv("EMULATOR_JITTER_MS", "0")),
+    "error_rate":    float(os.getenv("EMULATOR_ERROR_RATE", "0")),   # quota di richieste → HTTP 503
+    "fail_commands": [],                                             # comandi che rispondono {"error": ...}
+}
+_stats = {"requests": 0, "errors_injected": 0, "commands": Counter()}
+
+
+def _check_auth(request: Request):
+    if not _config["token"]:
+        return
+    if request.headers.get("Authorization", "") != f"Bearer {_config['token']}":
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+
+async def _simulate_network():
+    """Latenza (con jitter) ed eventuale errore iniettato, come un Upstash remoto."""
+    _stats["requests"] += 1
+    delay = _config["latency_ms"] + random.uniform(0, _config["jitter_ms"])
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+    if _config["error_rate"] and random.random() < _config["error_rate"]:
+        _stats["errors_injected"] += 1
+        raise HTTPException(status_code=503, detail="Injected error")
+
+
+def _execute(commands: list) -> list:
+    out = []
+    for cmd in commands:
+        op = str(cmd[0]).upper() if cmd else ""
+        _stats["commands"][op] += 1
+        if op in _config["fail_commands"]:
+            out.append({"error": f"ERR injected failure for {op}"})
+        else:
+            out.extend(_store.pipeline([cmd]))
+    return out
+
+
+@app.post("/pipeline")
+async def pipeline(request: Request):
+    _check_auth(request)
+    await _simulate_network()
+    commands = await request.json()
+    if not isinstance(commands, list) or not all(isinstance(c, list) and c for c in commands):
+        return JSONResponse({"error": "ERR pipeline body must be an array of commands"}, status_code=400)
+    return _execute(commands)
+
+
+@app.get("/_emulator/stats")
+async def emulator_stats():
+    return {**_stats, "commands": dict(_stats["commands"]), "config": {k: v for k, v in _config.items() if k != "token"}}
+
+
+@app.post("/_emulator/config")
+async def emulator_config(request: Request):
+    body = await request.json()
+    for k in ("latency_ms", "jitter_ms", "error_rate"):
+        if k in body:
+            _config[k] = float(body[k])
+    if "fail_commands" in body:
+        _config["fail_commands"] = [c.upper() for c in body["fail_commands"]]
+    return {k: v for k, v in _config.items() if k != "token"}
+
+
+@app.post("/_emulator/flush")
+async def emulator_flush():
+    global _store
+    _store = MemoryBackend()
+    _stats.update({"requests": 0, "errors_injected": 0, "commands": Counter()})
+    return {"ok": True}
+
+
+@app.post("/")
+async def single_command(request: Request):
+    _check_auth(request)
+    await _simulate_network()
+    cmd = await request.json()
+    if not isinstance(cmd, list) or not cmd:
+        return JSONResponse({"error": "ERR command must be a non-empty array"}, status_code=400)
+    result = _execute([cmd])[0]
+    return JSONResponse(result, status_code=400 if "error" in result else 200)
+
+
+@app.get("/{path:path}")
+async def path_command(path: str, request: Request):
+    _check_auth(request)
+    await _simulate_network()
+    cmd = [p for p in path.split("/") if p]
+    if not cmd:
+        return JSONResponse({"error": "ERR empty command"}, status_code=400)
+    result = _execute([cmd])[0]
+    return JSONResponse(result, status_code=400 if "error" in result else 200)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Emulatore locale Upstash REST")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8079)
+    parser.add_argument("--token", default=_config["token"])
+    parser.add_argument("--latency-ms", type=float, default=_config["latency_ms"])
+    parser.add_argument("--jitter-ms", type=float, default=_config["jitter_ms"])
+    parser.add_argument("--error-rate", type=float, default=_config["error_rate"])
+    args = parser.parse_args()
+
+    _config.update({
+        "token":      args.token,
+        "latency_ms": args.latency_ms,
+        "jitter_ms":  args.jitter_ms,
+        "error_rate": args.error_rate,
+    })
+    print(f"🧪 Upstash emulator su http://{args.host}:{args.port} "
+          f"(latenza {args.latency_ms:.0f}±{args.jitter_ms:.0f}ms, errori {args.error_rate:.0%})")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,400 @@
+"""
+upstream.py — Protezioni per le chiamate agli upstream (Open-Meteo, Upstash).
+
+Circuit breaker per host: dopo BREAKER_FAILURES errori consecutivi (eccezione,
+timeout, status 5xx o 429) il circuito si apre e per BREAKER_OPEN_SECONDS le
+chiamate falliscono subito con CircuitOpen, invece di aspettare ogni volta il
+timeout. Poi passa una sola richiesta di prova (half-open): se va bene il
+circuito si richiude, altrimenti resta aperto un altro giro. Chi chiama
+gestisce CircuitOpen come qualunque errore upstream (cache stale-if-error,
+fallback delle pagine).
+
+Richieste "hedged" per le GET idempotenti degli host in HEDGE_HOSTS (default
+solo il forecast Open-Meteo; l'Archive API ha già problemi di 429): se la
+prima richiesta non ha risposto entro il p95 delle latenze recenti dell'host,
+ne parte una seconda identica e vince la prima che risponde. La seconda
+conta nelle richieste in corso del limiter dell'host, se ne ha uno.
+
+Limite di concorrenza adattivo (AIMD) per host, es. Archive API: ogni
+risposta buona alza il limite di 1/limite (≈ +1 ogni "giro" di richieste),
+un 429/503 o un timeout lo dimezza (una volta per richiesta, anche se
+ritentata, e al massimo una volta per LIMIT_DECREASE_COOLDOWN, così una
+raffica di errori conta una volta sola). I 429/503 li segnala get(), i
+timeout l'uscita dal limiter.
+Un 429/503 con Retry-After sospende anche le nuove richieste verso l'host per
+quel tempo; la richiesta viene ritentata dopo Retry-After + jitter, fino a
+`retries` volte e senza mai attendere più di RETRY_MAX_WAIT.
+
+Lo stesso limiter fa da scheduler con priorità: ogni chiamata appartiene a
+una classe (contextvar, default "interactive"):
+
+  interactive : richieste dei visitatori
+  prefetch    : refresh in background della cache (stale-while-revalidate)
+  maintenance : job periodici (stato del terreno, ...)
+
+Ogni host ha una coda per classe. Un posto libero va sempre alla classe più
+alta in attesa (FIFO dentro la classe), e le classi basse possono occupare
+solo una parte dei posti (PRIORITY_SHARE): una raffica di prefetch non
+lascia mai un visitatore in coda dietro di sé.
+
+  BREAKER_FAILURES=5  BREAKER_OPEN_SECONDS=30
+  HEDGE_HOSTS=api.open-meteo.com   (vuoto = disattivato)
+  ARCHIVE_MAX_CONCURRENCY=8
+
+Metriche: upstream_circuit_state{host} (0 chiuso, 1 half-open, 2 aperto),
+upstream_circuit_rejections_total{host}, upstream_hedges_total{host, outcome},
+upstream_concurrency_limit{host}, upstream_in_flight{host},
+upstream_retries_total{host, status}, upstream_queue_depth{host, priority},
+upstream_queue_wait_seconds{host, priority}.
+"""
+
+import os
+import time
+import random
+import asyncio
+import threading
+import contextvars
+from collections import deque
+
+import httpx
+
+import metrics
+import log
+
+BREAKER_FAILURES     = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+HEDGE_HOSTS          = {h.strip() for h in os.getenv("HEDGE_HOSTS", "api.open-meteo.com").split(",") if h.strip()}
+HEDGE_QUANTILE       = 0.95
+HEDGE_MIN_SAMPLES    = 20       # sotto questa soglia di campioni si usa HEDGE_DEFAULT_DELAY
+HEDGE_DEFAULT_DELAY  = 1.0
+HEDGE_MIN_DELAY      = 0.05
+LIMIT_DECREASE_COOLDOWN = 1.0
+RETRY_BASE_DELAY     = 0.5      # senza Retry-After: 0.5s, 1s, 2s... più jitter
+RETRY_MAX_WAIT       = 10.0
+OVERLOAD_STATUS      = (429, 503)
+
+PRIORITIES     = ("interactive", "prefetch", "maintenance")
+PRIORITY_SHARE = {"interactive": 1.0, "prefetch": 0.75, "maintenance": 0.5}   # frazione del limite usabile
+
+_priority: contextvars.ContextVar = contextvars.ContextVar("upstream_priority", default="interactive")
+
+
+def set_priority(name: str):
+    """Classe delle chiamate upstream fatte dal task/contesto corrente."""
+    _priority.set(name if name in PRIORITY_SHARE else "interactive")
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(Exception):
+    """L'upstream è considerato giù: la chiamata non viene nemmeno tentata."""
+
+
+class CircuitBreaker:
+    """Stato del circuito di un host. Thread-safe: lo usa anche lo storage (sync)."""
+
+    def __init__(self, host: str):
+        self.host       = host
+        self.state      = CLOSED
+        self.failures   = 0
+        self.opened_at  = 0.0
+        self.probing    = False
+        self._lock      = threading.Lock()
+
+    def allow(self):
+        """Solleva CircuitOpen se la chiamata non va tentata."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= BREAKER_OPEN_SECONDS:
+                self.state, self.probing = HALF_OPEN, False
+            if self.state == CLOSED:
+                return
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True       # una sola richiesta di prova
+                return
+        CIRCUIT_REJECTIONS.inc(host=self.host)
+        raise CircuitOpen(f"circuito aperto per {self.host}")
+
+    def success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                log.info("🟢 Circuito {host} richiuso", host=self.host)
+            self.state, self.failures, self.probing = CLOSED, 0, False
+
+    def abandon(self):
+        """Chiamata annullata (es. budget della pagina scaduto): né successo né errore."""
+        with self._lock:
+            self.probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= BREAKER_FAILURES:
+                if self.state != OPEN:
+                    log.warning("🔴 Circuito {host} aperto dopo {failures} errori: fail-fast per {seconds:g}s",
+                                host=self.host, failures=self.failures, seconds=BREAKER_OPEN_SECONDS)
+                self.state, self.opened_at, self.probing = OPEN, time.monotonic(), False
+
+
+class AdaptiveLimiter:
+    """
+    Limite di richieste contemporanee che si adatta alle risposte (AIMD), con
+    una coda per classe di priorità. Si usa come `async with limiter:` attorno
+    alla chiamata: un'uscita senza eccezioni con il limite saturo lo alza, un timeout
+    come segnale di backoff (i 429/503 li ha già segnalati get()). Vive nell'event loop (non thread-safe).
+    Con minimum == maximum il limite è fisso.
+    """
+
+    def __init__(self, host: str, initial: int = 2, minimum: int = 1, maximum: int = 8):
+        self.host, self.minimum, self.maximum = host, minimum, maximum
+        self.limit         = float(initial)
+        self.in_flight     = 0
+        self.paused_until  = 0.0
+        self.last_decrease = 0.0
+        self._queues       = {p: [] for p in PRIORITIES}    # biglietti in attesa, in ordine di arrivo
+
+    def _can_run(self, cls: str, ticket: dict = None) -> bool:
+        if time.monotonic() < self.paused_until:
+            return False
+        if self.in_flight >= max(1, int(self.limit * PRIORITY_SHARE[cls])):
+            return False
+        if any(self._queues[p] for p in PRIORITIES[:PRIORITIES.index(cls)]):
+            return False          # c'è qualcuno più prioritario in coda
+        queue = self._queues[cls]
+        return not queue or queue[0] is ticket
+
+    async def __aenter__(self):
+        cls   = current_priority()
+        start = time.monotonic()
+        if not self._can_run(cls):
+            ticket = {"fut": None}
+            self._queues[cls].append(ticket)
+            try:
+                while not self._can_run(cls, ticket):
+                    ticket["fut"] = asyncio.get_running_loop().create_future()
+                    now = time.monotonic()
+                    try:
+                        # Sveglia al rilascio di un posto o alla fine della pausa Retry-After
+                        await asyncio.wait_for(ticket["fut"], self.paused_until - now if now < self.paused_until else None)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self._queues[cls].remove(ticket)
+                self._wake()      # il prossimo in coda ricontrolla
+        self.in_flight += 1
+        QUEUE_WAIT.observe(time.monotonic() - start, host=self.host, priority=cls)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # Si alza il limite solo se era davvero il vincolo (tutti i posti occupati o
+        # qualcuno in coda): con poco traffico crescerebbe fino al massimo senza
+        # che nessuna concorrenza più alta sia mai stata provata sull'upstream
+        saturated = self.in_flight >= int(self.limit) or any(self._queues.values())
+        self.in_flight -= 1
+        if exc is None and saturated:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        elif is_overload(exc) and not isinstance(exc, httpx.HTTPStatusError):
+            self.overloaded()     # 429/503: già segnalati da get() alla risposta
+        self._wake()
+        return False
+
+    def overloaded(self, retry_after: float = 0.0, decrease: bool = True):
+        """
+        Segnale di sovraccarico: dimezza il limite e, con Retry-After, sospende le nuove
+        richieste. decrease=False per i tentativi successivi della stessa richiesta: solo pausa.
+        """
+        now = time.monotonic()
+        if decrease and now - self.last_decrease >= LIMIT_DECREASE_COOLDOWN:
+            self.limit, self.last_decrease = max(self.minimum, self.limit / 2), now
+            log.warning("🐌 {host}: concorrenza ridotta a {limit}", host=self.host, limit=int(self.limit))
+        if retry_after > 0:
+            self.paused_until = max(self.paused_until, now + retry_after)
+
+    def occupy(self, task: asyncio.Future):
+        """Conta `task` tra le richieste in corso fino alla sua fine, senza coda (seconde richieste hedged)."""
+        self.in_flight += 1
+
+        def release(_):
+            self.in_flight -= 1
+            self._wake()
+        task.add_done_callback(release)
+
+    def _wake(self):
+        for queue in self._queues.values():
+            for ticket in queue:
+                if ticket["fut"] is not None and not ticket["fut"].done():
+                    ticket["fut"].set_result(None)
+
+
+_breakers: dict = {}
+_limiters: dict = {}
+_latencies: dict = {}       # host → ultime latenze delle risposte buone (per il p95)
+_lock = threading.Lock()
+
+
+def breaker(host: str) -> CircuitBreaker:
+    with _lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(host)
+        return _breakers[host]
+
+
+def limiter(host: str, **kwargs) -> AdaptiveLimiter:
+    """Limiter adattivo dell'host (creato al primo uso con i kwargs dati)."""
+    if host not in _limiters:
+        _limiters[host] = AdaptiveLimiter(host, **kwargs)
+    return _limiters[host]
+
+
+def is_failure(status_code: int) -> bool:
+    return status_code >= 500 or status_code == 429
+
+
+def is_overload(exc: BaseException) -> bool:
+    """Errori che indicano un upstream sovraccarico: 429/503 e timeout."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in OVERLOAD_STATUS
+    return isinstance(exc, httpx.TimeoutException)
+
+
+def retry_after(response: httpx.Response, attempt: int) -> float:
+    """Secondi da attendere: header Retry-After (secondi o data HTTP), altrimenti backoff esponenziale."""
+    value = response.headers.get("Retry-After")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            from email.utils import parsedate_to_datetime
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    return RETRY_BASE_DELAY * 2 ** attempt
+
+
+def _hedge_delay(host: str) -> float:
+    with _lock:
+        samples = sorted(_latencies.get(host, ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    return max(HEDGE_MIN_DELAY, samples[min(len(samples) - 1, int(HEDGE_QUANTILE * len(samples)))])
+
+
+def _record_latency(host: str, seconds: float):
+    with _lock:
+        _latencies.setdefault(host, deque(maxlen=200)).append(seconds)
+
+
+async def _timed_get(client: httpx.AsyncClient, host: str, url: str, **kwargs) -> httpx.Response:
+    start = time.perf_counter()
+    response = await client.get(url, **kwargs)
+    if not is_failure(response.status_code):
+        _record_latency(host, time.perf_counter() - start)
+    return response
+
+
+async def _hedged(client: httpx.AsyncClient, host: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Prima richiesta; se oltre il p95 ne parte una seconda. Vince la prima risposta non fallita.
+    La seconda occupa un posto nel limiter dell'host (se c'è) finché non termina.
+    """
+    first   = asyncio.ensure_future(_timed_get(client, host, url, **kwargs))
+    pending = {first}
+    error   = None
+    try:
+        done, _ = await asyncio.wait(pending, timeout=_hedge_delay(host))
+        if done:
+            return first.result()
+
+        HEDGES.inc(host=host, outcome="sent")
+        second = asyncio.ensure_future(_timed_get(client, host, url, **kwargs))
+        if host in _limiters:
+            _limiters[host].occupy(second)
+        pending = {first, second}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                response = task.result()
+                if is_failure(response.status_code) and pending:
+                    continue          # aspetta l'altra prima di arrendersi
+                if task is second:
+                    HEDGES.inc(host=host, outcome="won")
+                return response
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def get(host: str, url: str, hedge: bool = None, retries: int = 0, **kwargs) -> httpx.Response:
+    """
+    GET verso un upstream protetta dal circuit breaker dell'host (ed eventualmente hedged).
+    Solleva CircuitOpen senza fare richieste se il circuito è aperto.
+    Su 429/503 ritenta fino a `retries` volte rispettando Retry-After (+ jitter)
+    e avvisa il limiter adattivo dell'host, se esiste (un dimezzamento per chiamata).
+    """
+    cb = breaker(host)
+    cb.allow()
+    if hedge is None:
+        hedge = host in HEDGE_HOSTS
+    try:
+        async with httpx.AsyncClient() as client:
+            reported = False
+            for attempt in range(retries + 1):
+                if hedge:
+                    response = await _hedged(client, host, url, **kwargs)
+                else:
+                    response = await _timed_get(client, host, url, **kwargs)
+                if response.status_code not in OVERLOAD_STATUS:
+                    break
+                wait = retry_after(response, attempt)
+                if host in _limiters:
+                    _limiters[host].overloaded(wait, decrease=not reported)
+                    reported = True
+                if attempt == retries or wait > RETRY_MAX_WAIT:
+                    break
+                RETRIES.inc(host=host, status=response.status_code)
+                # Jitter: i client che hanno ricevuto lo stesso Retry-After non ripartono insieme
+                await asyncio.sleep(wait + random.uniform(0, max(wait, RETRY_BASE_DELAY) / 2))
+    except asyncio.CancelledError:
+        cb.abandon()
+        raise
+    except Exception:
+        cb.failure()
+        raise
+    if is_failure(response.status_code):
+        cb.failure()
+    else:
+        cb.success()
+    return response
+
+
+# ─── Metriche ────────────────────────────────────────────────────────────────
+
+CIRCUIT_STATE = metrics.Gauge(
+    "upstream_circuit_state", "Stato del circuit breaker per host (0 chiuso, 1 half-open, 2 aperto)", ("host",),
+    fn=lambda: {(host, ): _STATE_VALUE[cb.state] for host, cb in list(_breakers.items())})
+CIRCUIT_REJECTIONS = metrics.Counter(
+    "upstream_circuit_rejections_total", "Chiamate rifiutate a circuito aperto", ("host",))
+RETRIES = metrics.Counter(
+    "upstream_retries_total", "Richieste ritentate dopo 429/503", ("host", "status"))
+CONCURRENCY_LIMIT = metrics.Gauge(
+    "upstream_concurrency_limit", "Limite di concorrenza adattivo per host", ("host",),
+    fn=lambda: {(host, ): round(lim.limit, 2) for host, lim in list(_limiters.items())})
+IN_FLIGHT = metrics.Gauge(
+    "upstream_in_flight", "Richieste in corso sotto limiter adattivo", ("host",),
+    fn=lambda: {(host, ): lim.in_flight for host, lim in list(_limiters.items())})
+QUEUE_DEPTH = metrics.Gauge(
+    "upstream_queue_depth", "Chiamate in coda per host e classe di priorità", ("host", "priority"),
+    fn=lambda: {(host, p): len(q) for host, lim in list(_limiters.items()) for p, q in lim._queues.items()})
+QUEUE_WAIT = metrics.Histogram(
+    "upstream_queue_wait_seconds", "Attesa in coda prima della chiamata upstream", ("host", "priority"))
+HEDGES = metrics.Counter(
+    "upstream_hedges_total", "Richieste hedged: sent = seconda richiesta partita, won = ha risposto prima", ("host", "outcome"))
@@ -1,6 +1,8 @@
-import httpx
 from datetime import datetime, timedelta
 
+from metrics import track_upstream
+import upstream
+
 BASE_URL     = "https://api.open-meteo.com/v1/forecast"
 ARCHIVE_URL  = "https://archive-api.open-meteo.com/v1/archive"
 
@@ -13,8 +15,8 @@ async def fetch_weather(lat: float, lon: float):
         "forecast_days": 3,
         "timezone": "Europe/Rome"
     }
-    async with httpx.AsyncClient() as client:
-        response = await client.get(BASE_URL, params=params, timeout=10.0)
+    with track_upstream("api.open-meteo.com"):
+        response = await upstream.get("api.open-meteo.com", BASE_URL, params=params, timeout=10.0)
         response.raise_for_status()
         return response.json()
 
@@ -37,7 +39,7 @@ async def fetch_weather_history(lat: float, lon: float, days: int = 14):
         "daily": "precipitation_sum,temperature_2m_max,temperature_2m_min,windspeed_10m_max",
         "timezone": "Europe/Rome"
     }
-    async with httpx.AsyncClient() as client:
-        response = await client.get(ARCHIVE_URL, params=params, timeout=15.0)
+    with track_upstream("archive-api.open-meteo.com"):
+        response = await upstream.get("archive-api.open-meteo.com", ARCHIVE_URL, params=params, timeout=15.0, retries=3)
         response.raise_for_status()
         return response.json()
@@ -0,0 +1,120 @@
+"""
+zone_index.py — Indice spaziale delle zone geologiche (Voronoi rasterizzato).
+
+Invece di scorrere tutte le zone per ogni punto (O(zone) per lookup), la
+bounding box del Parco viene divisa in una griglia regolare: ogni cella
+contiene l'indice della zona più vicina al suo centro. Il lookup di un punto
+diventa quindi due divisioni intere + un accesso ad array, indipendentemente
+dal numero di zone.
+
+Risoluzione di default: 0.001° (~110m in lat, ~85m in lon). L'errore massimo
+sul confine tra due zone è mezza cella — trascurabile rispetto all'incertezza
+dei parametri geologici stessi.
+
+Distanza: equirettangolare (lon scalata per cos(lat)), così le celle ai bordi
+non vengono assegnate in modo sbilanciato verso est/ovest.
+"""
+
+import math
+from array import array
+
+CELL_DEG = 0.001
+
+
+def build_zone_index(zones: dict, bbox: dict, cell_deg: float = CELL_DEG) -> dict:
+    """
+    Costruisce il raster Voronoi delle zone sulla bbox data.
+    bbox nel formato di CASTELLI_BBOX (lat_sud, lat_nord, lon_ovest, lon_est).
+    Costo una tantum: celle × zone (~300k operazioni per 6 zone).
+    """
+    keys    = list(zones.keys())
+    lat0    = bbox["lat_sud"]
+    lon0    = bbox["lon_ovest"]
+    rows    = int(math.ceil((bbox["lat_nord"] - lat0) / cell_deg))
+    cols    = int(math.ceil((bbox["lon_est"] - lon0) / cell_deg))
+    kx      = math.cos(math.radians((bbox["lat_sud"] + bbox["lat_nord"]) / 2))
+    centers = [(zones[k]["lat"], zones[k]["lon"] * kx) for k in keys]
+
+    # 'H' = unsigned short: fino a 65535 zone, 2 byte per cella
+    grid = array("H", bytes(2 * rows * cols))
+    for r in range(rows):
+        clat = lat0 + (r + 0.5) * cell_deg
+        base = r * cols
+        for c in range(cols):
+            clon = (lon0 + (c + 0.5) * cell_deg) * kx
+            best_i, best_d = 0, float("inf")
+            for i, (zlat, zlon) in enumerate(centers):
+                d = (clat - zlat) ** 2 + (clon - zlon) ** 2
+                if d < best_d:
+                    best_i, best_d = i, d
+            grid[base + c] = best_i
+
+    return {
+        "keys":     keys,
+        "centers":  centers,
+        "kx":       kx,
+        "lat0":     lat0,
+        "lon0":     lon0,
+        "rows":     rows,
+        "cols":     cols,
+        "cell_deg": cell_deg,
+        "grid":     grid,
+    }
+
+
+def lookup_zone(index: dict, lat: float, lon: float) -> str:
+    """
+    Chiave della zona più vicina al punto. O(1) dentro la bbox;
+    fuori bbox ricade sulla scansione lineare dei centri (caso raro).
+    """
+    # floor, non int(): int() tronca verso zero e porterebbe nella prima
+    # riga/colonna i punti fino a una cella a sud/ovest della bbox
+    r = math.floor((lat - index["lat0"]) / index["cell_deg"])
+    c = math.floor((lon - index["lon0"]) / index["cell_deg"])
+    if 0 <= r < index["rows"] and 0 <= c < index["cols"]:
+        return index["keys"][index["grid"][r * index["cols"] + c]]
+
+    x = lon * index["kx"]
+    best = min(
+        range(len(index["centers"])),
+        key=lambda i: (lat - index["centers"][i][0]) ** 2 + (x - index["centers"][i][1]) ** 2,
+    )
+    return index["keys"][best]
+
+
+def _haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp     = p2 - p1
+    dl     = math.radians(lon2 - lon1)
+    a      = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * 6371.0 * math.asin(math.sqrt(a))
+
+
+def track_zone_shares(index: dict, coords: list) -> list:
+    """
+    Attribuisce ogni tratto del percorso alla zona del suo punto iniziale e
+    restituisce la lunghezza per zona, ordinata dalla zona prevalente:
+      [{"key": "faete", "km": 4.2, "share": 0.61}, ...]
+    coords: [[lat, lon], ...] come in _GPX_CACHE.
+    """
+    if not coords:
+        return []
+
+    km_by_zone = {}
+    if len(coords) == 1:
+        km_by_zone[lookup_zone(index, *coords[0])] = 0.0
+    for (lat1, lon1), (lat2, lon2) in zip(coords, coords[1:]):
+        key = lookup_zone(index, lat1, lon1)
+        km_by_zone[key] = km_by_zone.get(key, 0.0) + _haversine_km(lat1, lon1, lat2, lon2)
+
+    total = sum(km_by_zone.values())
+    shares = [
+        {
+            "key":   k,
+            "km":    round(km, 2),
+            "share": round(km / total, 3) if total > 0 else round(1 / len(km_by_zone), 3),
+        }
+        for k, km in km_by_zone.items()
+    ]
+    shares.sort(key=lambda s: s["share"], reverse=True)
+    return shares